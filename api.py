@@ -2,37 +2,126 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+import asyncio
 import logging
 import secrets
-import calendar
 import time as time_module
-from fastapi import Depends, FastAPI, HTTPException, status, Request, Header
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, status, Request, Header, Response
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-from sqlalchemy.orm import Session, joinedload
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, joinedload, selectinload
 from typing import List, Optional
 from datetime import date, datetime, time, timedelta
-from zoneinfo import ZoneInfo
 
 import models
-from database import SessionLocal, engine
-from config import ADMIN_USERNAME, ADMIN_PASSWORD, SUPER_ADMIN_USERNAME, SUPER_ADMIN_PASSWORD
-
-# Создаем таблицы
+import availability
+import migrations
+from cache import LRUCache
+from metrics import registry as metrics_registry, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from salon_events import publish_salons_changed, publish_catalog_changed
+import tracing
+from log_config import setup_logging, log_payload
+from database import SessionLocal, AsyncSessionLocal, engine, async_engine, pool_stats, QueryStats, current_query_stats
+from config import ADMIN_USERNAME, ADMIN_PASSWORD, SUPER_ADMIN_USERNAME, SUPER_ADMIN_PASSWORD, SALON_CACHE_SIZE, SALON_CACHE_TTL, USE_ASYNC_DB
+
+# Создаем таблицы и догоняем схему существующей БД
 models.Base.metadata.create_all(bind=engine)
+migrations.run_migrations(engine)
+
+setup_logging("api")
+tracing.configure("api")
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
+# --- Метрики (GET /metrics) ---
+REQUEST_LATENCY = metrics_registry.histogram("api_request_duration_seconds", "Время обработки запроса API", ("method", "route"))
+REQUESTS = metrics_registry.counter("api_requests_total", "Запросы API по статусу ответа", ("method", "route", "status"))
+DB_QUERIES = metrics_registry.counter("api_db_queries_total", "SQL-запросы, выполненные при обработке запросов API", ("route",))
+IN_FLIGHT = metrics_registry.gauge("api_requests_in_flight", "Запросы API в обработке")
+BOOKING_CONFLICTS = metrics_registry.counter("api_booking_conflicts_total", "Отказы 409: время уже занято", ("check",))
+
+def route_label(scope: dict) -> str:
+    # Шаблон маршрута, а не путь: иначе каждый id дает новый временной ряд
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+def incoming_trace_id(value: Optional[str]) -> Optional[str]:
+    # Заголовок попадает в логи как есть - принимаем только короткий id без спецсимволов
+    if value and len(value) <= 64 and value.replace("-", "").isalnum():
+        return value
+    return None
+
+# --- Число SQL-запросов и время БД на каждый запрос (видно в DevTools: Server-Timing) ---
+# X-Correlation-ID от бота (или новый) - в логах, спанах и заголовке ответа
+@app.middleware("http")
+async def query_timing_middleware(request: Request, call_next):
+    stats = QueryStats(request.scope)
+    token = current_query_stats.set(stats)
+    started = time_module.perf_counter()
+    IN_FLIGHT.inc()
+    status_code = 500
+    with tracing.trace(incoming_trace_id(request.headers.get(tracing.TRACE_HEADER))) as trace_id, \
+            tracing.span("request", parent_id=incoming_trace_id(request.headers.get(tracing.PARENT_HEADER)),
+                         method=request.method) as span:
+        try:
+            response = await call_next(request)
+            status_code = response.status_code
+        finally:
+            current_query_stats.reset(token)
+            IN_FLIGHT.dec()
+            elapsed = time_module.perf_counter() - started
+            route = route_label(request.scope)
+            REQUEST_LATENCY.observe(elapsed, method=request.method, route=route)
+            REQUESTS.inc(method=request.method, route=route, status=status_code)
+            DB_QUERIES.inc(stats.count, route=route)
+            span.set(route=route, status=status_code, db_queries=stats.count, db_ms=round(stats.total * 1000, 3))
+    response.headers["Server-Timing"] = (
+        f'db;dur={stats.total * 1000:.1f};desc="{stats.count} queries", app;dur={elapsed * 1000:.1f}'
+    )
+    response.headers[tracing.TRACE_HEADER] = trace_id
+    return response
+
 # --- Dependency БД ---
 def get_db():
     db = SessionLocal()
     try: yield db
     finally: db.close()
 
+# --- Запись без пересечений ---
+# Пересечения записей мастера запрещает ограничение в БД (migrations.install_overlap_guard):
+# одна вставка вместо count() + insert, и две одновременные брони одного слота
+# не проходят обе. Проверка запросом остается, только если ограничения нет.
+def check_overlap(db: Session, master_id: int, start_time: datetime, end_time: datetime, exclude_id: Optional[int] = None):
+    if migrations.overlap_guard_installed: return
+    q = db.query(models.Appointment).filter(models.Appointment.master_id == master_id, models.Appointment.start_time < end_time, models.Appointment.end_time > start_time)
+    if exclude_id is not None: q = q.filter(models.Appointment.id != exclude_id)
+    if q.count() > 0:
+        raise booking_conflict("precheck")
+
+def booking_conflict(check: str) -> HTTPException:
+    """409 "Time booked"; check - кто поймал пересечение: ограничение БД или проверка запросом"""
+    BOOKING_CONFLICTS.inc(check=check)
+    return HTTPException(409, "Time booked")
+
+def is_overlap_violation(e: IntegrityError) -> bool:
+    return models.APPOINTMENT_OVERLAP_GUARD in str(e.orig)
+
+def commit_booking(db: Session):
+    try:
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        if is_overlap_violation(e): raise booking_conflict("db_constraint")
+        raise
+
 # ==========================================
 #              АВТОРИЗАЦИЯ
 # ==========================================
@@ -45,10 +134,25 @@ def authenticate_super_admin(credentials: HTTPBasicCredentials = Depends(securit
         raise HTTPException(status_code=401, headers={"WWW-Authenticate": "Basic"})
     return credentials.username
 
+# Кэш снимков салонов: экономит запрос к salons на каждом вызове API.
+# Отсутствующие салоны не кэшируются.
+salons_by_token = LRUCache(maxsize=SALON_CACHE_SIZE, ttl=SALON_CACHE_TTL)
+salons_by_login = LRUCache(maxsize=SALON_CACHE_SIZE, ttl=SALON_CACHE_TTL)
+
+def invalidate_salon_auth(*keys: str):
+    """Сбрасывает кэш авторизации по токенам и логинам салона"""
+    for key in keys:
+        salons_by_token.pop(key); salons_by_login.pop(key)
+
 def authenticate_salon_admin(credentials: HTTPBasicCredentials = Depends(security), db: Session = Depends(get_db)):
     if credentials.username == SUPER_ADMIN_USERNAME and credentials.password == SUPER_ADMIN_PASSWORD:
         pass 
-    salon = db.query(models.Salon).filter(models.Salon.name == credentials.username).first()
+    salon = salons_by_login.get(credentials.username)
+    if salon is None:
+        db_salon = db.query(models.Salon).filter(models.Salon.name == credentials.username).first()
+        if db_salon:
+            salon = models.SalonSnapshot.from_model(db_salon)
+            salons_by_login.set(credentials.username, salon)
     if not salon or salon.admin_password != credentials.password:
         raise HTTPException(status_code=401, headers={"WWW-Authenticate": "Basic"})
     if not salon.is_active:
@@ -58,9 +162,13 @@ def authenticate_salon_admin(credentials: HTTPBasicCredentials = Depends(securit
 def get_current_salon(x_salon_token: str = Header(None), db: Session = Depends(get_db)):
     if not x_salon_token:
         raise HTTPException(status_code=403, detail="Missing Token")
-    salon = db.query(models.Salon).filter(models.Salon.telegram_token == x_salon_token).first()
-    if not salon:
-        raise HTTPException(status_code=403, detail="Invalid Token")
+    salon = salons_by_token.get(x_salon_token)
+    if salon is None:
+        db_salon = db.query(models.Salon).filter(models.Salon.telegram_token == x_salon_token).first()
+        if not db_salon:
+            raise HTTPException(status_code=403, detail="Invalid Token")
+        salon = models.SalonSnapshot.from_model(db_salon)
+        salons_by_token.set(x_salon_token, salon)
     if not salon.is_active:
         raise HTTPException(status_code=403, detail="Salon is inactive")
     return salon
@@ -68,7 +176,7 @@ def get_current_salon(x_salon_token: str = Header(None), db: Session = Depends(g
 # ==========================================
 #              PYDANTIC СХЕМЫ
 # ==========================================
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 class ServiceSchema(BaseModel):
     id: int; name: str; price: int; duration_minutes: int
@@ -115,12 +223,22 @@ class AppointmentNaturalLanguageSchema(BaseModel):
 class AvailableSlotSchema(BaseModel):
     time: str; master_id: int
 
+class BookingServiceSchema(ServiceSchema):
+    master_ids: List[int]
+
+class ActiveDaysSchema(BaseModel):
+    service_id: int; master_id: Optional[int] = None; year: int; month: int; days: List[int]
+
+class BookingContextSchema(BaseModel):
+    services: List[BookingServiceSchema]; masters: List[MasterSchema]; active_days: List[ActiveDaysSchema]
+
 class AppointmentInfoSchema(BaseModel):
     id: int; start_time: datetime; service_name: str; master_name: str
     class Config: from_attributes = True
 
 class SalonUpdateSchema(BaseModel):
     name: str; telegram_token: str; admin_password: str; is_active: bool
+    slot_step_minutes: Optional[int] = Field(None, ge=availability.MIN_SLOT_STEP_MINUTES, le=availability.MAX_SLOT_STEP_MINUTES)
 
 class ServiceCreateSchema(BaseModel):
     name: str
@@ -144,12 +262,18 @@ async def create_salon(request: Request, db: Session=Depends(get_db), username:
     title = form.get("title")
     token = form.get("token")
     password = form.get("password")
+    try: slot_step = int(form.get("slot_step") or availability.DEFAULT_SLOT_STEP_MINUTES)
+    except ValueError: raise HTTPException(400, "Invalid slot step")
+    if not availability.MIN_SLOT_STEP_MINUTES <= slot_step <= availability.MAX_SLOT_STEP_MINUTES:
+        raise HTTPException(400, f"Slot step must be {availability.MIN_SLOT_STEP_MINUTES}-{availability.MAX_SLOT_STEP_MINUTES} minutes")
     
     if db.query(models.Salon).filter(models.Salon.telegram_token == token).first():
         raise HTTPException(400, "Token already exists")
         
-    new_salon = models.Salon(name=name, title=title, telegram_token=token, admin_password=password)
+    new_salon = models.Salon(name=name, title=title, telegram_token=token, admin_password=password, slot_step_minutes=slot_step)
     db.add(new_salon); db.commit(); db.refresh(new_salon)
+    invalidate_salon_auth(name, token)
+    publish_salons_changed(new_salon.id)
 
     # Демо данные
     s1 = models.Service(salon_id=new_salon.id, name="Стрижка (Тест)", price=1000, duration_minutes=60)
@@ -167,17 +291,62 @@ async def create_salon(request: Request, db: Session=Depends(get_db), username:
 def update_salon(salon_id: int, data: SalonUpdateSchema, db: Session=Depends(get_db), username: str=Depends(authenticate_super_admin)):
     salon = db.query(models.Salon).get(salon_id)
     if not salon: raise HTTPException(404, "Salon not found")
+    invalidate_salon_auth(salon.name, salon.telegram_token, data.name, data.telegram_token)
     salon.name = data.name; salon.telegram_token = data.telegram_token
     salon.admin_password = data.admin_password; salon.is_active = data.is_active
+    if data.slot_step_minutes is not None: salon.slot_step_minutes = data.slot_step_minutes
     db.commit()
+    availability.invalidate_salon(salon_id)
+    # Повторно: запрос, прочитавший старые данные до commit, мог успеть положить их в кэш
+    invalidate_salon_auth(data.name, data.telegram_token)
+    publish_salons_changed(salon_id)
     return {"status": "updated"}
 
+@app.get("/superadmin/stats")
+def super_admin_stats(username: str=Depends(authenticate_super_admin)):
+    """Счетчики кэшей и пула соединений для мониторинга"""
+    return {
+        "salon_token_cache": salons_by_token.stats(),
+        "salon_login_cache": salons_by_login.stats(),
+        "availability_cache": availability.cache.stats(),
+        "db_pool": pool_stats(engine),
+        "async_db_pool": pool_stats(async_engine) if async_engine else None,
+    }
+
+@metrics_registry.collector
+def collect_pool_and_cache_metrics():
+    """Пул БД и кэши снимаются в момент запроса метрик (те же данные, что в /superadmin/stats)"""
+    engines = [("sync", engine)] + ([("async", async_engine)] if async_engine else [])
+    pools = [(name, pool_stats(e)) for name, e in engines]
+    for key, metric, kind, help in [
+        ("checked_out", "db_pool_checked_out", "gauge", "Соединения, выданные из пула"),
+        ("size", "db_pool_size", "gauge", "Размер пула соединений"),
+        ("overflow", "db_pool_overflow", "gauge", "Соединения сверх размера пула"),
+        ("checkouts", "db_pool_checkouts_total", "counter", "Получения соединения из пула"),
+        ("waits", "db_pool_waits_total", "counter", "Получения соединения с ожиданием дольше 1 мс"),
+        ("timeouts", "db_pool_timeouts_total", "counter", "Таймауты ожидания соединения"),
+    ]:
+        yield metric, kind, help, [({"engine": name}, stats[key]) for name, stats in pools if key in stats]
+    yield "db_pool_wait_seconds_total", "counter", "Суммарное ожидание свободного соединения", [
+        ({"engine": name}, stats["wait_time_total_ms"] / 1000) for name, stats in pools if "wait_time_total_ms" in stats]
+
+    caches = [("availability", availability.cache.stats()), ("salon_token", salons_by_token.stats()),
+              ("salon_login", salons_by_login.stats())]
+    yield "cache_hits_total", "counter", "Попадания в кэш", [({"cache": n}, c["hits"]) for n, c in caches]
+    yield "cache_misses_total", "counter", "Промахи кэша", [({"cache": n}, c["misses"]) for n, c in caches]
+    yield "cache_hit_ratio", "gauge", "Доля попаданий в кэш", [({"cache": n}, c["hit_ratio"]) for n, c in caches]
+    yield "cache_entries", "gauge", "Записей в кэше", [({"cache": n}, c["size"]) for n, c in caches]
+
+@app.get("/metrics", include_in_schema=False)
+def metrics_endpoint():
+    return Response(metrics_registry.render(), media_type=METRICS_CONTENT_TYPE)
+
 # ==========================================
 #           АДМИНКА САЛОНА
 # ==========================================
 
 @app.get("/admin/schedule")
-def admin_schedule_page(request: Request, selected_date_str: Optional[str]=None, db: Session=Depends(get_db), salon: models.Salon = Depends(authenticate_salon_admin)):
+def admin_schedule_page(request: Request, selected_date_str: Optional[str]=None, db: Session=Depends(get_db), salon: models.SalonSnapshot = Depends(authenticate_salon_admin)):
     try: selected_date = datetime.strptime(selected_date_str, "%Y-%m-%d").date() if selected_date_str else date.today()
     except: selected_date = date.today()
     
@@ -202,28 +371,106 @@ def admin_schedule_page(request: Request, selected_date_str: Optional[str]=None,
     return templates.TemplateResponse("schedule.html", context)
 
 @app.get("/admin/masters")
-def admin_masters_page(request: Request, db: Session=Depends(get_db), salon: models.Salon = Depends(authenticate_salon_admin)):
-    masters = db.query(models.Master).filter(models.Master.salon_id == salon.id).options(joinedload(models.Master.services)).all()
+def admin_masters_page(request: Request, db: Session=Depends(get_db), salon: models.SalonSnapshot = Depends(authenticate_salon_admin)):
+    masters = db.query(models.Master).filter(models.Master.salon_id == salon.id).options(selectinload(models.Master.services)).all()
     services = db.query(models.Service).filter(models.Service.salon_id == salon.id).all()
     return templates.TemplateResponse("masters.html", {"request": request, "masters": masters, "services": services, "page": "masters", "username": salon.name, "password": salon.admin_password})
 
 @app.get("/admin/services")
-def admin_services_page(request: Request, db: Session=Depends(get_db), salon: models.Salon = Depends(authenticate_salon_admin)):
+def admin_services_page(request: Request, db: Session=Depends(get_db), salon: models.SalonSnapshot = Depends(authenticate_salon_admin)):
     services = db.query(models.Service).filter(models.Service.salon_id == salon.id).all()
     return templates.TemplateResponse("services.html", {"request": request, "services": services, "page": "services", "username": salon.name, "password": salon.admin_password})
 
 @app.get("/admin/clients")
-def admin_clients_page(request: Request, db: Session=Depends(get_db), salon: models.Salon = Depends(authenticate_salon_admin)):
+def admin_clients_page(request: Request, db: Session=Depends(get_db), salon: models.SalonSnapshot = Depends(authenticate_salon_admin)):
     clients = db.query(models.Client).filter(models.Client.salon_id == salon.id).order_by(models.Client.id.desc()).limit(100).all()
     return templates.TemplateResponse("clients.html", {"request": request, "clients": clients, "page": "clients", "username": salon.name, "password": salon.admin_password})
 
+# ==========================================
+#           API БОТА (асинхронный режим)
+# ==========================================
+# При USE_ASYNC_DB горячие эндпоинты бота работают на AsyncSession (asyncpg) и не
+# занимают пул потоков Starlette. Синхронные версии тех же маршрутов - в bot_sync_router
+# ниже; к приложению подключается ровно один из роутеров (в конце файла).
+bot_async_router = APIRouter()
+bot_sync_router = APIRouter()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def get_current_salon_async(x_salon_token: str = Header(None), db: AsyncSession = Depends(get_async_db)):
+    if not x_salon_token:
+        raise HTTPException(status_code=403, detail="Missing Token")
+    salon = salons_by_token.get(x_salon_token)
+    if salon is None:
+        db_salon = (await db.execute(select(models.Salon).where(models.Salon.telegram_token == x_salon_token))).scalars().first()
+        if not db_salon:
+            raise HTTPException(status_code=403, detail="Invalid Token")
+        salon = models.SalonSnapshot.from_model(db_salon)
+        salons_by_token.set(x_salon_token, salon)
+    if not salon.is_active:
+        raise HTTPException(status_code=403, detail="Salon is inactive")
+    return salon
+
+@bot_async_router.get("/api/v1/services", response_model=List[ServiceSchema])
+async def get_services_async(db: AsyncSession = Depends(get_async_db), salon: models.SalonSnapshot = Depends(get_current_salon_async)):
+    return (await db.execute(select(models.Service).where(models.Service.salon_id == salon.id))).scalars().all()
+
+@bot_async_router.get("/api/v1/available-slots", response_model=List[AvailableSlotSchema])
+async def get_available_slots_async(service_id: int, selected_date: date, master_id: Optional[int]=None, db: AsyncSession = Depends(get_async_db), salon: models.SalonSnapshot = Depends(get_current_salon_async)):
+    now = availability.moscow_now()
+    async def compute():
+        ctx = await availability.load_context_async(db, salon, service_id, selected_date, selected_date, master_id)
+        return availability.day_slots(ctx, selected_date, now) if ctx else []
+    return await availability.cached_async(availability.slots_key(salon.id, service_id, master_id, selected_date), compute, now.date())
+
+@bot_async_router.get("/api/v1/active-days-in-month", response_model=List[int])
+async def get_active_days_async(service_id: int, year: int, month: int, master_id: Optional[int]=None, db: AsyncSession = Depends(get_async_db), salon: models.SalonSnapshot = Depends(get_current_salon_async)):
+    now = availability.moscow_now()
+    try: days = availability.month_days(year, month, now.date())
+    except: return []
+    if not days: return []
+    async def compute():
+        ctx = await availability.load_context_async(db, salon, service_id, days[0], days[-1], master_id)
+        return availability.active_days(ctx, days, now) if ctx else []
+    return await availability.cached_async(availability.days_key(salon.id, service_id, master_id, year, month), compute, now.date())
+
+@bot_async_router.post("/api/v1/appointments")
+async def create_appointment_async(appt: AppointmentCreateSchema, db: AsyncSession = Depends(get_async_db), salon: models.SalonSnapshot = Depends(get_current_salon_async)):
+    client = (await db.execute(select(models.Client).where(models.Client.telegram_user_id == appt.telegram_user_id, models.Client.salon_id == salon.id))).scalars().first()
+    if not client:
+        client = models.Client(telegram_user_id=appt.telegram_user_id, name=appt.user_name, salon_id=salon.id)
+        db.add(client); await db.commit(); await db.refresh(client)
+    service = (await db.execute(select(models.Service).where(models.Service.id == appt.service_id, models.Service.salon_id == salon.id))).scalars().first()
+    master = (await db.execute(select(models.Master).where(models.Master.id == appt.master_id, models.Master.salon_id == salon.id))).scalars().first()
+    if not service or not master: raise HTTPException(404, "Not found")
+    start_time = appt.start_time
+    end_time = start_time + timedelta(minutes=service.duration_minutes)
+    if not migrations.overlap_guard_installed:
+        overlap = select(func.count()).select_from(models.Appointment).where(models.Appointment.master_id == master.id, models.Appointment.start_time < end_time, models.Appointment.end_time > start_time)
+        if (await db.execute(overlap)).scalar() > 0:
+            raise booking_conflict("precheck")
+    new_appt = models.Appointment(salon_id=salon.id, client_id=client.id, master_id=master.id, service_id=service.id, start_time=start_time, end_time=end_time)
+    db.add(new_appt)
+    try:
+        await db.commit()
+    except IntegrityError as e:
+        await db.rollback()
+        if is_overlap_violation(e): raise booking_conflict("db_constraint")
+        raise
+    await db.refresh(new_appt)
+    # INCR версии в Redis - синхронный вызов, не держим им event loop
+    await asyncio.to_thread(availability.invalidate_appointment, salon.id, master.id, start_time)
+    return {"message": "Success", "appointment_id": new_appt.id}
+
 # ==========================================
 #           API БОТА
 # ==========================================
 
 # --- Clients (ИСПРАВЛЕННАЯ ЛОГИКА) ---
 @app.patch("/api/v1/clients/{tid}")
-def update_phone(tid: int, data: ClientUpdateSchema, db: Session = Depends(get_db), salon: models.Salon = Depends(get_current_salon)):
+def update_phone(tid: int, data: ClientUpdateSchema, db: Session = Depends(get_db), salon: models.SalonSnapshot = Depends(get_current_salon)):
     # Ищем клиента
     c = db.query(models.Client).filter(models.Client.telegram_user_id == tid, models.Client.salon_id == salon.id).first()
     
@@ -245,15 +492,16 @@ def update_phone(tid: int, data: ClientUpdateSchema, db: Session = Depends(get_d
     return {"message": "Updated"}
 
 @app.get("/api/v1/clients/by_telegram/{tg_id}", response_model=Optional[ClientManualSchema])
-def get_client_by_telegram(tg_id: int, db: Session = Depends(get_db), salon: models.Salon = Depends(get_current_salon)):
+def get_client_by_telegram(tg_id: int, db: Session = Depends(get_db), salon: models.SalonSnapshot = Depends(get_current_salon)):
     client = db.query(models.Client).filter(models.Client.telegram_user_id == tg_id, models.Client.salon_id == salon.id).first()
     return client
 
 # --- Appointments (Natural AI) ---
 @app.post("/api/v1/appointments/natural")
-def create_appointment_from_natural_language(req: AppointmentNaturalLanguageSchema, db: Session = Depends(get_db), salon: models.Salon = Depends(get_current_salon)):
+def create_appointment_from_natural_language(req: AppointmentNaturalLanguageSchema, db: Session = Depends(get_db), salon: models.SalonSnapshot = Depends(get_current_salon)):
     # ИСПРАВЛЕНО: используем 'req' вместо 'request'
-    logging.info(f"AI Request for Salon '{salon.name}': {req.dict()}")
+    logger.info("AI Request for Salon '%s': service '%s' on %s %s", salon.name, req.service_name, req.appointment_date, req.appointment_time)
+    log_payload(logger, "AI Request body", req)
     
     client = db.query(models.Client).filter(models.Client.telegram_user_id == req.telegram_user_id, models.Client.salon_id == salon.id).first()
     if not client:
@@ -275,47 +523,53 @@ def create_appointment_from_natural_language(req: AppointmentNaturalLanguageSche
     
     end_time = start_time + timedelta(minutes=service.duration_minutes)
     
-    if db.query(models.Appointment).filter(models.Appointment.master_id == master.id, models.Appointment.start_time < end_time, models.Appointment.end_time > start_time).count() > 0:
-        raise HTTPException(409, "Time booked")
+    check_overlap(db, master.id, start_time, end_time)
 
     new_appt = models.Appointment(salon_id=salon.id, client_id=client.id, master_id=master.id, service_id=service.id, start_time=start_time, end_time=end_time)
-    db.add(new_appt); db.commit(); db.refresh(new_appt)
+    db.add(new_appt); commit_booking(db); db.refresh(new_appt)
+    availability.invalidate_appointment(salon.id, master.id, start_time)
     return {"message": "Success", "start_time": start_time.isoformat(), "service_name": service.name, "master_name": master.name}
 
 # --- Остальные методы (без изменений) ---
-@app.get("/api/v1/services", response_model=List[ServiceSchema])
-def get_services(db: Session = Depends(get_db), salon: models.Salon = Depends(get_current_salon)):
+@bot_sync_router.get("/api/v1/services", response_model=List[ServiceSchema])
+def get_services(db: Session = Depends(get_db), salon: models.SalonSnapshot = Depends(get_current_salon)):
     return db.query(models.Service).filter(models.Service.salon_id == salon.id).all()
 
 @app.post("/api/v1/services")
-def create_service(service: ServiceCreateSchema, db: Session = Depends(get_db), salon: models.Salon = Depends(authenticate_salon_admin)):
+def create_service(service: ServiceCreateSchema, db: Session = Depends(get_db), salon: models.SalonSnapshot = Depends(authenticate_salon_admin)):
     new_service = models.Service(salon_id=salon.id, name=service.name, price=service.price, duration_minutes=service.duration_minutes)
     db.add(new_service); db.commit(); db.refresh(new_service)
+    availability.invalidate_catalog(salon.id)
+    publish_catalog_changed(salon.id)
     return new_service
 
 @app.put("/api/v1/services/{service_id}")
-def update_service(service_id: int, service_data: ServiceUpdateSchema, db: Session = Depends(get_db), salon: models.Salon = Depends(authenticate_salon_admin)):
+def update_service(service_id: int, service_data: ServiceUpdateSchema, db: Session = Depends(get_db), salon: models.SalonSnapshot = Depends(authenticate_salon_admin)):
     service = db.query(models.Service).filter(models.Service.id == service_id, models.Service.salon_id == salon.id).first()
     if not service: raise HTTPException(404, "Not found")
     service.name = service_data.name; service.price = service_data.price; service.duration_minutes = service_data.duration_minutes
     db.commit()
+    availability.invalidate_service(salon.id, service_id)
+    publish_catalog_changed(salon.id)
     return service
 
 @app.get("/api/v1/masters", response_model=List[MasterSchema])
-def get_masters(db: Session = Depends(get_db), salon: models.Salon = Depends(get_current_salon)):
+def get_masters(db: Session = Depends(get_db), salon: models.SalonSnapshot = Depends(get_current_salon)):
     return db.query(models.Master).filter(models.Master.salon_id == salon.id).all()
 
 @app.post("/api/v1/masters")
-def create_master(master_data: MasterCreateSchema, db: Session = Depends(get_db), salon: models.Salon = Depends(authenticate_salon_admin)):
+def create_master(master_data: MasterCreateSchema, db: Session = Depends(get_db), salon: models.SalonSnapshot = Depends(authenticate_salon_admin)):
     new_master = models.Master(salon_id=salon.id, name=master_data.name, specialization=master_data.specialization, description=master_data.description)
     if master_data.service_ids:
         services = db.query(models.Service).filter(models.Service.id.in_(master_data.service_ids), models.Service.salon_id == salon.id).all()
         new_master.services = services
     db.add(new_master); db.commit(); db.refresh(new_master)
+    availability.invalidate_catalog(salon.id)
+    publish_catalog_changed(salon.id)
     return new_master
 
 @app.put("/api/v1/masters/{master_id}")
-def update_master(master_id: int, master_data: MasterUpdateSchema, db: Session = Depends(get_db), salon: models.Salon = Depends(authenticate_salon_admin)):
+def update_master(master_id: int, master_data: MasterUpdateSchema, db: Session = Depends(get_db), salon: models.SalonSnapshot = Depends(authenticate_salon_admin)):
     master = db.query(models.Master).filter(models.Master.id == master_id, models.Master.salon_id == salon.id).first()
     if not master: raise HTTPException(404, "Not found")
     master.name = master_data.name; master.specialization = master_data.specialization; master.description = master_data.description
@@ -323,15 +577,19 @@ def update_master(master_id: int, master_data: MasterUpdateSchema, db: Session =
         services = db.query(models.Service).filter(models.Service.id.in_(master_data.service_ids), models.Service.salon_id == salon.id).all()
         master.services = services
     db.commit()
+    availability.invalidate_master(salon.id, master_id)
+    publish_catalog_changed(salon.id)
     return master
 
 @app.get("/api/v1/services/{service_id}/masters", response_model=List[MasterSchema])
-def get_masters_for_service(service_id: int, db: Session = Depends(get_db), salon: models.Salon = Depends(get_current_salon)):
-    service = db.query(models.Service).filter(models.Service.id == service_id, models.Service.salon_id == salon.id).first()
-    return service.masters if service else []
+def get_masters_for_service(service_id: int, db: Session = Depends(get_db), salon: models.SalonSnapshot = Depends(get_current_salon)):
+    # Один запрос через master_services вместо услуги + ленивой загрузки service.masters
+    return db.query(models.Master).join(models.Master.services).filter(
+        models.Service.id == service_id, models.Service.salon_id == salon.id
+    ).order_by(models.Master.id).all()
 
 @app.get("/api/v1/masters/{master_id}/schedule")
-def get_master_schedule(master_id: int, db: Session = Depends(get_db), salon: models.Salon = Depends(authenticate_salon_admin)):
+def get_master_schedule(master_id: int, db: Session = Depends(get_db), salon: models.SalonSnapshot = Depends(authenticate_salon_admin)):
     schedules = db.query(models.Schedule).filter(models.Schedule.master_id == master_id).all()
     result = []
     db_sched_map = {s.day_of_week: s for s in schedules}
@@ -342,7 +600,7 @@ def get_master_schedule(master_id: int, db: Session = Depends(get_db), salon: mo
     return result
 
 @app.post("/api/v1/masters/{master_id}/schedule")
-def update_master_schedule(master_id: int, data: MasterScheduleUpdate, db: Session = Depends(get_db), salon: models.Salon = Depends(authenticate_salon_admin)):
+def update_master_schedule(master_id: int, data: MasterScheduleUpdate, db: Session = Depends(get_db), salon: models.SalonSnapshot = Depends(authenticate_salon_admin)):
     db.query(models.Schedule).filter(models.Schedule.master_id == master_id).delete()
     new_schedules = []
     for item in data.items:
@@ -354,10 +612,12 @@ def update_master_schedule(master_id: int, data: MasterScheduleUpdate, db: Sessi
             except ValueError: continue
     if new_schedules: db.add_all(new_schedules)
     db.commit()
+    availability.invalidate_master(salon.id, master_id)
+    publish_catalog_changed(salon.id)
     return {"message": "OK"}
 
 @app.post("/api/v1/clients_manual")
-def create_client_manual(data: ClientManualSchema, db: Session = Depends(get_db), salon: models.Salon = Depends(authenticate_salon_admin)):
+def create_client_manual(data: ClientManualSchema, db: Session = Depends(get_db), salon: models.SalonSnapshot = Depends(authenticate_salon_admin)):
     tg_id = data.telegram_user_id
     if tg_id is None: tg_id = -int(time_module.time() * 1000)
     if db.query(models.Client).filter(models.Client.telegram_user_id == tg_id, models.Client.salon_id == salon.id).first():
@@ -367,7 +627,7 @@ def create_client_manual(data: ClientManualSchema, db: Session = Depends(get_db)
     return new_client
 
 @app.put("/api/v1/clients_manual/{client_id}")
-def update_client_manual(client_id: int, data: ClientManualSchema, db: Session = Depends(get_db), salon: models.Salon = Depends(authenticate_salon_admin)):
+def update_client_manual(client_id: int, data: ClientManualSchema, db: Session = Depends(get_db), salon: models.SalonSnapshot = Depends(authenticate_salon_admin)):
     client = db.query(models.Client).get(client_id)
     if not client: raise HTTPException(404, "Not found")
     client.name = data.name; client.phone_number = data.phone_number
@@ -378,54 +638,38 @@ def update_client_manual(client_id: int, data: ClientManualSchema, db: Session =
     db.commit()
     return client
 
-@app.get("/api/v1/available-slots", response_model=List[AvailableSlotSchema])
-def get_available_slots(service_id: int, selected_date: date, master_id: Optional[int]=None, db: Session=Depends(get_db), salon: models.Salon = Depends(get_current_salon)):
-    service = db.query(models.Service).filter(models.Service.id == service_id, models.Service.salon_id == salon.id).first()
-    if not service: return []
-    duration = timedelta(minutes=service.duration_minutes)
-    masters_query = db.query(models.Master).join(models.Service, models.Master.services).filter(models.Service.id == service_id, models.Master.salon_id == salon.id)
-    if master_id: masters_query = masters_query.filter(models.Master.id == master_id)
-    potential_masters = masters_query.all()
-    all_slots = []
-    day_of_week = selected_date.isoweekday()
-    moscow_tz = ZoneInfo("Europe/Moscow")
-    now_in_moscow = datetime.now(moscow_tz)
-    for master in potential_masters:
-        schedule = db.query(models.Schedule).filter(models.Schedule.master_id == master.id, models.Schedule.day_of_week == day_of_week).first()
-        if not schedule: continue
-        start_day = datetime.combine(selected_date, time.min)
-        end_day = datetime.combine(selected_date, time.max)
-        appointments = db.query(models.Appointment).filter(models.Appointment.master_id == master.id, models.Appointment.start_time.between(start_day, end_day)).all()
-        slot_start = datetime.combine(selected_date, schedule.start_time)
-        work_end = datetime.combine(selected_date, schedule.end_time)
-        while slot_start + duration <= work_end:
-            if selected_date == now_in_moscow.date() and slot_start.time() <= now_in_moscow.time():
-                 slot_start += timedelta(minutes=30); continue
-            slot_end = slot_start + duration
-            is_free = True
-            for appt in appointments:
-                if max(slot_start, appt.start_time) < min(slot_end, appt.end_time):
-                    is_free = False; break
-            if is_free: all_slots.append({"time": slot_start.strftime("%H:%M"), "master_id": master.id})
-            slot_start += timedelta(minutes=30)
-    return sorted(all_slots, key=lambda x: x['time'])
-
-@app.get("/api/v1/active-days-in-month", response_model=List[int])
-def get_active_days(service_id: int, year: int, month: int, master_id: Optional[int]=None, db: Session=Depends(get_db), salon: models.Salon = Depends(get_current_salon)):
-    try: num_days = calendar.monthrange(year, month)[1]
+@bot_sync_router.get("/api/v1/available-slots", response_model=List[AvailableSlotSchema])
+def get_available_slots(service_id: int, selected_date: date, master_id: Optional[int]=None, db: Session=Depends(get_db), salon: models.SalonSnapshot = Depends(get_current_salon)):
+    now = availability.moscow_now()
+    def compute():
+        ctx = availability.load_context(db, salon, service_id, selected_date, selected_date, master_id)
+        return availability.day_slots(ctx, selected_date, now) if ctx else []
+    return availability.cached(availability.slots_key(salon.id, service_id, master_id, selected_date), compute, now.date())
+
+@bot_sync_router.get("/api/v1/active-days-in-month", response_model=List[int])
+def get_active_days(service_id: int, year: int, month: int, master_id: Optional[int]=None, db: Session=Depends(get_db), salon: models.SalonSnapshot = Depends(get_current_salon)):
+    now = availability.moscow_now()
+    # Прошедшие дни не показываем и не грузим для них данные
+    try: days = availability.month_days(year, month, now.date())
     except: return []
-    active_days = []
-    moscow_tz = ZoneInfo("Europe/Moscow")
-    today_moscow = datetime.now(moscow_tz).date()
-    for day in range(1, num_days + 1):
-        current_date = date(year, month, day)
-        if current_date < today_moscow: continue
-        if get_available_slots(service_id, current_date, master_id, db, salon):
-            active_days.append(day)
-    return active_days
-
-@app.post("/api/v1/appointments")
-def create_appointment(appt: AppointmentCreateSchema, db: Session = Depends(get_db), salon: models.Salon = Depends(get_current_salon)):
+    if not days: return []
+    def compute():
+        ctx = availability.load_context(db, salon, service_id, days[0], days[-1], master_id)
+        return availability.active_days(ctx, days, now) if ctx else []
+    return availability.cached(availability.days_key(salon.id, service_id, master_id, year, month), compute, now.date())
+
+@app.get("/api/v1/booking-context", response_model=BookingContextSchema)
+def get_booking_context(db: Session=Depends(get_db), salon: models.SalonSnapshot = Depends(get_current_salon)):
+    """Услуги, мастера услуг и активные дни на текущий и следующий месяц - одним ответом для /book"""
+    now = availability.moscow_now()
+    this_month = now.date().replace(day=1)
+    next_month = (this_month + timedelta(days=32)).replace(day=1)
+    months = [(this_month.year, this_month.month), (next_month.year, next_month.month)]
+    return availability.cached(availability.context_key(salon.id, this_month.year, this_month.month),
+                               lambda: availability.booking_context(db, salon, months, now), now.date())
+
+@bot_sync_router.post("/api/v1/appointments")
+def create_appointment(appt: AppointmentCreateSchema, db: Session = Depends(get_db), salon: models.SalonSnapshot = Depends(get_current_salon)):
     client = db.query(models.Client).filter(models.Client.telegram_user_id == appt.telegram_user_id, models.Client.salon_id == salon.id).first()
     if not client:
         client = models.Client(telegram_user_id=appt.telegram_user_id, name=appt.user_name, salon_id=salon.id)
@@ -434,54 +678,70 @@ def create_appointment(appt: AppointmentCreateSchema, db: Session = Depends(get_
     master = db.query(models.Master).filter(models.Master.id == appt.master_id, models.Master.salon_id == salon.id).first()
     start_time = appt.start_time
     end_time = start_time + timedelta(minutes=service.duration_minutes)
-    if db.query(models.Appointment).filter(models.Appointment.master_id == master.id, models.Appointment.start_time < end_time, models.Appointment.end_time > start_time).count() > 0:
-        raise HTTPException(409, "Time booked")
+    check_overlap(db, master.id, start_time, end_time)
     new_appt = models.Appointment(salon_id=salon.id, client_id=client.id, master_id=master.id, service_id=service.id, start_time=start_time, end_time=end_time)
-    db.add(new_appt); db.commit(); db.refresh(new_appt)
+    db.add(new_appt); commit_booking(db); db.refresh(new_appt)
+    availability.invalidate_appointment(salon.id, master.id, start_time)
     return {"message": "Success", "appointment_id": new_appt.id}
 
 @app.post("/api/v1/appointments/admin")
-def create_appointment_admin(appt: AppointmentAdminCreateSchema, db: Session = Depends(get_db), salon: models.Salon = Depends(authenticate_salon_admin)):
+def create_appointment_admin(appt: AppointmentAdminCreateSchema, db: Session = Depends(get_db), salon: models.SalonSnapshot = Depends(authenticate_salon_admin)):
     service = db.query(models.Service).filter(models.Service.id == appt.service_id, models.Service.salon_id == salon.id).first()
     if not service: raise HTTPException(404, "Service not found")
     end_time = appt.start_time + timedelta(minutes=service.duration_minutes)
-    if db.query(models.Appointment).filter(models.Appointment.master_id == appt.master_id, models.Appointment.start_time < end_time, models.Appointment.end_time > appt.start_time).count() > 0:
-        raise HTTPException(409, "Time booked")
+    check_overlap(db, appt.master_id, appt.start_time, end_time)
     new_appt = models.Appointment(salon_id=salon.id, client_id=appt.client_id, master_id=appt.master_id, service_id=appt.service_id, start_time=appt.start_time, end_time=end_time)
-    db.add(new_appt); db.commit(); db.refresh(new_appt)
+    db.add(new_appt); commit_booking(db); db.refresh(new_appt)
+    availability.invalidate_appointment(salon.id, appt.master_id, appt.start_time)
     return new_appt
 
 @app.put("/api/v1/appointments/{appt_id}")
-def update_appointment(appt_id: int, appt_data: AppointmentUpdateSchema, db: Session = Depends(get_db), salon: models.Salon = Depends(authenticate_salon_admin)):
+def update_appointment(appt_id: int, appt_data: AppointmentUpdateSchema, db: Session = Depends(get_db), salon: models.SalonSnapshot = Depends(authenticate_salon_admin)):
     appt = db.query(models.Appointment).filter(models.Appointment.id == appt_id, models.Appointment.salon_id == salon.id).first()
     if not appt: raise HTTPException(404, "Not found")
     service = db.query(models.Service).get(appt_data.service_id)
     end_time = appt_data.start_time + timedelta(minutes=service.duration_minutes)
-    if db.query(models.Appointment).filter(models.Appointment.id != appt_id, models.Appointment.master_id == appt_data.master_id, models.Appointment.start_time < end_time, models.Appointment.end_time > appt_data.start_time).count() > 0:
-        raise HTTPException(409, "Time booked")
+    check_overlap(db, appt_data.master_id, appt_data.start_time, end_time, exclude_id=appt_id)
+    old_master_id, old_start_time = appt.master_id, appt.start_time
     appt.master_id = appt_data.master_id; appt.service_id = appt_data.service_id; appt.start_time = appt_data.start_time; appt.end_time = end_time
-    db.commit()
+    commit_booking(db)
+    availability.invalidate_appointment(salon.id, old_master_id, old_start_time)
+    availability.invalidate_appointment(salon.id, appt_data.master_id, appt_data.start_time)
     return appt
 
 @app.delete("/api/v1/appointments/{aid}")
-def delete_appt_admin(aid: int, db: Session = Depends(get_db), salon: models.Salon = Depends(authenticate_salon_admin)):
+def delete_appt_admin(aid: int, db: Session = Depends(get_db), salon: models.SalonSnapshot = Depends(authenticate_salon_admin)):
     a = db.query(models.Appointment).filter(models.Appointment.id == aid, models.Appointment.salon_id == salon.id).first()
-    if a: db.delete(a); db.commit()
+    if a:
+        master_id, start_time = a.master_id, a.start_time
+        db.delete(a); db.commit()
+        availability.invalidate_appointment(salon.id, master_id, start_time)
     return {"message": "Deleted"}
 
 @app.delete("/api/v1/bot/appointments/{aid}")
-def delete_appt_bot(aid: int, db: Session = Depends(get_db), salon: models.Salon = Depends(get_current_salon)):
+def delete_appt_bot(aid: int, db: Session = Depends(get_db), salon: models.SalonSnapshot = Depends(get_current_salon)):
     # Бот может удалить запись, только если она принадлежит этому салону
     a = db.query(models.Appointment).filter(models.Appointment.id == aid, models.Appointment.salon_id == salon.id).first()
     if not a: 
         raise HTTPException(404, "Appointment not found")
+    master_id, start_time = a.master_id, a.start_time
     db.delete(a)
     db.commit()
+    availability.invalidate_appointment(salon.id, master_id, start_time)
     return {"message": "Deleted by bot"}
 
 @app.get("/api/v1/clients/{tid}/appointments", response_model=List[AppointmentInfoSchema])
-def get_client_appts(tid: int, db: Session = Depends(get_db), salon: models.Salon = Depends(get_current_salon)):
-    client = db.query(models.Client).filter(models.Client.telegram_user_id == tid, models.Client.salon_id == salon.id).first()
-    if not client: return []
-    appts = db.query(models.Appointment).filter(models.Appointment.client_id == client.id, models.Appointment.start_time >= datetime.utcnow()).all()
-    return [{"id": a.id, "start_time": a.start_time, "service_name": a.service.name, "master_name": a.master.name} for a in appts]
+def get_client_appts(tid: int, db: Session = Depends(get_db), salon: models.SalonSnapshot = Depends(get_current_salon)):
+    # Только нужные колонки одним запросом (без ленивой загрузки a.service / a.master на каждую запись)
+    rows = db.execute(
+        select(models.Appointment.id, models.Appointment.start_time,
+               models.Service.name.label("service_name"), models.Master.name.label("master_name"))
+        .join(models.Appointment.client).join(models.Appointment.service).join(models.Appointment.master)
+        .where(models.Client.telegram_user_id == tid, models.Client.salon_id == salon.id,
+               models.Appointment.start_time >= datetime.utcnow())
+        .order_by(models.Appointment.start_time)
+    ).mappings().all()
+    return rows
+
+# Синхронные или асинхронные горячие эндпоинты бота - не оба сразу
+app.include_router(bot_async_router if USE_ASYNC_DB else bot_sync_router)
@@ -0,0 +1,411 @@
+# availability.py - Расчет свободных слотов и активных дней календаря.
+# Все данные за период (услуга, мастера, графики, записи) грузятся фиксированным
+# числом запросов, дальше расчет идет в памяти.
+import asyncio
+import calendar
+import json
+import logging
+import time as time_module
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+import redis
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+import models
+from cache import LRUCache
+from config import (AVAILABILITY_CACHE_SIZE, AVAILABILITY_CACHE_TTL, AVAILABILITY_CACHE_TODAY_TTL,
+                    AVAILABILITY_CACHE_BACKEND, AVAILABILITY_VERSION_REFRESH, REDIS_HOST, REDIS_PORT)
+
+logger = logging.getLogger(__name__)
+
+MOSCOW_TZ = ZoneInfo("Europe/Moscow")
+DEFAULT_SLOT_STEP_MINUTES = 30
+# Допустимый шаг сетки слотов салона, минут (проверяется в API при сохранении)
+MIN_SLOT_STEP_MINUTES = 5
+MAX_SLOT_STEP_MINUTES = 240
+
+
+def moscow_now() -> datetime:
+    return datetime.now(MOSCOW_TZ)
+
+
+class AvailabilityContext:
+    """Снимок данных салона за период: длительность услуги, мастера, графики и записи."""
+
+    def __init__(self, duration: timedelta, step: timedelta, master_ids: List[int],
+                 schedules: Dict[Tuple[int, int], Tuple[time, time]],
+                 appointments: Dict[Tuple[int, date], List[Tuple[datetime, datetime]]]):
+        self.duration = duration
+        self.step = step
+        self.master_ids = master_ids
+        self.schedules = schedules          # (master_id, day_of_week) -> (start, end)
+        self.appointments = appointments    # (master_id, date) -> [(start, end), ...] по возрастанию
+
+
+# Запросы вынесены отдельно, чтобы их могли выполнять и Session, и AsyncSession
+def _service_stmt(salon_id: int, service_id: int):
+    return select(models.Service).where(models.Service.id == service_id, models.Service.salon_id == salon_id)
+
+
+def _masters_stmt(salon_id: int, service_id: int, master_id: Optional[int]):
+    stmt = select(models.Master.id).join(models.Service, models.Master.services).where(
+        models.Service.id == service_id, models.Master.salon_id == salon_id)
+    if master_id: stmt = stmt.where(models.Master.id == master_id)
+    return stmt.order_by(models.Master.id)
+
+
+def _schedules_stmt(master_ids: List[int]):
+    return select(models.Schedule.master_id, models.Schedule.day_of_week, models.Schedule.start_time,
+                  models.Schedule.end_time).where(models.Schedule.master_id.in_(master_ids)).order_by(models.Schedule.id)
+
+
+def _appointments_stmt(master_ids: List[int], date_from: date, date_to: date):
+    return select(models.Appointment.master_id, models.Appointment.start_time, models.Appointment.end_time).where(
+        models.Appointment.master_id.in_(master_ids),
+        models.Appointment.start_time.between(datetime.combine(date_from, time.min), datetime.combine(date_to, time.max)))
+
+
+def _salon_step(salon: models.SalonSnapshot) -> timedelta:
+    # Неположительный шаг (старые данные в БД) зациклил бы перебор слотов - берем шаг по умолчанию
+    step = salon.slot_step_minutes
+    if step is None or step <= 0:
+        return timedelta(minutes=DEFAULT_SLOT_STEP_MINUTES)
+    return timedelta(minutes=step)
+
+
+def _build_context(duration: timedelta, step: timedelta, master_ids: List[int], schedule_rows, appointment_rows) -> AvailabilityContext:
+    schedules = {}
+    for row in schedule_rows:
+        # Как и раньше, берется первая строка графика на день недели
+        schedules.setdefault((row.master_id, row.day_of_week), (row.start_time, row.end_time))
+
+    appointments = defaultdict(list)
+    for row in appointment_rows:
+        # Записи нулевой длины ничего не занимают
+        if row.end_time > row.start_time:
+            appointments[(row.master_id, row.start_time.date())].append((row.start_time, row.end_time))
+    for day_appointments in appointments.values():
+        day_appointments.sort()
+
+    return AvailabilityContext(duration, step, master_ids, schedules, dict(appointments))
+
+
+def load_context(db: Session, salon: models.SalonSnapshot, service_id: int, date_from: date, date_to: date,
+                 master_id: Optional[int] = None) -> Optional[AvailabilityContext]:
+    """Загружает данные за [date_from, date_to] четырьмя запросами. None - если услуги нет."""
+    service = db.execute(_service_stmt(salon.id, service_id)).scalars().first()
+    if not service:
+        return None
+    duration = timedelta(minutes=service.duration_minutes)
+    master_ids = list(db.execute(_masters_stmt(salon.id, service_id, master_id)).scalars())
+    if not master_ids:
+        return AvailabilityContext(duration, _salon_step(salon), [], {}, {})
+    return _build_context(duration, _salon_step(salon), master_ids,
+                          db.execute(_schedules_stmt(master_ids)).all(),
+                          db.execute(_appointments_stmt(master_ids, date_from, date_to)).all())
+
+
+async def load_context_async(db: AsyncSession, salon: models.SalonSnapshot, service_id: int, date_from: date,
+                             date_to: date, master_id: Optional[int] = None) -> Optional[AvailabilityContext]:
+    """То же, что load_context, для асинхронной сессии."""
+    service = (await db.execute(_service_stmt(salon.id, service_id))).scalars().first()
+    if not service:
+        return None
+    duration = timedelta(minutes=service.duration_minutes)
+    master_ids = list((await db.execute(_masters_stmt(salon.id, service_id, master_id))).scalars())
+    if not master_ids:
+        return AvailabilityContext(duration, _salon_step(salon), [], {}, {})
+    return _build_context(duration, _salon_step(salon), master_ids,
+                          (await db.execute(_schedules_stmt(master_ids))).all(),
+                          (await db.execute(_appointments_stmt(master_ids, date_from, date_to))).all())
+
+
+def _master_slots(ctx: AvailabilityContext, master_id: int, day: date, now: datetime):
+    """Идет по свободным промежуткам между отсортированными записями мастера.
+
+    Слоты выровнены по сетке от начала смены с шагом ctx.step, поэтому
+    работа линейна по числу записей и найденных слотов."""
+    schedule = ctx.schedules.get((master_id, day.isoweekday()))
+    if not schedule:
+        return
+    work_start = datetime.combine(day, schedule[0])
+    work_end = datetime.combine(day, schedule[1])
+    # Сегодня слоты начинаются строго после текущего времени
+    first_index = 0
+    if day == now.date():
+        now_naive = datetime.combine(day, now.time())
+        if now_naive >= work_start:
+            first_index = (now_naive - work_start) // ctx.step + 1
+
+    cursor = work_start
+    for appt_start, appt_end in ctx.appointments.get((master_id, day), []) + [(work_end, work_end)]:
+        gap_end = min(appt_start, work_end)
+        # Первый узел сетки внутри промежутка [cursor, gap_end)
+        index = max(first_index, -((work_start - cursor) // ctx.step))
+        slot_start = work_start + index * ctx.step
+        while slot_start + ctx.duration <= gap_end:
+            yield slot_start
+            slot_start += ctx.step
+        cursor = max(cursor, appt_end)
+        if cursor >= work_end:
+            return
+
+
+def day_slots(ctx: AvailabilityContext, day: date, now: datetime) -> List[dict]:
+    """Свободные слоты всех мастеров на день, отсортированные по времени."""
+    all_slots = []
+    for master_id in ctx.master_ids:
+        for slot_start in _master_slots(ctx, master_id, day, now):
+            all_slots.append({"time": slot_start.strftime("%H:%M"), "master_id": master_id})
+    return sorted(all_slots, key=lambda x: x['time'])
+
+
+def has_slots(ctx: AvailabilityContext, day: date, now: datetime) -> bool:
+    return any(next(_master_slots(ctx, master_id, day, now), None) for master_id in ctx.master_ids)
+
+
+def active_days(ctx: AvailabilityContext, days: List[date], now: datetime) -> List[int]:
+    """Номера дней, в которые есть хотя бы один свободный слот."""
+    return [d.day for d in days if has_slots(ctx, d, now)]
+
+
+def month_days(year: int, month: int, today: date) -> List[date]:
+    """Дни месяца начиная с сегодняшнего (прошедшие не показываем)."""
+    num_days = calendar.monthrange(year, month)[1]
+    return [d for d in (date(year, month, day) for day in range(1, num_days + 1)) if d >= today]
+
+
+def booking_context(db: Session, salon: models.SalonSnapshot, months: List[Tuple[int, int]], now: datetime) -> dict:
+    """Все, что нужно боту для шагов услуга -> мастер -> календарь, за один проход.
+
+    Пять запросов: услуги, мастера, связи мастер-услуга, графики, записи за период.
+    Активные дни считаются для каждой услуги и каждого ее мастера, а для
+    "любого мастера" - как объединение дней ее мастеров."""
+    services = db.execute(select(models.Service).where(models.Service.salon_id == salon.id).order_by(models.Service.id)).scalars().all()
+    masters = db.execute(select(models.Master).where(models.Master.salon_id == salon.id).order_by(models.Master.id)).scalars().all()
+    links = db.execute(select(models.master_services.c.service_id, models.master_services.c.master_id)
+                       .join(models.Master, models.Master.id == models.master_services.c.master_id)
+                       .where(models.Master.salon_id == salon.id).order_by(models.master_services.c.master_id)).all()
+    service_masters = defaultdict(list)
+    for row in links:
+        service_masters[row.service_id].append(row.master_id)
+
+    days = [d for year, month in months for d in month_days(year, month, now.date())]
+    master_ids = [m.id for m in masters]
+    schedule_rows, appointment_rows = [], []
+    if master_ids and days:
+        schedule_rows = db.execute(_schedules_stmt(master_ids)).all()
+        appointment_rows = db.execute(_appointments_stmt(master_ids, days[0], days[-1])).all()
+    base = _build_context(timedelta(0), _salon_step(salon), master_ids, schedule_rows, appointment_rows)
+
+    active = []
+    for service in services:
+        ctx = AvailabilityContext(timedelta(minutes=service.duration_minutes), base.step, service_masters[service.id],
+                                  base.schedules, base.appointments)
+        by_master = {m_id: [d for d in days if next(_master_slots(ctx, m_id, d, now), None)] for m_id in ctx.master_ids}
+        any_master = sorted({d for m_days in by_master.values() for d in m_days})
+        for master_id, m_days in [(None, any_master)] + list(by_master.items()):
+            for year, month in months:
+                active.append({"service_id": service.id, "master_id": master_id, "year": year, "month": month,
+                               "days": [d.day for d in m_days if (d.year, d.month) == (year, month)]})
+
+    return {
+        "services": [{"id": s.id, "name": s.name, "price": s.price, "duration_minutes": s.duration_minutes,
+                      "master_ids": service_masters[s.id]} for s in services],
+        "masters": [{"id": m.id, "name": m.name, "specialization": m.specialization, "description": m.description}
+                    for m in masters],
+        "active_days": active,
+    }
+
+
+# ==========================================
+#     КЭШ ДОСТУПНОСТИ (в памяти процесса)
+# ==========================================
+# Ключ: (вид, salon_id, service_id, master_id, дата). Для слотов дата - сам день,
+# для активных дней месяца - первое число месяца. master_id=None - "любой мастер".
+# Контекст записи (booking_context) хранится с service_id=master_id=None.
+
+cache = LRUCache(maxsize=AVAILABILITY_CACHE_SIZE, ttl=AVAILABILITY_CACHE_TTL)
+# Поколение данных салона: растет при каждой инвалидации. Результат, посчитанный
+# до записи в БД, не попадет в кэш после нее.
+_generations: Dict[int, int] = defaultdict(int)
+
+
+def slots_key(salon_id: int, service_id: int, master_id: Optional[int], day: date) -> tuple:
+    return ("slots", salon_id, service_id, master_id or None, day)
+
+
+def days_key(salon_id: int, service_id: int, master_id: Optional[int], year: int, month: int) -> tuple:
+    return ("days", salon_id, service_id, master_id or None, date(year, month, 1))
+
+
+def context_key(salon_id: int, year: int, month: int) -> tuple:
+    return ("context", salon_id, None, None, date(year, month, 1))
+
+
+class RedisAvailabilityStore:
+    """Общий для всех воркеров uvicorn кэш в Redis.
+
+    У каждого салона есть счетчик версии; версия входит в ключ, поэтому запись
+    в любом воркере (INCR) делает устаревшими все значения салона без FLUSH.
+    Старые версии просто доживают свой TTL.
+
+    Версия запоминается в процессе на version_refresh секунд, чтобы попадание
+    в локальный кэш не стоило запроса к Redis. Клиент синхронный: асинхронные
+    эндпоинты вызывают его через asyncio.to_thread (см. cached_async)."""
+
+    def __init__(self, client, prefix: str = "avail", version_refresh: float = AVAILABILITY_VERSION_REFRESH):
+        self.client = client
+        self.prefix = prefix
+        self.version_refresh = version_refresh
+        self._versions: Dict[int, Tuple[Optional[int], float]] = {}  # salon_id -> (версия, когда прочитана)
+
+    def _key(self, key: tuple, version: int) -> str:
+        kind, salon_id, service_id, master_id, day = key[:5]
+        return f"{self.prefix}:{salon_id}:{version}:{kind}:{service_id}:{master_id or 0}:{day.isoformat()}"
+
+    def known_version(self, salon_id: int) -> Tuple[bool, Optional[int]]:
+        """(True, версия), если версия прочитана недавно и запрос к Redis не нужен"""
+        entry = self._versions.get(salon_id)
+        if entry is not None and time_module.monotonic() - entry[1] < self.version_refresh:
+            return True, entry[0]
+        return False, None
+
+    def version(self, salon_id: int) -> Optional[int]:
+        fresh, version = self.known_version(salon_id)
+        if fresh:
+            return version
+        try:
+            version = int(self.client.get(f"{self.prefix}:ver:{salon_id}") or 0)
+        except redis.RedisError as e:
+            # Недоступность тоже запоминаем: не ждем таймаут Redis на каждом запросе
+            logger.warning(f"Redis недоступен, кэш доступности только локальный: {e}")
+            version = None
+        self._versions[salon_id] = (version, time_module.monotonic())
+        return version
+
+    def get(self, key: tuple, version: int) -> Any:
+        try:
+            raw = self.client.get(self._key(key, version))
+        except redis.RedisError:
+            return None
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key: tuple, version: int, value: Any, ttl: int):
+        try:
+            self.client.set(self._key(key, version), json.dumps(value), ex=ttl)
+        except redis.RedisError:
+            pass
+
+    def bump(self, salon_id: int):
+        try:
+            version = int(self.client.incr(f"{self.prefix}:ver:{salon_id}"))
+        except redis.RedisError as e:
+            logger.warning(f"Не удалось сбросить версию кэша салона {salon_id} в Redis: {e}")
+            self._versions.pop(salon_id, None)
+            return
+        # Свой воркер видит новую версию сразу, остальные - после version_refresh
+        self._versions[salon_id] = (version, time_module.monotonic())
+
+
+shared: Optional[RedisAvailabilityStore] = None
+if AVAILABILITY_CACHE_BACKEND == "redis":
+    shared = RedisAvailabilityStore(redis.Redis(host=REDIS_HOST, port=REDIS_PORT, socket_timeout=0.5, socket_connect_timeout=0.5))
+
+
+def _lookup_local(key: tuple, today: date, version: Optional[int]) -> Tuple[Any, tuple]:
+    """Ищет значение в локальном кэше. Возвращает (значение, состояние для _store)."""
+    salon_id = key[1]
+    # Результаты, зависящие от текущего времени (сегодняшний день), живут недолго
+    kind, day = key[0], key[4]
+    involves_today = day == today if kind == "slots" else (day.year, day.month) == (today.year, today.month)
+    ttl = AVAILABILITY_CACHE_TODAY_TTL if involves_today else AVAILABILITY_CACHE_TTL
+
+    local_key = key if version is None else key + (version,)
+    state = (key, local_key, version, ttl, _generations[salon_id])
+    return cache.get(local_key), state
+
+
+def _lookup_shared(state: tuple) -> Any:
+    key, local_key, version, ttl, _ = state
+    value = shared.get(key, version)
+    if value is not None:
+        cache.set(local_key, value, ttl=ttl)
+    return value
+
+
+def _store(state: tuple, value: Any) -> bool:
+    """Кладет значение в локальный кэш; True - его нужно записать и в общий (shared.set)"""
+    key, local_key, version, ttl, generation = state
+    if _generations[key[1]] != generation:
+        return False
+    cache.set(local_key, value, ttl=ttl)
+    return version is not None
+
+
+def cached(key: tuple, compute: Callable[[], Any], today: date) -> Any:
+    """Возвращает значение из кэша (локального, затем общего) или считает его и сохраняет."""
+    version = shared.version(key[1]) if shared else None
+    value, state = _lookup_local(key, today, version)
+    if value is None and version is not None:
+        value = _lookup_shared(state)
+    if value is None:
+        value = compute()
+        if _store(state, value):
+            shared.set(key, version, value, state[3])
+    return value
+
+
+async def cached_async(key: tuple, compute: Callable[[], Awaitable[Any]], today: date) -> Any:
+    """То же для асинхронных эндпоинтов: запросы к Redis - в потоке, а не в event loop."""
+    version = None
+    if shared:
+        fresh, version = shared.known_version(key[1])
+        if not fresh:
+            version = await asyncio.to_thread(shared.version, key[1])
+    value, state = _lookup_local(key, today, version)
+    if value is None and version is not None:
+        value = await asyncio.to_thread(_lookup_shared, state)
+    if value is None:
+        value = await compute()
+        if _store(state, value):
+            await asyncio.to_thread(shared.set, key, version, value, state[3])
+    return value
+
+
+def _invalidate(salon_id: int, predicate: Callable[[tuple], bool]):
+    _generations[salon_id] += 1
+    cache.invalidate(lambda key: key[1] == salon_id and predicate(key))
+    if shared:
+        shared.bump(salon_id)
+
+
+def invalidate_appointment(salon_id: int, master_id: Optional[int], start_time: datetime):
+    """Запись создана/изменена/удалена: сбрасываем день мастера и его месяц (включая "любого мастера")."""
+    day = start_time.date()
+    month = day.replace(day=1)
+    _invalidate(salon_id, lambda key: key[0] == "context" or
+                (key[3] in (master_id, None) and key[4] == (day if key[0] == "slots" else month)))
+
+
+def invalidate_master(salon_id: int, master_id: int):
+    """Изменились график мастера или его услуги."""
+    _invalidate(salon_id, lambda key: key[3] in (master_id, None))
+
+
+def invalidate_service(salon_id: int, service_id: int):
+    """Изменилась длительность услуги."""
+    _invalidate(salon_id, lambda key: key[2] in (service_id, None))
+
+
+def invalidate_catalog(salon_id: int):
+    """Добавлены услуга или мастер: меняется только контекст записи."""
+    _invalidate(salon_id, lambda key: key[0] == "context")
+
+
+def invalidate_salon(salon_id: int):
+    _invalidate(salon_id, lambda key: True)
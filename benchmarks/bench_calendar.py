@@ -0,0 +1,60 @@
+# benchmarks/bench_calendar.py - Микробенчмарк сборки клавиатуры календаря.
+#
+# Сравнивает сборку месяца с нуля (как раньше на каждый cal_nav/master_select)
+# с наложением активных дней на закэшированный шаблон месяца.
+#
+# Запуск:
+#   python benchmarks/bench_calendar.py --renders 20000
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import keyboards  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--renders", type=int, default=20000, help="сколько клавиатур собрать")
+    parser.add_argument("--months", type=int, default=3, help="сколько разных месяцев листают пользователи")
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args()
+
+
+def workload(args):
+    rnd = random.Random(args.seed)
+    months = [(2026, m) for m in range(1, args.months + 1)]
+    return [(*rnd.choice(months), set(rnd.sample(range(1, 29), rnd.randint(0, 20)))) for _ in range(args.renders)]
+
+
+def run(calls, serialize: bool, cold: bool) -> float:
+    started = time.perf_counter()
+    for year, month, days in calls:
+        if cold:
+            keyboards._month_template.cache_clear()
+        markup = keyboards.create_calendar_keyboard(year, month, days)
+        if serialize:
+            # Так клавиатура уходит в Telegram (editMessageText)
+            markup.model_dump_json(exclude_none=True)
+    return (time.perf_counter() - started) / len(calls) * 1e6
+
+
+def main():
+    args = parse_args()
+    calls = workload(args)
+    print(f"Клавиатур: {args.renders}, месяцев: {args.months}")
+    print(f"{'режим':<34}{'мкс/клавиатура':>16}{'клавиатур/с':>14}")
+    for serialize in (False, True):
+        cold = run(calls, serialize, cold=True)
+        warm = run(calls, serialize, cold=False)
+        suffix = " + JSON" if serialize else ""
+        for name, value in ((f"сборка с нуля{suffix}", cold), (f"шаблон из кэша{suffix}", warm)):
+            print(f"{name:<34}{value:>16.1f}{1e6 / value:>14.0f}")
+        print(f"{'ускорение' + suffix:<34}{cold / warm:>15.1f}x")
+
+
+if __name__ == "__main__":
+    main()
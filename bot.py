@@ -1,98 +1,224 @@
 import asyncio
 import logging
-import sys
+import signal
+import socket
 import locale
-from aiogram import Bot, Dispatcher, types
+import time
+from typing import Optional
+from aiogram import Bot, Dispatcher
 from aiogram.fsm.storage.redis import RedisStorage
 from redis.asyncio.client import Redis
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
 
-from config import REDIS_HOST, REDIS_PORT, DATABASE_URL
-from middleware import SalonContextMiddleware
+from config import REDIS_HOST, REDIS_PORT, BOT_MODE, BOT_WORKERS, BOT_METRICS_PORT, WEBHOOK_HOST, WEBHOOK_PORT
+from database import SessionLocal, engine
+from middleware import (SalonContextMiddleware, UserSerialMiddleware, UpdateMetricsMiddleware, HandlerMetricsMiddleware,
+                        TelegramSpanMiddleware)
+import metrics
+import tracing
+from log_config import setup_logging
 import models
+from bot_registry import BotRegistry
 from handlers import common, appointments, booking
+from services.api_client import api_client
+from services.yandex_client import yandex_gpt_client
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+setup_logging("bot")
+tracing.configure("bot")
+logger = logging.getLogger(__name__)
 
-# Функция для проверки количества салонов в базе
-def get_active_salons_count():
+# Активные салоны из базы: {salon_id: telegram_token}.
+# Движок один на процесс (database.engine): соединения берутся из его пула, а не открываются заново
+def get_active_salons():
+    session = SessionLocal()
     try:
-        engine = create_engine(DATABASE_URL)
-        Session = sessionmaker(bind=engine)
-        session = Session()
-        count = session.query(models.Salon).filter(models.Salon.is_active == True).count()
+        rows = session.query(models.Salon.id, models.Salon.telegram_token).filter(models.Salon.is_active == True).all()
+        return {salon_id: token for salon_id, token in rows if token}
+    finally:
         session.close()
-        return count
-    except Exception as e:
-        logging.error(f"DB Error check: {e}")
-        return 0
-
-async def main():
-    # 1. Получаем салоны
-    engine = create_engine(DATABASE_URL)
-    Session = sessionmaker(bind=engine)
-    session = Session()
-    salons = session.query(models.Salon).filter(models.Salon.is_active == True).all()
-    session.close()
-
-    if not salons:
-        logging.warning("Нет активных салонов. Ожидание...")
-        # Если салонов нет, просто ждем 10 сек и перезапускаемся, вдруг появятся
-        await asyncio.sleep(10)
-        sys.exit(0) 
-
-    logging.info(f"Найдено активных салонов: {len(salons)}")
-
-    # 2. Инициализация
-    storage = RedisStorage(redis=Redis(host=REDIS_HOST, port=REDIS_PORT))
+
+
+async def load_active_salons():
+    # Синхронный запрос к БД - вне event loop, чтобы не тормозить ботов
+    return await asyncio.to_thread(get_active_salons)
+
+
+async def on_startup():
+    await api_client.start()
+    await yandex_gpt_client.start()
+
+
+async def on_shutdown():
+    # Закрываем пулы HTTP-соединений (keep-alive к API и YandexGPT)
+    await api_client.close()
+    await yandex_gpt_client.close()
+    engine.dispose()
+
+
+def build_dispatcher(storage) -> Dispatcher:
     dp = Dispatcher(storage=storage)
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
     dp.update.outer_middleware(SalonContextMiddleware())
-    
-    dp.include_router(booking.router)
-    dp.include_router(appointments.router)
-    dp.include_router(common.router)
-
-    # 3. Создаем ботов
-    bots = []
-    for salon in salons:
-        try:
-            bot = Bot(token=salon.telegram_token)
-            await bot.delete_webhook(drop_pending_updates=True)
-            # Устанавливаем команды для каждого бота
-            await bot.set_my_commands([
-                types.BotCommand(command="start", description="Начало"),
-                types.BotCommand(command="book", description="Запись"),
-                types.BotCommand(command="my_appointments", description="Мои записи"),
-                types.BotCommand(command="cancel", description="Отмена")
-            ])
-            bots.append(bot)
-        except Exception as e:
-            logging.error(f"Ошибка при запуске бота для {salon.name}: {e}")
-
-    if not bots:
-        logging.error("Не удалось запустить ни одного бота.")
-        sys.exit(1)
-
-    # 4. Запускаем Polling в фоновом режиме
-    polling_task = asyncio.create_task(dp.start_polling(*bots))
-    
-    # 5. Цикл слежения за новыми салонами (Hot Reload)
-    initial_count = len(salons)
-    logging.info("Бот запущен. Слежу за изменениями в БД...")
-    
-    while True:
-        await asyncio.sleep(10) # Проверяем каждые 10 секунд
-        current_count = get_active_salons_count()
-        
-        if current_count != initial_count:
-            logging.info("Обнаружено изменение количества салонов! Перезагрузка...")
-            polling_task.cancel() # Останавливаем текущих ботов
-            sys.exit(0) # Завершаем процесс. Docker (restart: always) запустит его заново.
+    dp.update.outer_middleware(UserSerialMiddleware())
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
 
-if __name__ == "__main__":
+    for name, module in (("booking", booking), ("appointments", appointments), ("common", common)):
+        # Внутренние middleware срабатывают только для хендлеров своего роутера
+        module.router.message.middleware(HandlerMetricsMiddleware(name))
+        module.router.callback_query.middleware(HandlerMetricsMiddleware(name))
+        dp.include_router(module.router)
+    return dp
+
+
+async def serve_metrics(port: int):
+    """GET /metrics процесса ботов для Prometheus"""
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(body=metrics.registry.render().encode(), headers={"Content-Type": metrics.CONTENT_TYPE})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, port=port).start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def make_bot(token: str) -> Bot:
+    bot = Bot(token)
+    bot.session.middleware(TelegramSpanMiddleware())
+    return bot
+
+
+async def serve_webhook(receiver):
+    """Вместо getUpdates на каждого бота - один HTTP-сервер для всех салонов"""
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(receiver, host=WEBHOOK_HOST, port=WEBHOOK_PORT, log_level="warning"))
+    await server.serve()
+
+
+async def main(worker_index: Optional[int] = None):
+    # 1. Инициализация
+    redis = Redis(host=REDIS_HOST, port=REDIS_PORT)
+    dp = build_dispatcher(RedisStorage(redis=redis))
+
+    membership = None
+    if worker_index is not None:
+        # Воркер супервизора: только свои салоны по кольцу живых воркеров, FSM общий в Redis
+        from sharding import WorkerMembership
+        membership = WorkerMembership(redis, f"{socket.gethostname()}-{worker_index}")
+        await membership.heartbeat()  # узнаем состав до первой сверки, иначе возьмем чужие салоны
+
+        async def load_owned_salons():
+            await membership.refresh()
+            salons = await load_active_salons()
+            return {salon_id: token for salon_id, token in salons.items() if membership.owns(salon_id)}
+
+    receiver = None
+    if BOT_MODE == "webhook":
+        from webhook import WebhookReceiver, check_config
+        check_config()
+        receiver = WebhookReceiver(dp)
+    registry = BotRegistry(dp, receiver, bot_factory=make_bot, on_catalog_changed=api_client.invalidate_catalog)
+
+    # SIGTERM от docker - штатная остановка с отработкой уже принятых обновлений
+    main_task = asyncio.current_task()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, main_task.cancel)
+
+    await dp.emit_startup(dispatcher=dp)
+    # 2. Боты запускаются и останавливаются по одному при изменении салонов (Hot Reload)
+    if membership is not None:
+        load_salons = load_owned_salons
+    else:
+        load_salons = load_active_salons
+    tasks = [asyncio.create_task(registry.watch(load_salons, redis))]
+    if membership is not None:
+        tasks.append(asyncio.create_task(membership.run()))
+    if receiver is not None:
+        tasks.append(asyncio.create_task(serve_webhook(receiver)))
+    if BOT_METRICS_PORT:
+        tasks.append(asyncio.create_task(serve_metrics(BOT_METRICS_PORT + (worker_index or 0))))
+    logger.info("Бот запущен. Слежу за изменениями салонов...")
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await registry.stop()
+        if membership is not None:
+            await membership.leave()
+        if receiver is not None:
+            await receiver.wait_pending()
+        await dp.emit_shutdown(dispatcher=dp)
+        await dp.storage.close()
+
+
+def run_worker(worker_index: Optional[int] = None):
     try:
         locale.setlocale(locale.LC_TIME, 'ru_RU.UTF-8')
     except:
         pass
-    asyncio.run(main())
+    try:
+        asyncio.run(main(worker_index))
+    except asyncio.CancelledError:
+        pass
+
+
+def supervise(workers: int, target=run_worker, restart_delay: float = 5.0, poll_interval: float = 1.0):
+    """Запускает workers процессов-ботов (target(index)) и перезапускает упавшие.
+
+    Пока упавший воркер не поднят, его салоны через BOT_WORKER_TTL разбирают остальные.
+    """
+    import multiprocessing
+
+    ctx = multiprocessing.get_context("spawn")
+    processes = {}
+    started_at = {}
+    stopping = False
+
+    def start(index):
+        process = ctx.Process(target=target, args=(index,), name=f"bot-worker-{index}")
+        process.start()
+        processes[index], started_at[index] = process, time.monotonic()
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for process in processes.values():
+            if process.is_alive():
+                process.terminate()  # SIGTERM: воркер штатно останавливает своих ботов
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for index in range(workers):
+        start(index)
+    logger.info(f"Супервизор: запущено воркеров ботов: {workers}")
+
+    while not stopping:
+        time.sleep(poll_interval)
+        for index, process in list(processes.items()):
+            # Не перезапускаем чаще раза в restart_delay секунд, если воркер падает сразу при старте
+            if not stopping and not process.is_alive() and time.monotonic() - started_at[index] > restart_delay:
+                logger.error(f"Воркер ботов {index} завершился (код {process.exitcode}), перезапуск")
+                start(index)
+    for process in processes.values():
+        process.join()
+
+
+if __name__ == "__main__":
+    if BOT_WORKERS > 1 and BOT_MODE != "webhook":
+        supervise(BOT_WORKERS)
+    else:
+        if BOT_WORKERS > 1:
+            logger.warning("BOT_WORKERS > 1 поддерживается только в режиме polling, запускаю один процесс")
+        run_worker()
@@ -0,0 +1,195 @@
+# bot_registry.py - Запущенные боты салонов внутри одного Dispatcher.
+# Список активных салонов сверяется по (id, token): новые боты запускаются, удаленные
+# и сменившие токен - останавливаются, остальные продолжают работать без перезапуска.
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+from aiogram import Bot, Dispatcher, types
+from aiogram.methods import GetUpdates
+
+from config import SALON_RESYNC_SECONDS
+from salon_events import SALONS_CHANNEL, CATALOG_CHANNEL
+
+logger = logging.getLogger(__name__)
+
+POLLING_TIMEOUT = 30  # секунд long polling getUpdates
+FEED_DRAIN_TIMEOUT = 30  # секунд на обработку уже полученных обновлений останавливаемого бота
+
+BOT_COMMANDS = [
+    types.BotCommand(command="start", description="Начало"),
+    types.BotCommand(command="book", description="Запись"),
+    types.BotCommand(command="my_appointments", description="Мои записи"),
+    types.BotCommand(command="cancel", description="Отмена"),
+]
+
+
+async def drain(tasks: Set[asyncio.Task], timeout: float = FEED_DRAIN_TIMEOUT):
+    """Дожидается задач обработки обновлений; не успевшие за timeout - отменяет"""
+    if not tasks:
+        return
+    _, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class BotRegistry:
+    """Боты салонов {salon_id: Bot}; в режиме вебхуков обновления приходят через receiver."""
+
+    def __init__(self, dp: Dispatcher, receiver=None, bot_factory: Callable[[str], Bot] = Bot,
+                 on_catalog_changed: Optional[Callable[[str], None]] = None):
+        self.dp = dp
+        self.on_catalog_changed = on_catalog_changed  # (token) - сброс кэша справочников салона
+        self.receiver = receiver            # webhook.WebhookReceiver или None (polling)
+        self.bot_factory = bot_factory
+        self.bots: Dict[int, Bot] = {}
+        self._polling: Dict[int, asyncio.Task] = {}
+        self._updates: Dict[int, Set[asyncio.Task]] = {}  # salon_id -> обработка обновлений его бота
+        self._lock = asyncio.Lock()         # сверки из pub/sub и по таймеру не пересекаются
+
+    async def sync(self, salons: Dict[int, str]):
+        """Приводит запущенных ботов к набору {salon_id: token}"""
+        async with self._lock:
+            for salon_id in [s for s, bot in self.bots.items() if salons.get(s) != bot.token]:
+                await self.stop_bot(salon_id)
+            for salon_id, token in salons.items():
+                if salon_id not in self.bots:
+                    await self.start_bot(salon_id, token)
+
+    async def start_bot(self, salon_id: int, token: str) -> bool:
+        bot = self.bot_factory(token)
+        try:
+            await bot.set_my_commands(BOT_COMMANDS)
+            # Очередь обновлений не сбрасываем: это сообщения клиентов, пришедшие во время
+            # деплоя/перезапуска или пока бот работал на другом воркере (ребалансировка)
+            if self.receiver is not None:
+                await self.receiver.set_webhook(salon_id, bot, drop_pending_updates=False)
+            else:
+                await bot.delete_webhook(drop_pending_updates=False)
+                self._polling[salon_id] = asyncio.create_task(self._poll(salon_id, bot))
+        except Exception as e:
+            # Не добавляем в реестр - следующая сверка попробует снова
+            logger.error(f"Ошибка при запуске бота салона {salon_id}: {e}")
+            await bot.session.close()
+            return False
+        self.bots[salon_id] = bot
+        logger.info(f"Бот салона {salon_id} запущен")
+        return True
+
+    async def stop_bot(self, salon_id: int, delete_webhook: bool = True):
+        """delete_webhook=False - остановка процесса: вебхук остается, и Telegram копит
+        обновления до следующего запуска; снимаем его, только если салон удален или сменил токен"""
+        bot = self.bots.pop(salon_id)
+        task = self._polling.pop(salon_id, None)
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        if self.receiver is not None:
+            self.receiver.remove_bot(salon_id)
+        # Хендлеры уже полученных обновлений отвечают через сессию бота - закрываем ее после них
+        updates = self._updates.pop(salon_id, set())
+        if self.receiver is not None:
+            updates |= self.receiver.pending(salon_id)
+        await drain(updates)
+        if self.receiver is not None and delete_webhook:
+            try:
+                # Иначе Telegram продолжит слать обновления отключенного салона
+                await bot.delete_webhook()
+            except Exception as e:
+                logger.warning(f"Не удалось снять вебхук бота салона {salon_id}: {e}")
+        await bot.session.close()
+        logger.info(f"Бот салона {salon_id} остановлен")
+
+    async def stop(self):
+        async with self._lock:
+            for salon_id in list(self.bots):
+                await self.stop_bot(salon_id, delete_webhook=False)
+
+    async def _poll(self, salon_id: int, bot: Bot):
+        offset: Optional[int] = None
+        failures = 0
+        while True:
+            try:
+                updates = await bot(
+                    GetUpdates(offset=offset, timeout=POLLING_TIMEOUT, allowed_updates=self.dp.resolve_used_update_types()),
+                    request_timeout=int(bot.session.timeout + POLLING_TIMEOUT),
+                )
+                failures = 0
+            except Exception as e:
+                failures += 1
+                delay = min(2 ** failures, 60)
+                logger.error(f"getUpdates бота салона {salon_id}: {e}, повтор через {delay} с")
+                await asyncio.sleep(delay)
+                continue
+            for update in updates:
+                offset = update.update_id + 1
+                task = asyncio.create_task(self._feed(salon_id, bot, update))
+                tasks = self._updates.setdefault(salon_id, set())
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+    async def _feed(self, salon_id: int, bot: Bot, update: types.Update):
+        try:
+            await self.dp.feed_update(bot, update, salon_id=salon_id)
+        except Exception as e:
+            logger.error(f"Ошибка обработки обновления {update.update_id}: {e}", exc_info=True)
+
+    async def watch(self, load_salons: Callable[[], Awaitable[Dict[int, str]]], redis=None):
+        """Сверяет салоны при уведомлении из API и не реже, чем раз в SALON_RESYNC_SECONDS"""
+        pubsub = None
+        if redis is not None:
+            try:
+                pubsub = redis.pubsub()
+                await pubsub.subscribe(SALONS_CHANNEL, CATALOG_CHANNEL)
+            except Exception as e:
+                logger.warning(f"Подписка на изменения салонов недоступна, только сверка по таймеру: {e}")
+                pubsub = None
+        try:
+            while True:
+                try:
+                    await self.sync(await load_salons())
+                except Exception as e:
+                    logger.error(f"Не удалось получить список салонов: {e}")
+                await self._wait_for_change(pubsub)
+        finally:
+            if pubsub is not None:
+                await pubsub.aclose()
+
+    def _catalog_message(self, message) -> bool:
+        """Сообщение об изменении услуг/мастеров салона: сбрасываем кэш, сверка салонов не нужна"""
+        channel = message["channel"]
+        if (channel.decode() if isinstance(channel, bytes) else channel) != CATALOG_CHANNEL:
+            return False
+        try:
+            bot = self.bots.get(int(message["data"]))
+        except ValueError:
+            return True
+        # Салон другого воркера: в кэше этого процесса его справочников нет
+        if bot is not None and self.on_catalog_changed is not None:
+            self.on_catalog_changed(bot.token)
+        return True
+
+    async def _wait_for_change(self, pubsub):
+        if pubsub is None:
+            await asyncio.sleep(SALON_RESYNC_SECONDS)
+            return
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + SALON_RESYNC_SECONDS
+        try:
+            while True:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=max(0.0, deadline - loop.time()))
+                if message is None:
+                    if loop.time() >= deadline:
+                        return
+                    continue
+                if not self._catalog_message(message):
+                    break
+            # Пачку изменений (например, массовое редактирование) обрабатываем одной сверкой
+            while message is not None:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=0.5)
+                if message is not None:
+                    self._catalog_message(message)
+        except Exception as e:
+            logger.warning(f"Ошибка подписки на изменения салонов: {e}")
+            await asyncio.sleep(SALON_RESYNC_SECONDS)
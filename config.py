@@ -12,15 +12,107 @@ DB_HOST = os.getenv("DB_HOST", "localhost")
 DB_PORT = os.getenv("DB_PORT", "6432" if "yandexcloud" in str(DB_HOST) else "5432")
 
 DATABASE_URL = f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+# Полный URL перекрывает DB_* (локальные прогоны и бенчмарки, в т.ч. на SQLite)
+DATABASE_URL = os.getenv("DB_URL") or DATABASE_URL
+
+# Пул соединений. За pgbouncer (порт 6432) удобнее DB_PGBOUNCER_MODE=true:
+# без собственного пула (NullPool) и без prepared statements у asyncpg
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 30))     # секунд ожидания свободного соединения
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))   # пересоздавать соединения старше N секунд
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+DB_PGBOUNCER_MODE = os.getenv("DB_PGBOUNCER_MODE", "false").lower() in ("1", "true", "yes")
+
+# SQL-запросы дольше порога пишутся в лог вместе с маршрутом API
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", 200))
+
+# Асинхронный режим API (asyncpg): горячие эндпоинты бота работают без пула потоков
+USE_ASYNC_DB = os.getenv("USE_ASYNC_DB", "false").lower() in ("1", "true", "yes")
+ASYNC_DATABASE_URL = DATABASE_URL.replace("+psycopg2", "+asyncpg", 1).replace("sqlite://", "sqlite+aiosqlite://", 1)
 
 # --- Telegram & API ---
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 API_URL = os.getenv("API_URL", "http://api:8000")
 
+# Кэш справочников (услуги, мастера) в ApiClient бота
+CATALOG_CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", 512))
+CATALOG_CACHE_TTL = int(os.getenv("CATALOG_CACHE_TTL", 60))  # секунд
+# Контекст записи (/booking-context) содержит активные дни - держим его меньше справочников
+BOOKING_CONTEXT_TTL = int(os.getenv("BOOKING_CONTEXT_TTL", 30))  # секунд
+# Активные дни месяца (в т.ч. заранее загруженный следующий месяц календаря)
+ACTIVE_DAYS_CACHE_TTL = int(os.getenv("ACTIVE_DAYS_CACHE_TTL", 30))  # секунд
+
+# --- Режим получения обновлений ботами ---
+# polling - getUpdates на каждого бота; webhook - один ASGI-приемник (webhook.py) на все салоны
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")        # публичный https-адрес, например https://bot.example.ru
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")       # путь салона: {WEBHOOK_PATH}/{salon_id}
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")            # из него выводится secret_token каждого бота
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8081))
+
+# Порт /metrics процесса ботов (воркер i супервизора слушает BOT_METRICS_PORT + i); 0 - выключено
+BOT_METRICS_PORT = int(os.getenv("BOT_METRICS_PORT", 9100))
+
+# --- Логирование (log_config.py) ---
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# Уровни отдельных модулей: "httpx=WARNING,services.yandex_client=DEBUG"
+LOG_LEVELS = os.getenv("LOG_LEVELS", "httpx=WARNING")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # json или text
+# Большие данные (ответы YandexGPT, запросы на запись текстом) логируются на DEBUG для этой доли сообщений
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", 0.01))
+LOG_PAYLOAD_MAX_CHARS = int(os.getenv("LOG_PAYLOAD_MAX_CHARS", 2000))
+
+# Спаны бота и API в JSONL (tracing.py) для разбора медленных обновлений; пусто - не пишутся
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "")
+
+# Процессов ботов: салоны делятся между ними консистентным хешированием (sharding.py), только polling
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", 1))
+BOT_WORKER_HEARTBEAT = int(os.getenv("BOT_WORKER_HEARTBEAT", 5))  # секунд между heartbeat в Redis
+BOT_WORKER_TTL = int(os.getenv("BOT_WORKER_TTL", 15))              # без heartbeat дольше - воркер считается мертвым
+
+# Полная сверка списка салонов (в дополнение к уведомлениям из API через Redis pub/sub)
+SALON_RESYNC_SECONDS = int(os.getenv("SALON_RESYNC_SECONDS", 60))
+
+# Повторные нажатия той же inline-кнопки (cal_day:, cal_nav:, time_select:) в этом окне отбрасываются
+CALLBACK_DEBOUNCE_SECONDS = float(os.getenv("CALLBACK_DEBOUNCE_SECONDS", 1.0))
+
+# --- HTTP-клиенты бота (API и YandexGPT), общий транспорт services/transport.py ---
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 100))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", 20))       # простаивающих соединений в пуле
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 30))  # секунд
+# HTTP/2 работает только поверх TLS (YandexGPT) и требует пакета h2 (httpx[http2])
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "false").lower() in ("1", "true", "yes")
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 3))
+API_TIMEOUT = float(os.getenv("API_TIMEOUT", 10))                  # секунд на ответ API
+API_NATURAL_TIMEOUT = float(os.getenv("API_NATURAL_TIMEOUT", 20))  # запись по тексту дольше обычной
+YANDEX_GPT_TIMEOUT = float(os.getenv("YANDEX_GPT_TIMEOUT", 20))
+# Повторы идемпотентных GET: не больше HTTP_RETRY_ATTEMPTS на запрос и не больше
+# HTTP_RETRY_BUDGET_RATIO от общего числа запросов (чтобы повторы не добивали лежащий API)
+HTTP_RETRY_ATTEMPTS = int(os.getenv("HTTP_RETRY_ATTEMPTS", 2))
+HTTP_RETRY_BUDGET_RATIO = float(os.getenv("HTTP_RETRY_BUDGET_RATIO", 0.2))
+HTTP_RETRY_BACKOFF = float(os.getenv("HTTP_RETRY_BACKOFF", 0.2))    # базовая пауза, секунд
+
 # --- YandexGPT ---
 YANDEX_API_KEY = os.getenv("YANDEX_API_KEY")
 YANDEX_FOLDER_ID = os.getenv("YANDEX_FOLDER_ID")
 
+# --- Кэш доступности (слоты и активные дни) ---
+AVAILABILITY_CACHE_SIZE = int(os.getenv("AVAILABILITY_CACHE_SIZE", 4096))
+AVAILABILITY_CACHE_TTL = int(os.getenv("AVAILABILITY_CACHE_TTL", 600))              # секунд
+AVAILABILITY_CACHE_TODAY_TTL = int(os.getenv("AVAILABILITY_CACHE_TODAY_TTL", 60))  # для сегодняшнего дня
+# "memory" - только в процессе; "redis" - плюс общий кэш для нескольких воркеров/реплик API
+AVAILABILITY_CACHE_BACKEND = os.getenv("AVAILABILITY_CACHE_BACKEND", "memory")
+# Как часто воркер перечитывает из Redis версию кэша салона; запись в другом воркере
+# становится видна не позже чем через столько секунд (записи своего воркера - сразу)
+AVAILABILITY_VERSION_REFRESH = float(os.getenv("AVAILABILITY_VERSION_REFRESH", 1.0))
+
+# --- Кэш авторизации салонов (токен бота / логин админа -> снимок салона) ---
+# Изменения салона в другом воркере API станут видны не позже, чем через TTL
+SALON_CACHE_SIZE = int(os.getenv("SALON_CACHE_SIZE", 1024))
+SALON_CACHE_TTL = int(os.getenv("SALON_CACHE_TTL", 60))  # секунд
+
 # --- Redis ---
 REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
 REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
@@ -1,7 +1,71 @@
+import logging
 import os
-from sqlalchemy import create_engine
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Optional
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.orm import sessionmaker, declarative_base # <-- ИЗМЕНЕНИЕ
-from config import DATABASE_URL
+from sqlalchemy.pool import NullPool, QueuePool, AsyncAdaptedQueuePool
+from config import (DATABASE_URL, USE_ASYNC_DB, ASYNC_DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW,
+                    DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING, DB_PGBOUNCER_MODE, SLOW_QUERY_MS)
+
+logger = logging.getLogger(__name__)
+
+
+class _WaitTimingMixin:
+    """Считает получения соединений из пула и сколько запросы ждали свободное соединение.
+
+    checkouts - все получения; waits - только те, что ждали дольше WAIT_THRESHOLD
+    (пул исчерпан или открывается новое соединение).
+    """
+    WAIT_THRESHOLD = 0.001  # секунд
+    checkouts = 0
+    waits = 0
+    wait_time_total = 0.0
+    wait_time_max = 0.0
+    timeouts = 0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            self.checkouts += 1
+            if waited > self.WAIT_THRESHOLD:
+                self.waits += 1
+            self.wait_time_total += waited
+            self.wait_time_max = max(self.wait_time_max, waited)
+
+
+class TimedQueuePool(_WaitTimingMixin, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(_WaitTimingMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def _pool_kwargs(poolclass) -> dict:
+    # За pgbouncer (Яндекс, порт 6432) пулом управляет он сам: держим соединение
+    # только на время запроса, иначе после простоя получаем протухшие соединения
+    if DB_PGBOUNCER_MODE:
+        return {"poolclass": NullPool}
+    return {
+        "poolclass": poolclass,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
 
 # Настройки подключения
 connect_args = {}
@@ -11,11 +75,108 @@ if ":6432" in DATABASE_URL:
         "sslmode": "verify-full",
         "sslrootcert": "root.crt"
     }
+elif DATABASE_URL.startswith("sqlite"):
+    # Эндпоинты работают в пуле потоков
+    connect_args = {"check_same_thread": False, "timeout": 30}
 
 engine = create_engine(
     DATABASE_URL,
-    connect_args=connect_args
+    connect_args=connect_args,
+    **_pool_kwargs(TimedQueuePool)
 )
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base() # <-- ИЗМЕНЕНИЕ
+
+# --- Асинхронный движок (asyncpg), включается USE_ASYNC_DB ---
+async_engine = None
+AsyncSessionLocal = None
+
+if USE_ASYNC_DB:
+    import ssl
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+    async_connect_args = {}
+    if ":6432" in ASYNC_DATABASE_URL:
+        # asyncpg не понимает sslmode/sslrootcert, ему нужен SSLContext (аналог verify-full)
+        async_connect_args = {"ssl": ssl.create_default_context(cafile="root.crt")}
+    if DB_PGBOUNCER_MODE:
+        # pgbouncer в режиме транзакций не переносит именованные prepared statements asyncpg
+        async_connect_args.update({
+            "statement_cache_size": 0,
+            "prepared_statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__",
+        })
+
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, connect_args=async_connect_args, **_pool_kwargs(TimedAsyncQueuePool))
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+
+def pool_stats(db_engine) -> dict:
+    """Текущее состояние пула соединений движка (для подбора числа воркеров)"""
+    pool = db_engine.pool
+    stats = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": max(pool.overflow(), 0),
+            "max_overflow": pool._max_overflow,
+        })
+    if isinstance(pool, _WaitTimingMixin):
+        stats.update({
+            "checkouts": pool.checkouts,
+            "waits": pool.waits,
+            "wait_time_total_ms": round(pool.wait_time_total * 1000, 3),
+            "wait_time_max_ms": round(pool.wait_time_max * 1000, 3),
+            "timeouts": pool.timeouts,
+        })
+    return stats
+
+
+# --- Учет SQL-запросов в пределах HTTP-запроса (Server-Timing, лог медленных запросов) ---
+class QueryStats:
+    """Счетчики SQL одного HTTP-запроса; scope - ASGI scope, из него берется маршрут для лога"""
+
+    def __init__(self, scope: Optional[dict] = None):
+        self.count = 0
+        self.total = 0.0
+        self.scope = scope or {}
+
+    @property
+    def route(self) -> str:
+        route = self.scope.get("route")
+        path = getattr(route, "path", None) or self.scope.get("path", "-")
+        return f"{self.scope.get('method', '')} {path}".strip()
+
+
+# Middleware API кладет сюда объект на время запроса. Синхронные эндпоинты работают
+# в пуле потоков с копией контекста, поэтому объект изменяется на месте, а не заменяется
+current_query_stats: ContextVar[Optional[QueryStats]] = ContextVar("current_query_stats", default=None)
+
+
+# Слушатели на классе Engine: срабатывают и для engine, и для async_engine (его sync_engine)
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    stats = current_query_stats.get()
+    if stats is not None:
+        stats.count += 1
+        stats.total += elapsed
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        route = stats.route if stats is not None else "вне запроса"
+        logger.warning(f"Медленный SQL-запрос {elapsed * 1000:.1f} мс [{route}]: {' '.join(statement.split())[:500]}")
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(exception_context):
+    # after_cursor_execute при ошибке не вызывается - снимаем отметку времени сами
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_started"):
+        conn.info["query_started"].pop()
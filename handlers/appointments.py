@@ -7,6 +7,8 @@ import logging
 
 from services.api_client import api_client
 
+logger = logging.getLogger(__name__)
+
 router = Router()
 
 @router.message(Command("my_appointments"))
@@ -34,7 +36,7 @@ async def show_my_appointments(message: types.Message, salon_token: str):
             await message.answer(response_text, reply_markup=builder.as_markup(), parse_mode="Markdown")
             
     except (httpx.RequestError, httpx.HTTPStatusError) as e:
-        logging.error(f"Error fetching appointments: {e}")
+        logger.error(f"Error fetching appointments: {e}")
         await message.answer("Ой, не удалось загрузить записи. Попробуйте чуть позже! 🙏")
 
 @router.callback_query(F.data.startswith("cancel_appt:"))
@@ -45,6 +47,6 @@ async def cancel_appointment_handler(callback: types.CallbackQuery, salon_token:
         await api_client.delete_appointment(appointment_id, token=salon_token)
         await callback.message.edit_text("Готово! Ваша запись отменена. Будем ждать вас в другой раз! 💖")
     except (httpx.RequestError, httpx.HTTPStatusError) as e:
-        logging.error(f"Error deleting appointment: {e}")
+        logger.error(f"Error deleting appointment: {e}")
         await callback.message.edit_text("Что-то пошло не так, и не получилось отменить запись. Пожалуйста, попробуйте еще раз или свяжитесь с нами напрямую. 😥")
     await callback.answer()
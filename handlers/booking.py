@@ -13,15 +13,58 @@ from fsm import AppointmentStates
 from keyboards import create_calendar_keyboard
 from services.api_client import api_client
 
+logger = logging.getLogger(__name__)
+
 router = Router()
 
+
+def _context_active_days(context: dict, service_id: int, master_id, year: int, month: int):
+    """Активные дни из контекста записи или None, если такого месяца в нем нет"""
+    for entry in context["active_days"]:
+        if (entry["service_id"], entry["master_id"], entry["year"], entry["month"]) == (service_id, master_id, year, month):
+            return entry["days"]
+    return None
+
+
+def _master_name(context: dict, master_id: int):
+    return next((m["name"] for m in context["masters"] if m["id"] == master_id), None)
+
+
+def _next_month(year: int, month: int):
+    return (year, month + 1) if month < 12 else (year + 1, 1)
+
+
+async def _show_calendar(callback: types.CallbackQuery, context: dict, salon_token: str, service_id: int,
+                         master_id, master_name: str, year: int, month: int):
+    active_days = _context_active_days(context, service_id, master_id, year, month)
+    if active_days is None:
+        # Месяца нет в контексте (дальше следующего или контекст получен в прошлом месяце)
+        active_days = await api_client.get_active_days(service_id, year, month, token=salon_token, master_id=master_id)
+    calendar_kb = create_calendar_keyboard(year, month, set(active_days))
+    back_button = types.InlineKeyboardButton(
+        text="◀️ Назад к мастерам", callback_data="back_to_master"
+    )
+    calendar_kb.inline_keyboard.append([back_button])
+
+    await callback.message.edit_text(
+        f"Мастер: **{master_name}**.\nТеперь выберите удобную дату: 🗓️",
+        reply_markup=calendar_kb,
+        parse_mode="Markdown"
+    )
+    # Пока пользователь смотрит месяц, загружаем следующий - "Вперед >" откроется без ожидания
+    next_year, next_month = _next_month(year, month)
+    if _context_active_days(context, service_id, master_id, next_year, next_month) is None:
+        api_client.prefetch_active_days(service_id, next_year, next_month, token=salon_token, master_id=master_id)
+
 # Шаг 1: /book
 @router.message(Command("book"))
 async def start_booking(message: types.Message, state: FSMContext, salon_token: str):
     await state.clear()
     await state.set_state(AppointmentStates.choosing_service)
     try:
-        services = await api_client.get_services(token=salon_token)
+        # Услуги, мастера и календарь берем из одного ответа /booking-context
+        context = await api_client.get_booking_context(token=salon_token)
+        services = context["services"]
         builder = InlineKeyboardBuilder()
         for service in services:
             builder.button(
@@ -34,7 +77,7 @@ async def start_booking(message: types.Message, state: FSMContext, salon_token:
             reply_markup=builder.as_markup(),
         )
     except (httpx.RequestError, httpx.HTTPStatusError) as e:
-        logging.error(f"API Error: {e}")
+        logger.error(f"API Error: {e}")
         await message.answer(
             "Ой, не могу сейчас загрузить список наших прекрасных услуг. Попробуйте, пожалуйста, через минутку! 😔"
         )
@@ -49,10 +92,12 @@ async def service_selected(callback: types.CallbackQuery, state: FSMContext, sal
     service_id = int(callback.data.split(":")[1])
     
     try:
-        services = await api_client.get_services(token=salon_token)
-        selected_service = next((s for s in services if s['id'] == service_id), None)
+        context = await api_client.get_booking_context(token=salon_token)
+        selected_service = next((s for s in context["services"] if s['id'] == service_id), None)
         
         if not selected_service:
+            # Список услуг мог устареть в кэше - следующий запрос возьмет свежий
+            api_client.invalidate_catalog(salon_token)
             await callback.answer("Услуга не найдена", show_alert=True)
             return
 
@@ -62,7 +107,7 @@ async def service_selected(callback: types.CallbackQuery, state: FSMContext, sal
             service_price=selected_service['price']
         )
         
-        masters = await api_client.get_masters_for_service(service_id, token=salon_token)
+        masters = [m for m in context["masters"] if m["id"] in selected_service["master_ids"]]
         
         if not masters:
             await callback.message.edit_text(
@@ -95,7 +140,7 @@ async def service_selected(callback: types.CallbackQuery, state: FSMContext, sal
         await state.set_state(AppointmentStates.choosing_master)
         
     except (httpx.RequestError, httpx.HTTPStatusError) as e:
-        logging.error(f"API Error: {e}")
+        logger.error(f"API Error: {e}")
         await callback.message.edit_text(
             "Простите, не могу загрузить список мастеров. Попробуйте, пожалуйста, еще раз. 🙏"
         )
@@ -114,40 +159,41 @@ async def master_selected_show_calendar(
     master_id_str = callback.data.split(":")[1]
     master_id = None if master_id_str == "any" else int(master_id_str)
     
-    master_name = "Любой мастер"
-    if master_id:
-        try:
-            masters = await api_client.get_all_masters(token=salon_token)
-            found = next((m for m in masters if m['id'] == master_id), None)
-            if found:
-                master_name = found['name']
-        except:
-            pass
-
-    await state.update_data(master_id=master_id, master_name=master_name)
-    
     moscow_tz = ZoneInfo("Europe/Moscow")
     today = datetime.now(moscow_tz).date()
     
     user_data = await state.get_data()
     try:
-        active_days = await api_client.get_active_days(
-            user_data["service_id"], today.year, today.month, token=salon_token, master_id=user_data.get("master_id")
-        )
-        calendar_kb = create_calendar_keyboard(
-            today.year, today.month, set(active_days)
-        )
-        back_button = types.InlineKeyboardButton(
-            text="◀️ Назад к мастерам", callback_data="back_to_master"
-        )
-        calendar_kb.inline_keyboard.append([back_button])
-        
+        context = await api_client.get_booking_context(token=salon_token)
+        master_name = (_master_name(context, master_id) if master_id else None) or "Любой мастер"
+        await state.update_data(master_id=master_id, master_name=master_name)
+
+        await _show_calendar(callback, context, salon_token, user_data["service_id"], master_id, master_name,
+                             today.year, today.month)
+        await state.set_state(AppointmentStates.choosing_date)
+    except (httpx.RequestError, httpx.HTTPStatusError):
         await callback.message.edit_text(
-            f"Мастер: **{master_name}**.\nТеперь выберите удобную дату: 🗓️",
-            reply_markup=calendar_kb,
-            parse_mode="Markdown"
+            "Произошла ошибка при загрузке календаря. Попробуйте снова."
         )
-        await state.set_state(AppointmentStates.choosing_date)
+    finally:
+        await callback.answer()
+
+
+# Листание календаря
+@router.callback_query(AppointmentStates.choosing_date, F.data.startswith("cal_nav:"))
+async def calendar_navigate(callback: types.CallbackQuery, state: FSMContext, salon_token: str):
+    _, year, month = callback.data.split(":")
+    year, month = int(year), int(month)
+    today = datetime.now(ZoneInfo("Europe/Moscow")).date()
+    if (year, month) < (today.year, today.month):
+        await callback.answer("Записаться в прошлое, увы, нельзя 🙂")
+        return
+
+    user_data = await state.get_data()
+    try:
+        context = await api_client.get_booking_context(token=salon_token)
+        await _show_calendar(callback, context, salon_token, user_data["service_id"], user_data.get("master_id"),
+                             user_data.get("master_name", "Любой мастер"), year, month)
     except (httpx.RequestError, httpx.HTTPStatusError):
         await callback.message.edit_text(
             "Произошла ошибка при загрузке календаря. Попробуйте снова."
@@ -224,14 +270,11 @@ async def time_selected(callback: types.CallbackQuery, state: FSMContext, salon_
         user_data = await state.get_data()
         
         master_name = user_data.get("master_name")
-        if user_data.get("master_id") is None or True:
-            try:
-                all_masters = await api_client.get_all_masters(token=salon_token)
-                found = next((m for m in all_masters if m['id'] == selected_master_id), None)
-                if found:
-                    master_name = found['name']
-            except:
-                pass
+        try:
+            context = await api_client.get_booking_context(token=salon_token)
+            master_name = _master_name(context, selected_master_id) or master_name
+        except (httpx.RequestError, httpx.HTTPStatusError):
+            pass
 
         selected_date_obj = date.fromisoformat(user_data["selected_date"])
         formatted_date = selected_date_obj.strftime("%d.%m.%Y")
@@ -255,7 +298,7 @@ async def time_selected(callback: types.CallbackQuery, state: FSMContext, salon_
         await state.set_state(AppointmentStates.confirmation)
         
     except Exception as e:
-        logging.error(f"CRITICAL ERROR in [time_selected]: {e}", exc_info=True)
+        logger.error(f"CRITICAL ERROR in [time_selected]: {e}", exc_info=True)
         await callback.answer(
             "Ой, произошла ошибка. Пожалуйста, начните сначала. /book 🙏",
             show_alert=True,
@@ -326,7 +369,7 @@ async def confirm_booking_handler(callback: types.CallbackQuery, state: FSMConte
         await callback.message.edit_text(
             f"{error_msg}\n\nПожалуйста, выберите другое время: /book"
         )
-        logging.error(f"API Error: {e.response.text}")
+        logger.error(f"API Error: {e.response.text}")
         await state.clear()
     except httpx.RequestError:
         await callback.message.edit_text(
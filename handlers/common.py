@@ -10,6 +10,8 @@ import logging
 
 from fsm import AppointmentStates
 
+logger = logging.getLogger(__name__)
+
 router = Router()
 
 @router.callback_query(F.data.in_({"ignore", "ignore_inactive_day"}))
@@ -154,7 +156,7 @@ async def ai_confirm_handler(callback: types.CallbackQuery, state: FSMContext, s
         await callback.message.edit_text(f"{error_msg}\n\nПопробуйте выбрать другое время: /book")
 
     except Exception as e:
-        logging.error(f"Error in AI confirm: {e}")
+        logger.error(f"Error in AI confirm: {e}")
         await callback.message.edit_text("😔 Произошла техническая ошибка.")
     
     finally:
@@ -0,0 +1,109 @@
+# log_config.py - Логирование API и процесса ботов без блокировки на записи.
+# Хендлер корневого логгера только кладет запись в очередь (QueueHandler), а форматирует
+# и пишет в stderr отдельный поток (QueueListener). Вывод - JSON по строке на запись
+# (LOG_FORMAT=json) или текст; уровни задаются по модулям: LOG_LEVELS="httpx=WARNING,api=DEBUG".
+import atexit
+import copy
+import json
+import logging
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional
+
+from pydantic import BaseModel
+
+from config import LOG_LEVEL, LOG_LEVELS, LOG_FORMAT, LOG_PAYLOAD_SAMPLE_RATE, LOG_PAYLOAD_MAX_CHARS
+import tracing
+
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(name)s - [%(trace_id)s] %(message)s"
+
+# Атрибуты LogRecord; все остальные (переданные через extra=) попадают в JSON отдельными полями
+_RECORD_FIELDS = set(logging.makeLogRecord({}).__dict__) | {"message", "asctime", "trace_id"}
+
+_listener: Optional[QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, service: str):
+        super().__init__()
+        self.service = service
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "service": self.service,
+            "trace_id": getattr(record, "trace_id", "-"),
+            "message": record.getMessage(),
+        }
+        entry.update((k, v) for k, v in record.__dict__.items() if k not in _RECORD_FIELDS)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _QueueHandler(QueueHandler):
+    """Как QueueHandler, но traceback остается отдельным полем (exc), а не частью message"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def parse_levels(spec: str) -> Dict[str, str]:
+    """"httpx=WARNING, services.yandex_client=DEBUG" -> {логгер: уровень}"""
+    levels = {}
+    for item in spec.split(","):
+        name, sep, level = item.partition("=")
+        if sep and name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging(service: str):
+    """Один раз на процесс: корневой логгер пишет через очередь, уровни - из конфига"""
+    global _listener
+    tracing.install_log_correlation()
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL.upper())
+    for name, level in parse_levels(LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level)
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter(service) if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT))
+    records = queue.SimpleQueue()
+    root.addHandler(_QueueHandler(records))
+    _listener = QueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+    # Дописываем то, что осталось в очереди, до выхода процесса
+    atexit.register(_listener.stop)
+
+
+def log_payload(logger: logging.Logger, message: str, payload: Any):
+    """Большие данные (ответы YandexGPT, тела запросов) - на DEBUG и только для доли
+    LOG_PAYLOAD_SAMPLE_RATE сообщений; сериализуются, только если запись будет выведена.
+    payload - строка, dict/list, модель pydantic или функция без аргументов, которая их вернет.
+    """
+    if not logger.isEnabledFor(logging.DEBUG) or random.random() >= LOG_PAYLOAD_SAMPLE_RATE:
+        return
+    if callable(payload):
+        payload = payload()
+    if isinstance(payload, BaseModel):
+        payload = payload.model_dump(mode="json")
+    text = payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False, default=str)
+    if len(text) > LOG_PAYLOAD_MAX_CHARS:
+        text = f"{text[:LOG_PAYLOAD_MAX_CHARS]}... ({len(text)} символов)"
+    logger.debug("%s: %s", message, text)
@@ -1,8 +1,20 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
 from typing import Callable, Dict, Any, Awaitable
 from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
 from aiogram.types import Message, CallbackQuery, TelegramObject
+from config import CALLBACK_DEBOUNCE_SECONDS
+from metrics import registry
+import tracing
 from services.api_client import api_client
 
+logger = logging.getLogger(__name__)
+
 class SalonContextMiddleware(BaseMiddleware):
     async def __call__(
         self,
@@ -25,5 +37,130 @@ class SalonContextMiddleware(BaseMiddleware):
         # Внедряем токен в api_client для этого контекста (немного магии)
         # В идеале api_client должен передаваться в handler, но для совместимости
         # мы будем явно передавать токен в методы api_client в хендлерах
-        
-        return await handler(event, data)
+
+        # Сквозной id обновления: уходит в API заголовком и попадает во все строки лога
+        with tracing.trace() as trace_id:
+            data["trace_id"] = trace_id
+            with tracing.span("update", event=getattr(event, "event_type", None),
+                              update_id=getattr(event, "update_id", None), salon_id=data.get("salon_id")):
+                return await handler(event, data)
+
+
+# Кнопки, повторное нажатие которых запускает ту же цепочку запросов к API
+DEBOUNCE_PREFIXES = ("cal_day:", "cal_nav:", "time_select:")
+
+
+class UserSerialMiddleware(BaseMiddleware):
+    """Одно обновление на пользователя за раз + отбрасывание двойных нажатий.
+
+    Регистрируется на уровне update после SalonContextMiddleware. Ключ пользователя -
+    (бот, user_id): состояние FSM у каждого бота салона свое.
+    """
+
+    def __init__(self, window: float = CALLBACK_DEBOUNCE_SECONDS):
+        self.window = window
+        self._locks: Dict[tuple, asyncio.Lock] = {}
+        self._waiters: Dict[tuple, int] = {}
+        self._recent: "OrderedDict[tuple, float]" = OrderedDict()  # ключ нажатия -> время
+
+    def _is_duplicate(self, key: tuple) -> bool:
+        now = time.monotonic()
+        while self._recent:
+            if now - next(iter(self._recent.values())) < self.window:
+                break
+            self._recent.popitem(last=False)
+        if key in self._recent:
+            return True
+        self._recent[key] = now
+        return False
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        bot = data.get("bot")
+        if user is None or bot is None:
+            return await handler(event, data)
+        user_key = (bot.id, user.id)
+
+        callback = getattr(event, "callback_query", None)
+        if callback is not None and callback.message is not None and (callback.data or "").startswith(DEBOUNCE_PREFIXES):
+            if self._is_duplicate(user_key + (callback.message.message_id, callback.data)):
+                logger.debug(f"Повторное нажатие {callback.data} от {user.id} отброшено")
+                try:
+                    # Убираем "часики" на кнопке, сам хендлер не запускаем
+                    await bot.answer_callback_query(callback.id)
+                except Exception:
+                    pass
+                return None
+
+        lock = self._locks.get(user_key)
+        if lock is None:
+            lock = self._locks[user_key] = asyncio.Lock()
+        self._waiters[user_key] = self._waiters.get(user_key, 0) + 1
+        try:
+            async with lock:
+                return await handler(event, data)
+        finally:
+            self._waiters[user_key] -= 1
+            if not self._waiters[user_key]:
+                # Никто больше не ждет - не держим лок для каждого когда-либо писавшего пользователя
+                del self._waiters[user_key]
+                del self._locks[user_key]
+
+
+BOT_UPDATES = registry.counter("bot_updates_total", "Обновления Telegram по салонам", ("salon_id", "event"))
+BOT_UPDATE_LATENCY = registry.histogram("bot_update_duration_seconds", "Полная обработка обновления", ("event",))
+HANDLER_LATENCY = registry.histogram("bot_handler_duration_seconds", "Время хендлеров по роутерам", ("router", "event"))
+HANDLER_ERRORS = registry.counter("bot_handler_errors_total", "Исключения в хендлерах", ("router", "event"))
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Внешний middleware уровня update: число обновлений по салонам и общее время обработки.
+
+    salon_id передают BotRegistry и WebhookReceiver в dp.feed_update.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        kind = getattr(event, "event_type", "unknown")
+        BOT_UPDATES.inc(salon_id=data.get("salon_id", "unknown"), event=kind)
+        with BOT_UPDATE_LATENCY.time(event=kind):
+            return await handler(event, data)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутренний middleware роутера: вызывается, только если хендлер этого роутера подошел"""
+
+    def __init__(self, router_name: str):
+        self.router_name = router_name
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        kind = type(event).__name__
+        try:
+            with HANDLER_LATENCY.time(router=self.router_name, event=kind), \
+                    tracing.span("handler", router=self.router_name, event=kind):
+                return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(router=self.router_name, event=kind)
+            raise
+
+
+class TelegramSpanMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: время каждого вызова Bot API в спанах обновления"""
+
+    async def __call__(self, make_request: NextRequestMiddlewareType[TelegramType], bot, method: TelegramMethod[TelegramType]):
+        with tracing.span(f"telegram.{method.__api_method__}"):
+            return await make_request(bot, method)
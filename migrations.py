@@ -0,0 +1,107 @@
+# migrations.py - Доводит схему уже существующей БД до models.py.
+# create_all создает только новые таблицы, поэтому новые колонки и индексы
+# существующих таблиц добавляем здесь. Все шаги идемпотентны и выполняются при старте API.
+import logging
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import CreateIndex
+
+from database import Base
+from models import APPOINTMENT_OVERLAP_GUARD
+
+logger = logging.getLogger(__name__)
+
+# (таблица, колонка, DDL-определение)
+ADDED_COLUMNS = [
+    ("salons", "slot_step_minutes", "INTEGER NOT NULL DEFAULT 30"),
+]
+
+
+def missing_indexes(engine: Engine) -> list:
+    """Индексы из models.py, которых еще нет в БД"""
+    inspector = inspect(engine)
+    result = []
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {ix["name"] for ix in inspector.get_indexes(table.name)}
+        result.extend(ix for ix in table.indexes if ix.name not in existing)
+    return result
+
+
+def create_indexes(engine: Engine):
+    for index in missing_indexes(engine):
+        logger.info(f"Миграция: создаю индекс {index.name}")
+        ddl = str(CreateIndex(index).compile(dialect=engine.dialect))
+        if engine.dialect.name == "postgresql":
+            # CONCURRENTLY не блокирует запись в большую таблицу, но не работает внутри транзакции
+            ddl = ddl.replace("CREATE INDEX", "CREATE INDEX CONCURRENTLY IF NOT EXISTS", 1)
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                conn.execute(text(ddl))
+        else:
+            with engine.begin() as conn:
+                conn.execute(text(ddl))
+
+
+# --- Запрет пересечения записей одного мастера на уровне БД ---
+# PostgreSQL: exclusion constraint по (master_id, tsrange). Границы tsrange '[)',
+# так что запись 10:00-11:00 не конфликтует с 11:00-12:00 - как и старая проверка.
+PG_OVERLAP_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS btree_gist",
+    f"ALTER TABLE appointments ADD CONSTRAINT {APPOINTMENT_OVERLAP_GUARD} "
+    "EXCLUDE USING gist (master_id WITH =, tsrange(start_time, end_time) WITH &&)",
+]
+# SQLite (тесты, локальные бенчмарки): то же самое триггерами
+SQLITE_OVERLAP_DDL = [
+    f"""CREATE TRIGGER IF NOT EXISTS {APPOINTMENT_OVERLAP_GUARD}_insert BEFORE INSERT ON appointments
+    WHEN EXISTS (SELECT 1 FROM appointments WHERE master_id = NEW.master_id
+                 AND start_time < NEW.end_time AND end_time > NEW.start_time)
+    BEGIN SELECT RAISE(ABORT, '{APPOINTMENT_OVERLAP_GUARD}'); END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {APPOINTMENT_OVERLAP_GUARD}_update BEFORE UPDATE OF master_id, start_time, end_time ON appointments
+    WHEN EXISTS (SELECT 1 FROM appointments WHERE id != NEW.id AND master_id = NEW.master_id
+                 AND start_time < NEW.end_time AND end_time > NEW.start_time)
+    BEGIN SELECT RAISE(ABORT, '{APPOINTMENT_OVERLAP_GUARD}'); END""",
+]
+
+# Установлено ли ограничение. Если нет (например, в БД уже есть пересечения),
+# API делает прежнюю проверку count() перед вставкой.
+overlap_guard_installed = False
+
+
+def _overlap_guard_exists(conn) -> bool:
+    if conn.dialect.name == "postgresql":
+        sql = "SELECT 1 FROM pg_constraint WHERE conname = :name"
+    else:
+        sql = "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = :name || '_insert'"
+    return conn.execute(text(sql), {"name": APPOINTMENT_OVERLAP_GUARD}).first() is not None
+
+
+def install_overlap_guard(engine: Engine) -> bool:
+    global overlap_guard_installed
+    statements = {"postgresql": PG_OVERLAP_DDL, "sqlite": SQLITE_OVERLAP_DDL}.get(engine.dialect.name)
+    if statements is None:
+        overlap_guard_installed = False
+        return False
+    try:
+        with engine.begin() as conn:
+            if not _overlap_guard_exists(conn):
+                logger.info(f"Миграция: добавляю ограничение {APPOINTMENT_OVERLAP_GUARD}")
+                for ddl in statements:
+                    conn.execute(text(ddl))
+        overlap_guard_installed = True
+    except Exception as e:
+        logger.error(f"Не удалось включить запрет пересечений записей в БД, остается проверка в API: {e}")
+        overlap_guard_installed = False
+    return overlap_guard_installed
+
+
+def run_migrations(engine: Engine):
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table, column, ddl in ADDED_COLUMNS:
+            existing = {c["name"] for c in inspector.get_columns(table)}
+            if column not in existing:
+                logger.info(f"Миграция: добавляю колонку {table}.{column}")
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+    create_indexes(engine)
+    install_overlap_guard(engine)
@@ -1,8 +1,13 @@
+from dataclasses import dataclass
+from typing import Optional
 from sqlalchemy import (Column, Integer, String, Text, ForeignKey, Table,
-                      BigInteger, Time, Date, DateTime, Boolean)
+                      BigInteger, Time, Date, DateTime, Boolean, Index)
 from sqlalchemy.orm import relationship
 from database import Base
 
+# Имя ограничения БД, запрещающего пересечение записей одного мастера (см. migrations.py)
+APPOINTMENT_OVERLAP_GUARD = "appointments_no_overlap"
+
 # Таблица Салонов
 class Salon(Base):
     __tablename__ = "salons"
@@ -12,6 +17,7 @@ class Salon(Base):
     telegram_token = Column(String(255), unique=True, nullable=False)
     admin_password = Column(String(255), nullable=True)
     is_active = Column(Boolean, default=True)
+    slot_step_minutes = Column(Integer, nullable=False, default=30, server_default="30") # Шаг сетки записи
     
     masters = relationship("Master", back_populates="salon")
     services = relationship("Service", back_populates="salon")
@@ -34,6 +40,10 @@ class Client(Base):
     salon = relationship("Salon", back_populates="clients")
     appointments = relationship("Appointment", back_populates="client")
 
+    __table_args__ = (
+        Index("ix_clients_salon_telegram", "salon_id", "telegram_user_id"),  # поиск клиента бота
+    )
+
 class Service(Base):
     __tablename__ = "services"
     id = Column(Integer, primary_key=True, index=True)
@@ -68,6 +78,10 @@ class Schedule(Base):
     end_time = Column(Time, nullable=False)
     master = relationship("Master", back_populates="schedules")
 
+    __table_args__ = (
+        Index("ix_schedules_master_day", "master_id", "day_of_week"),
+    )
+
 class Appointment(Base):
     __tablename__ = "appointments"
     id = Column(Integer, primary_key=True)
@@ -82,3 +96,26 @@ class Appointment(Base):
     client = relationship("Client", back_populates="appointments")
     master = relationship("Master", back_populates="appointments")
     service = relationship("Service", back_populates="appointments")
+
+    __table_args__ = (
+        Index("ix_appointments_master_start", "master_id", "start_time"),  # слоты и проверка пересечений
+        Index("ix_appointments_salon_start", "salon_id", "start_time"),    # расписание дня в админке
+    )
+
+
+@dataclass(frozen=True)
+class SalonSnapshot:
+    """Неизменяемый снимок салона для кэша авторизации (не привязан к сессии БД)."""
+    id: int
+    name: str
+    title: Optional[str]
+    telegram_token: str
+    admin_password: Optional[str]
+    is_active: bool
+    slot_step_minutes: int
+
+    @classmethod
+    def from_model(cls, salon: Salon) -> "SalonSnapshot":
+        return cls(id=salon.id, name=salon.name, title=salon.title, telegram_token=salon.telegram_token,
+                   admin_password=salon.admin_password, is_active=salon.is_active,
+                   slot_step_minutes=salon.slot_step_minutes)
@@ -0,0 +1,38 @@
+# salon_events.py - Уведомление процесса ботов об изменении салонов (Redis pub/sub).
+# API публикует id салона после создания/изменения, bot_registry подписан на канал.
+# Pub/sub не гарантирует доставку, поэтому бот дополнительно сверяет список салонов по таймеру.
+# Изменения услуг, мастеров и графиков идут в CATALOG_CHANNEL: бот сбрасывает кэш справочников
+# салона (ApiClient.invalidate_catalog), не дожидаясь CATALOG_CACHE_TTL.
+import logging
+from typing import Optional
+
+import redis
+
+from config import REDIS_HOST, REDIS_PORT
+
+logger = logging.getLogger(__name__)
+
+SALONS_CHANNEL = "salons:changed"
+CATALOG_CHANNEL = "salons:catalog"
+
+_client: Optional[redis.Redis] = None
+
+
+def _publish(channel: str, salon_id: int) -> bool:
+    global _client
+    if _client is None:
+        _client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, socket_timeout=0.5, socket_connect_timeout=0.5)
+    try:
+        _client.publish(channel, str(salon_id))
+        return True
+    except redis.RedisError as e:
+        logger.warning(f"Не удалось уведомить ботов об изменении салона {salon_id}: {e}")
+        return False
+
+
+def publish_salons_changed(salon_id: int):
+    _publish(SALONS_CHANNEL, salon_id)
+
+
+def publish_catalog_changed(salon_id: int):
+    _publish(CATALOG_CHANNEL, salon_id)
@@ -1,37 +1,112 @@
+import asyncio
+import logging
 import httpx
 from typing import List, Optional, Dict, Any
-from config import API_URL
+from cache import LRUCache
+from config import (API_URL, API_TIMEOUT, API_NATURAL_TIMEOUT, CATALOG_CACHE_SIZE, CATALOG_CACHE_TTL,
+                    BOOKING_CONTEXT_TTL, ACTIVE_DAYS_CACHE_TTL)
+from services.transport import make_async_client
+import tracing
+
+logger = logging.getLogger(__name__)
 
 class ApiClient:
     def __init__(self, base_url: str):
         self.base_url = base_url
-        self.client = httpx.AsyncClient(base_url=self.base_url)
+        self.client = make_async_client(self.base_url, timeout=API_TIMEOUT)
+        # Кэш справочников салона (услуги, мастера): ключ (token, url, params).
+        # Значения общие для всех хендлеров - их нельзя изменять на месте.
+        self.catalog_cache = LRUCache(maxsize=CATALOG_CACHE_SIZE, ttl=CATALOG_CACHE_TTL)
+        # Одинаковые одновременные запросы ждут один HTTP-вызов
+        self._inflight: Dict[tuple, asyncio.Task] = {}
+        self._prefetches: set = set()
+
+    async def start(self):
+        # После close() (перезапуск ботов в том же процессе) создаем пул заново
+        if self.client.is_closed:
+            self.client = make_async_client(self.base_url, timeout=API_TIMEOUT)
+
+    async def close(self):
+        await self.client.aclose()
 
     # Вспомогательный метод для заголовков
     def _headers(self, token: str):
-        return {"X-Salon-Token": token}
+        # X-Correlation-ID текущего обновления: связывает лог и спаны API с ботом
+        return {"X-Salon-Token": token, **tracing.outgoing_headers()}
 
-    async def get_services(self, token: str) -> List[Dict[str, Any]]:
-        response = await self.client.get("/api/v1/services", headers=self._headers(token))
+    async def _fetch_json(self, url: str, token: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        response = await self.client.get(url, params=params, headers=self._headers(token))
         response.raise_for_status()
         return response.json()
 
+    async def _coalesced_get(self, key: tuple, url: str, token: str, params: Optional[Dict[str, Any]] = None,
+                             cache: Optional[LRUCache] = None, ttl: Optional[float] = None) -> Any:
+        """GET с объединением одинаковых параллельных запросов и (опционально) кэшем ответа."""
+        if cache is not None:
+            value = cache.get(key)
+            if value is not None:
+                return value
+        task = self._inflight.get(key)
+        if task is None:
+            async def fetch():
+                value = await self._fetch_json(url, token, params)
+                if cache is not None:
+                    cache.set(key, value, ttl)
+                return value
+            task = asyncio.ensure_future(fetch())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._on_fetch_done(key, t))
+        # shield: отмена одного ожидающего хендлера не отменяет запрос для остальных
+        return await asyncio.shield(task)
+
+    def _on_fetch_done(self, key: tuple, task: asyncio.Task):
+        self._inflight.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # ошибка уже получена ожидающими; иначе asyncio ругается в лог
+
+    def _catalog_get(self, url: str, token: str) -> Any:
+        return self._coalesced_get(("catalog", token, url), url, token, cache=self.catalog_cache)
+
+    def invalidate_catalog(self, token: Optional[str] = None):
+        """Сбрасывает кэш справочников салона (или всех салонов, если token не задан)."""
+        self.catalog_cache.invalidate(lambda key: token is None or key[1] == token)
+
+    async def get_booking_context(self, token: str) -> Dict[str, Any]:
+        """Услуги (с master_ids), мастера и активные дни на текущий и следующий месяц одним запросом."""
+        url = "/api/v1/booking-context"
+        return await self._coalesced_get(("availability", token, url), url, token, cache=self.catalog_cache, ttl=BOOKING_CONTEXT_TTL)
+
+    def invalidate_availability(self, token: str):
+        """Сбрасывает контекст записи и активные дни салона (после создания/отмены записи)."""
+        self.catalog_cache.invalidate(lambda key: key[0] == "availability" and key[1] == token)
+
+    async def get_services(self, token: str) -> List[Dict[str, Any]]:
+        return await self._catalog_get("/api/v1/services", token)
+
     async def get_masters_for_service(self, service_id: int, token: str) -> List[Dict[str, Any]]:
-        response = await self.client.get(f"/api/v1/services/{service_id}/masters", headers=self._headers(token))
-        response.raise_for_status()
-        return response.json()
+        return await self._catalog_get(f"/api/v1/services/{service_id}/masters", token)
 
     async def get_all_masters(self, token: str) -> List[Dict[str, Any]]:
-        response = await self.client.get("/api/v1/masters", headers=self._headers(token))
-        response.raise_for_status()
-        return response.json()
+        return await self._catalog_get("/api/v1/masters", token)
 
     async def get_active_days(self, service_id: int, year: int, month: int, token: str, master_id: Optional[int] = None) -> List[int]:
         params = {"service_id": service_id, "year": year, "month": month}
         if master_id: params["master_id"] = master_id
-        response = await self.client.get("/api/v1/active-days-in-month", params=params, headers=self._headers(token))
-        response.raise_for_status()
-        return response.json()
+        url = "/api/v1/active-days-in-month"
+        key = ("availability", token, url, service_id, master_id, year, month)
+        return await self._coalesced_get(key, url, token, params, cache=self.catalog_cache, ttl=ACTIVE_DAYS_CACHE_TTL)
+
+    def prefetch_active_days(self, service_id: int, year: int, month: int, token: str, master_id: Optional[int] = None):
+        """Загружает активные дни месяца в кэш в фоне, не задерживая ответ пользователю."""
+        async def prefetch():
+            try:
+                await self.get_active_days(service_id, year, month, token=token, master_id=master_id)
+            except (httpx.RequestError, httpx.HTTPStatusError) as e:
+                logger.debug(f"Предзагрузка активных дней {year}-{month} не удалась: {e}")
+
+        task = asyncio.ensure_future(prefetch())
+        self._prefetches.add(task)
+        task.add_done_callback(self._prefetches.discard)
 
     async def get_available_slots(self, service_id: int, selected_date: str, token: str, master_id: Optional[int] = None) -> List[Dict[str, Any]]:
         params = {"service_id": service_id, "selected_date": selected_date}
@@ -41,9 +116,13 @@ class ApiClient:
         return response.json()
 
     async def create_appointment(self, payload: Dict[str, Any], token: str) -> Dict[str, Any]:
-        response = await self.client.post("/api/v1/appointments", json=payload, headers=self._headers(token))
-        response.raise_for_status()
-        return response.json()
+        try:
+            response = await self.client.post("/api/v1/appointments", json=payload, headers=self._headers(token))
+            response.raise_for_status()
+            return response.json()
+        finally:
+            # Занятое (или оказавшееся занятым) время меняет активные дни
+            self.invalidate_availability(token)
 
     async def get_client_appointments(self, telegram_user_id: int, token: str) -> List[Dict[str, Any]]:
         response = await self.client.get(f"/api/v1/clients/{telegram_user_id}/appointments", headers=self._headers(token))
@@ -52,6 +131,7 @@ class ApiClient:
 
     async def delete_appointment(self, appointment_id: int, token: str):
         response = await self.client.delete(f"/api/v1/bot/appointments/{appointment_id}", headers=self._headers(token))
+        self.invalidate_availability(token)
         response.raise_for_status()
 
     async def update_client_phone(self, telegram_user_id: int, phone_number: str, token: str):
@@ -60,7 +140,9 @@ class ApiClient:
         response.raise_for_status()
 
     async def create_natural_appointment(self, payload: Dict[str, Any], token: str) -> Dict[str, Any]:
-        response = await self.client.post("/api/v1/appointments/natural", json=payload, headers=self._headers(token))
+        response = await self.client.post("/api/v1/appointments/natural", json=payload, headers=self._headers(token),
+                                          timeout=API_NATURAL_TIMEOUT)
+        self.invalidate_availability(token)
         response.raise_for_status()
         return response.json()
 
@@ -0,0 +1,136 @@
+# services/transport.py - Общий HTTP-транспорт для клиентов бота (API салонов и YandexGPT).
+# Один пул соединений на клиент с keep-alive и лимитами, опционально HTTP/2,
+# повторы идемпотентных GET с джиттером в рамках общего бюджета повторов.
+import asyncio
+import importlib.util
+import logging
+import random
+import threading
+import time
+from typing import Optional
+
+import httpx
+
+from config import (HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE, HTTP_KEEPALIVE_EXPIRY, HTTP2_ENABLED,
+                    HTTP_CONNECT_TIMEOUT, HTTP_RETRY_ATTEMPTS, HTTP_RETRY_BUDGET_RATIO, HTTP_RETRY_BACKOFF)
+from metrics import registry
+import tracing
+
+logger = logging.getLogger(__name__)
+
+CLIENT_LATENCY = registry.histogram("http_client_request_duration_seconds",
+                                    "Время HTTP-запросов бота до получения ответа (с повторами)", ("client", "method"))
+CLIENT_REQUESTS = registry.counter("http_client_requests_total",
+                                   "HTTP-запросы бота; status=error - сетевая ошибка или таймаут", ("client", "status"))
+
+RETRY_METHODS = {"GET", "HEAD", "OPTIONS"}
+RETRY_STATUSES = {502, 503, 504}
+
+
+class RetryBudget:
+    """Бюджет повторов: каждый запрос добавляет ratio токена, каждый повтор тратит один.
+
+    При массовых ошибках повторов становится не больше ratio от потока запросов,
+    а min_reserve позволяет повторять и при малом трафике.
+    """
+
+    def __init__(self, ratio: float, min_reserve: float = 10, max_tokens: float = 100):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = min_reserve
+        self._lock = threading.Lock()
+        self.retries = 0
+        self.exhausted = 0
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self.tokens < 1:
+                self.exhausted += 1
+                return False
+            self.tokens -= 1
+            self.retries += 1
+            return True
+
+
+class RetryTransport(httpx.AsyncBaseTransport):
+    """Обертка над транспортом: повторяет GET при сетевых ошибках и 502/503/504."""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, attempts: int = HTTP_RETRY_ATTEMPTS,
+                 budget: Optional[RetryBudget] = None, backoff: float = HTTP_RETRY_BACKOFF):
+        self.transport = transport
+        self.attempts = attempts
+        self.budget = budget or RetryBudget(HTTP_RETRY_BUDGET_RATIO)
+        self.backoff = backoff
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.budget.deposit()
+        if request.method not in RETRY_METHODS:
+            return await self.transport.handle_async_request(request)
+
+        attempt = 0
+        while True:
+            try:
+                response = await self.transport.handle_async_request(request)
+            except httpx.TransportError as e:
+                if attempt >= self.attempts or not self.budget.withdraw():
+                    raise
+                logger.warning(f"HTTP {request.method} {request.url.path}: {type(e).__name__}, повтор {attempt + 1}")
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt >= self.attempts or not self.budget.withdraw():
+                    return response
+                await response.aclose()
+                logger.warning(f"HTTP {request.method} {request.url.path}: {response.status_code}, повтор {attempt + 1}")
+            attempt += 1
+            # Экспоненциальная пауза с полным джиттером: повторы разных запросов не идут пачкой
+            await asyncio.sleep(random.uniform(0, self.backoff * 2 ** (attempt - 1)))
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """Внешняя обертка: время и статусы запросов клиента для /metrics бота и спанов"""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, name: str):
+        self.transport = transport
+        self.name = name
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.perf_counter()
+        status = "error"
+        try:
+            with tracing.span(f"http.{self.name}", method=request.method, path=request.url.path) as span:
+                response = await self.transport.handle_async_request(request)
+                status = response.status_code
+                span.set(status=status)
+            return response
+        finally:
+            CLIENT_LATENCY.observe(time.perf_counter() - started, client=self.name, method=request.method)
+            CLIENT_REQUESTS.inc(client=self.name, status=status)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def http2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+
+def make_async_client(base_url: str = "", timeout: float = 10.0, retries: bool = True, name: str = "api") -> httpx.AsyncClient:
+    """AsyncClient с настроенным пулом; timeout - время ожидания ответа по умолчанию, name - метка в метриках"""
+    http2 = HTTP2_ENABLED
+    if http2 and not http2_available():
+        logger.warning("HTTP2_ENABLED=true, но пакет h2 не установлен - работаю по HTTP/1.1")
+        http2 = False
+    limits = httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                          keepalive_expiry=HTTP_KEEPALIVE_EXPIRY)
+    transport = httpx.AsyncHTTPTransport(limits=limits, http2=http2)
+    if retries:
+        transport = RetryTransport(transport)
+    transport = InstrumentedTransport(transport, name)
+    return httpx.AsyncClient(base_url=base_url, transport=transport,
+                             timeout=httpx.Timeout(timeout, connect=HTTP_CONNECT_TIMEOUT))
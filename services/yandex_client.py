@@ -1,9 +1,11 @@
 import logging
-import json
-import httpx
 from datetime import date, timedelta
 from aiogram.fsm.context import FSMContext
-from config import YANDEX_API_KEY, YANDEX_FOLDER_ID
+from config import YANDEX_API_KEY, YANDEX_FOLDER_ID, YANDEX_GPT_TIMEOUT
+from services.transport import make_async_client
+from log_config import log_payload
+
+logger = logging.getLogger(__name__)
 
 # URL для запросов к YandexGPT
 YANDEX_GPT_URL = "https://llm.api.cloud.yandex.net/foundationModels/v1/completion"
@@ -43,7 +45,17 @@ class YandexGptClient:
         self.api_key = api_key
         self.folder_id = folder_id
         if not api_key or not folder_id:
-            logging.warning("Ключи для YandexGPT не найдены!")
+            logger.warning("Ключи для YandexGPT не найдены!")
+        # Один клиент на процесс: соединение с YandexGPT (TLS) переиспользуется между сообщениями.
+        # POST генерации не идемпотентен, поэтому без повторов
+        self.client = make_async_client(timeout=YANDEX_GPT_TIMEOUT, retries=False, name="yandex_gpt")
+
+    async def start(self):
+        if self.client.is_closed:
+            self.client = make_async_client(timeout=YANDEX_GPT_TIMEOUT, retries=False, name="yandex_gpt")
+
+    async def close(self):
+        await self.client.aclose()
 
 # ... (начало файла без изменений)
 
@@ -100,57 +112,56 @@ class YandexGptClient:
         }
 
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(YANDEX_GPT_URL, json=payload, headers=headers, timeout=20.0)
+            response = await self.client.post(YANDEX_GPT_URL, json=payload, headers=headers)
+            
+            if response.status_code != 200:
+                logger.error(f"YandexGPT Error {response.status_code}: {response.text[:500]}")
+                return {"type": "text", "content": f"Простите, сервис временно недоступен (Код {response.status_code})."}
+
+            result = response.json()
+            
+            # Полный ответ - только на DEBUG и для выборки сообщений (LOG_PAYLOAD_SAMPLE_RATE)
+            log_payload(logger, "YandexGPT Raw Response", result)
+
+            alternatives = result.get("result", {}).get("alternatives", [])
+            if not alternatives:
+                return {"type": "text", "content": "Не удалось получить ответ от нейросети."}
+            
+            message = alternatives[0].get("message", {})
+            
+            # Сохраняем вопрос пользователя в историю
+            history_raw.append({'role': 'user', 'parts': [{'text': user_message}]})
+
+            # --- ИСПРАВЛЕННАЯ ЛОГИКА ПОИСКА ИНСТРУМЕНТОВ ---
+            # Проверяем и toolCalls (стандарт), и toolCallList (специфика Яндекса)
+            tool_calls = message.get("toolCalls") or message.get("toolCallList", {}).get("toolCalls")
+            
+            if tool_calls:
+                tool_call = tool_calls[0]
+                tool_name = tool_call["functionCall"]["name"]
+                args = tool_call["functionCall"]["arguments"] # В REST API это уже словарь
                 
-                if response.status_code != 200:
-                    logging.error(f"YandexGPT Error {response.status_code}: {response.text}")
-                    return {"type": "text", "content": f"Простите, сервис временно недоступен (Код {response.status_code})."}
-
-                result = response.json()
-                
-                # Логируем полный ответ для отладки
-                logging.info(f"YandexGPT Raw Response: {json.dumps(result, ensure_ascii=False)}")
-
-                alternatives = result.get("result", {}).get("alternatives", [])
-                if not alternatives:
-                    return {"type": "text", "content": "Не удалось получить ответ от нейросети."}
+                logger.info(f"YandexGPT запросил инструмент: {tool_name} с аргументами: {args}")
                 
-                message = alternatives[0].get("message", {})
+                # Очищаем историю после успешного вызова, чтобы начать новый контекст
+                await state.update_data(chat_history=[])
                 
-                # Сохраняем вопрос пользователя в историю
-                history_raw.append({'role': 'user', 'parts': [{'text': user_message}]})
-
-                # --- ИСПРАВЛЕННАЯ ЛОГИКА ПОИСКА ИНСТРУМЕНТОВ ---
-                # Проверяем и toolCalls (стандарт), и toolCallList (специфика Яндекса)
-                tool_calls = message.get("toolCalls") or message.get("toolCallList", {}).get("toolCalls")
-                
-                if tool_calls:
-                    tool_call = tool_calls[0]
-                    tool_name = tool_call["functionCall"]["name"]
-                    args = tool_call["functionCall"]["arguments"] # В REST API это уже словарь
-                    
-                    logging.info(f"YandexGPT запросил инструмент: {tool_name} с аргументами: {args}")
-                    
-                    # Очищаем историю после успешного вызова, чтобы начать новый контекст
-                    await state.update_data(chat_history=[])
-                    
-                    return {"type": "tool_call", "name": tool_name, "args": args}
-                
-                # Если инструментов нет, берем текст
-                bot_text = message.get("text", "")
-                
-                # Защита от пустого ответа
-                if not bot_text:
-                    logging.warning("YandexGPT вернул пустой текст и нет вызова инструмента!")
-                    return {"type": "text", "content": "Я вас услышал, но мне нужно уточнить детали. Повторите, пожалуйста."}
-
-                history_raw.append({'role': 'model', 'parts': [{'text': bot_text}]})
-                await state.update_data(chat_history=history_raw)
-                return {"type": "text", "content": bot_text}
+                return {"type": "tool_call", "name": tool_name, "args": args}
+            
+            # Если инструментов нет, берем текст
+            bot_text = message.get("text", "")
+            
+            # Защита от пустого ответа
+            if not bot_text:
+                logger.warning("YandexGPT вернул пустой текст и нет вызова инструмента!")
+                return {"type": "text", "content": "Я вас услышал, но мне нужно уточнить детали. Повторите, пожалуйста."}
+
+            history_raw.append({'role': 'model', 'parts': [{'text': bot_text}]})
+            await state.update_data(chat_history=history_raw)
+            return {"type": "text", "content": bot_text}
 
         except Exception as e:
-            logging.error(f"Ошибка при HTTP запросе к YandexGPT: {e}")
+            logger.error(f"Ошибка при HTTP запросе к YandexGPT: {e}")
             return {"type": "text", "content": "Произошла ошибка связи."}
 
 yandex_gpt_client = YandexGptClient(YANDEX_API_KEY, YANDEX_FOLDER_ID)
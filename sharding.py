@@ -0,0 +1,102 @@
+# sharding.py - Распределение салонов по процессам ботов (BOT_WORKERS > 1).
+# Салон обслуживает воркер, которому он достается на кольце консистентного хеширования
+# живых воркеров. Живость - по heartbeat в Redis: если воркер пропал, его салоны
+# разбирают остальные, а при появлении нового переезжает только ~1/N салонов.
+import asyncio
+import bisect
+import hashlib
+import logging
+import time
+from typing import Dict, Iterable, List, Optional
+
+from config import BOT_WORKER_HEARTBEAT, BOT_WORKER_TTL
+from salon_events import SALONS_CHANNEL
+
+logger = logging.getLogger(__name__)
+
+WORKERS_KEY = "bot:workers"  # sorted set: имя воркера -> время последнего heartbeat
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Кольцо консистентного хеширования; replicas виртуальных точек на воркер выравнивают нагрузку"""
+
+    def __init__(self, workers: Iterable[str], replicas: int = 64):
+        points = sorted((_hash(f"{worker}#{i}"), worker) for worker in set(workers) for i in range(replicas))
+        self._hashes = [h for h, _ in points]
+        self._workers = [w for _, w in points]
+
+    def owner(self, salon_id: int) -> Optional[str]:
+        if not self._hashes:
+            return None
+        index = bisect.bisect(self._hashes, _hash(f"salon:{salon_id}")) % len(self._hashes)
+        return self._workers[index]
+
+    def assign(self, salon_ids: Iterable[int]) -> Dict[str, List[int]]:
+        result: Dict[str, List[int]] = {}
+        for salon_id in salon_ids:
+            result.setdefault(self.owner(salon_id), []).append(salon_id)
+        return result
+
+
+class WorkerMembership:
+    """Heartbeat воркера в Redis и текущий состав живых воркеров"""
+
+    def __init__(self, redis, name: str):
+        self.redis = redis
+        self.name = name
+        self.workers: List[str] = [name]   # последний известный состав, если Redis недоступен
+        self.ring = HashRing(self.workers)
+
+    async def heartbeat(self) -> bool:
+        """Отмечается живым; возвращает True, если состав воркеров изменился"""
+        now = time.time()
+        try:
+            await self.redis.zadd(WORKERS_KEY, {self.name: now})
+            await self.redis.zremrangebyscore(WORKERS_KEY, "-inf", now - BOT_WORKER_TTL)
+            raw = await self.redis.zrangebyscore(WORKERS_KEY, now - BOT_WORKER_TTL, "+inf")
+        except Exception as e:
+            # Без Redis держимся прежнего состава, чтобы два воркера не взяли один салон
+            logger.warning(f"Heartbeat воркера {self.name} не удался: {e}")
+            return False
+        workers = sorted({w.decode() if isinstance(w, bytes) else w for w in raw} | {self.name})
+        if workers == self.workers:
+            return False
+        self.workers = workers
+        self.ring = HashRing(workers)
+        return True
+
+    def owns(self, salon_id: int) -> bool:
+        return self.ring.owner(salon_id) == self.name
+
+    async def refresh(self):
+        """Heartbeat и, если состав изменился, уведомление остальных воркеров.
+
+        Вызывается и перед каждой сверкой салонов: сообщение workers:* от другого воркера
+        приходит раньше нашего очередного heartbeat, и со старым кольцом два воркера
+        какое-то время опрашивали бы один токен (409 Conflict от Telegram).
+        """
+        if not await self.heartbeat():
+            return
+        logger.info(f"Состав воркеров ботов: {', '.join(self.workers)}")
+        try:
+            await self.redis.publish(SALONS_CHANNEL, f"workers:{self.name}")
+        except Exception as e:
+            logger.warning(f"Не удалось уведомить воркеров о смене состава: {e}")
+
+    async def run(self):
+        """Цикл heartbeat; при смене состава все воркеры пересверяют свои салоны"""
+        while True:
+            await self.refresh()
+            await asyncio.sleep(BOT_WORKER_HEARTBEAT)
+
+    async def leave(self):
+        """Штатная остановка: остальные забирают салоны сразу, не дожидаясь BOT_WORKER_TTL"""
+        try:
+            await self.redis.zrem(WORKERS_KEY, self.name)
+            await self.redis.publish(SALONS_CHANNEL, f"workers:{self.name}")
+        except Exception as e:
+            logger.warning(f"Воркер {self.name} не смог выйти из состава: {e}")
@@ -1,7 +1,8 @@
 import sys
 import os
+from contextlib import contextmanager
 import pytest
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
 from fastapi.testclient import TestClient
@@ -10,8 +11,9 @@ from fastapi.testclient import TestClient
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from database import Base
-from api import app, get_db
-import models
+from api import app, get_db, salons_by_token, salons_by_login
+import availability
+import migrations
 
 # Используем базу в оперативной памяти для тестов (быстро и чисто)
 SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
@@ -28,6 +30,8 @@ TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engin
 def db_session():
     """Создает чистую БД для каждого теста"""
     Base.metadata.create_all(bind=engine)
+    # Как при старте API: в SQLite запрет пересечений делают триггеры
+    migrations.run_migrations(engine)
     db = TestingSessionLocal()
     try:
         yield db
@@ -45,5 +49,33 @@ def client(db_session):
             db_session.close()
 
     app.dependency_overrides[get_db] = override_get_db
+    # Кэш живет на уровне процесса, а БД у каждого теста своя
+    availability.cache.clear()
+    salons_by_token.clear(); salons_by_login.clear()
     with TestClient(app) as c:
         yield c
+
+
+@contextmanager
+def count_queries(bind=engine):
+    """Собирает SQL-запросы, выполненные через bind внутри блока"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(bind, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(bind, "before_cursor_execute", before_cursor_execute)
+
+@pytest.fixture
+def query_budget():
+    """with query_budget(2): ... - падает, если в блоке выполнено больше запросов (ловит N+1)"""
+    @contextmanager
+    def budget(limit: int):
+        with count_queries() as statements:
+            yield statements
+        assert len(statements) <= limit, f"{len(statements)} запросов при бюджете {limit}:\n" + "\n".join(statements)
+    return budget
@@ -0,0 +1,48 @@
+# Локальный фейковый Bot API Telegram для тестов: запоминает вызовы методов
+# и отвечает как настоящий сервер. Бот направляется на него через TelegramAPIServer.
+import asyncio
+import time
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+
+class FakeTelegram:
+    def __init__(self):
+        self.calls = []  # (token, метод, параметры)
+        self.updates = {}  # token -> обновления, которые вернет следующий getUpdates
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self.server = TestServer(app)
+
+    async def _handle(self, request: web.Request):
+        params = dict(await request.post())
+        token, method = request.match_info["token"], request.match_info["method"]
+        self.calls.append((token, method, params))
+        if method == "getUpdates":
+            result = self.updates.pop(token, [])
+            if not result:
+                # Новых обновлений нет - как long polling с коротким таймаутом
+                await asyncio.sleep(0.05)
+        elif method == "sendMessage":
+            result = {"message_id": len(self.calls), "date": int(time.time()), "text": params.get("text"),
+                      "chat": {"id": int(params["chat_id"]), "type": "private"}}
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    def methods(self, token: str):
+        return [(method, params) for t, method, params in self.calls if t == token]
+
+    def bot(self, token: str) -> Bot:
+        base = str(self.server.make_url("")).rstrip("/")
+        return Bot(token=token, session=AiohttpSession(api=TelegramAPIServer.from_base(base)))
+
+    async def __aenter__(self):
+        await self.server.start_server()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.server.close()
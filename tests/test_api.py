@@ -1,6 +1,11 @@
 import base64
-from datetime import date, timedelta
+import pytest
+from datetime import date, datetime, timedelta
 from fastapi.testclient import TestClient
+from sqlalchemy.exc import IntegrityError
+
+import migrations
+import models
 
 # ВАЖНО: УДАЛИЛИ лишний импорт from tests.conftest...
 
@@ -68,3 +73,113 @@ def test_full_flow(client: TestClient):
     assert slots[0]["time"] == "10:00"
 
     # 6. БОТ: Создаем запись
+
+def test_salon_token_cache_invalidated_on_update(client: TestClient):
+    super_auth = basic_auth(SUPER_ADMIN_USERNAME, SUPER_ADMIN_PASSWORD)
+    salon_data = {"name": "test_salon", "title": "Тест", "token": "123:TEST_TOKEN", "password": "admin"}
+    assert client.post("/superadmin/salons", data=salon_data, headers=super_auth).status_code == 200
+
+    bot_headers = {"X-Salon-Token": "123:TEST_TOKEN"}
+    assert client.get("/api/v1/services", headers=bot_headers).status_code == 200
+    assert client.get("/api/v1/services", headers=bot_headers).status_code == 200
+    stats = client.get("/superadmin/stats", headers=super_auth).json()["salon_token_cache"]
+    assert stats["hits"] == 1 and stats["misses"] == 1
+
+    # Отключенный салон сразу теряет доступ, несмотря на кэш
+    update = {"name": "test_salon", "telegram_token": "123:TEST_TOKEN", "admin_password": "admin", "is_active": False}
+    assert client.put("/superadmin/salons/1", json=update, headers=super_auth).status_code == 200
+    assert client.get("/api/v1/services", headers=bot_headers).status_code == 403
+    assert client.get("/admin/services", headers=basic_auth("test_salon", "admin")).status_code == 403
+
+def test_overlap_rejected_by_database_constraint(client: TestClient, db_session):
+    assert migrations.overlap_guard_installed
+    super_auth = basic_auth(SUPER_ADMIN_USERNAME, SUPER_ADMIN_PASSWORD)
+    client.post("/superadmin/salons", data={"name": "test_salon", "title": "Тест", "token": "123:TEST_TOKEN", "password": "admin"}, headers=super_auth)
+    salon_auth = basic_auth("test_salon", "admin")
+    # Демо-салон: услуга 1 (60 мин), мастер 1
+    day = (date.today() + timedelta(days=3)).isoformat()
+    first = client.post("/api/v1/appointments/admin", json={"client_id": 1, "master_id": 1, "service_id": 1, "start_time": f"{day}T10:00:00"}, headers=salon_auth)
+    second = client.post("/api/v1/appointments/admin", json={"client_id": 1, "master_id": 1, "service_id": 1, "start_time": f"{day}T11:00:00"}, headers=salon_auth)
+    assert first.status_code == 200 and second.status_code == 200
+
+    # Перенос на занятое время и пересекающаяся вставка в обход API упираются в БД
+    moved = client.put(f"/api/v1/appointments/{second.json()['id']}", json={"master_id": 1, "service_id": 1, "start_time": f"{day}T10:30:00"}, headers=salon_auth)
+    assert moved.status_code == 409
+    db_session.add(models.Appointment(salon_id=1, client_id=1, master_id=1, service_id=1,
+                                      start_time=datetime.fromisoformat(f"{day}T10:59:00"), end_time=datetime.fromisoformat(f"{day}T11:30:00")))
+    with pytest.raises(IntegrityError):
+        db_session.commit()
+
+def test_bot_endpoints_stay_within_query_budget(client: TestClient, query_budget):
+    super_auth = basic_auth(SUPER_ADMIN_USERNAME, SUPER_ADMIN_PASSWORD)
+    client.post("/superadmin/salons", data={"name": "n1", "title": "N+1", "token": "1:N1", "password": "admin"}, headers=super_auth)
+    salon_auth = basic_auth("n1", "admin")
+    bot = {"X-Salon-Token": "1:N1"}
+    service_ids = [client.post("/api/v1/services", json={"id": 0, "name": f"Услуга {i}", "price": 100, "duration_minutes": 30},
+                               headers=salon_auth).json()["id"] for i in range(3)]
+    for i in range(3):
+        master_id = client.post("/api/v1/masters", json={"name": f"Мастер {i}", "specialization": "-", "service_ids": service_ids},
+                                headers=salon_auth).json()["id"]
+        client.post(f"/api/v1/masters/{master_id}/schedule", headers=salon_auth,
+                    json={"items": [{"day_of_week": d, "is_working": True, "start_time": "10:00", "end_time": "19:00"} for d in range(1, 8)]})
+        day = date.today() + timedelta(days=1 + i)
+        response = client.post("/api/v1/appointments", headers=bot, json={"telegram_user_id": 777, "user_name": "Клиент",
+                               "service_id": service_ids[i], "master_id": master_id, "start_time": f"{day.isoformat()}T10:00:00"})
+        assert response.status_code == 200, response.text
+
+    # Салон уже в кэше авторизации - остаются только запросы самих эндпоинтов
+    with query_budget(1):
+        appts = client.get("/api/v1/clients/777/appointments", headers=bot).json()
+    assert [a["service_name"] for a in appts] == ["Услуга 0", "Услуга 1", "Услуга 2"]
+    assert [a["master_name"] for a in appts] == ["Мастер 0", "Мастер 1", "Мастер 2"]
+
+    with query_budget(1):
+        masters = client.get(f"/api/v1/services/{service_ids[0]}/masters", headers=bot).json()
+    assert [m["name"] for m in masters] == ["Мастер 0", "Мастер 1", "Мастер 2"]
+
+def test_server_timing_and_slow_query_log(client: TestClient, monkeypatch, caplog):
+    import database
+    super_auth = basic_auth(SUPER_ADMIN_USERNAME, SUPER_ADMIN_PASSWORD)
+    client.post("/superadmin/salons", data={"name": "st", "title": "ST", "token": "1:ST", "password": "admin"}, headers=super_auth)
+    client.get("/api/v1/services", headers={"X-Salon-Token": "1:ST"})
+
+    # Каждый запрос считаем медленным - в лог попадает маршрут, а не конкретный путь
+    monkeypatch.setattr(database, "SLOW_QUERY_MS", 0)
+    response = client.get("/api/v1/services/1/masters", headers={"X-Salon-Token": "1:ST"})
+    assert response.headers["Server-Timing"].startswith("db;dur=")
+    assert 'desc="1 queries"' in response.headers["Server-Timing"]
+    assert "[GET /api/v1/services/{service_id}/masters]" in caplog.text
+
+def test_metrics_endpoint(client: TestClient):
+    import api
+    super_auth = basic_auth(SUPER_ADMIN_USERNAME, SUPER_ADMIN_PASSWORD)
+    client.post("/superadmin/salons", data={"name": "mt", "title": "MT", "token": "1:MT", "password": "admin"}, headers=super_auth)
+    salon_auth = basic_auth("mt", "admin")
+    check = "db_constraint" if migrations.overlap_guard_installed else "precheck"
+    conflicts = api.BOOKING_CONFLICTS.value(check=check)
+    day = (date.today() + timedelta(days=3)).isoformat()
+    body = {"client_id": 1, "master_id": 1, "service_id": 1, "start_time": f"{day}T10:00:00"}
+    assert client.post("/api/v1/appointments/admin", json=body, headers=salon_auth).status_code == 200
+    assert client.post("/api/v1/appointments/admin", json=body, headers=salon_auth).status_code == 409
+    assert api.BOOKING_CONFLICTS.value(check=check) == conflicts + 1
+
+    response = client.get("/metrics")
+    assert response.headers["content-type"].startswith("text/plain")
+    # Метки - шаблон маршрута, а не путь с id
+    assert 'api_requests_total{method="POST",route="/api/v1/appointments/admin",status="409"}' in response.text
+    assert 'api_request_duration_seconds_bucket{method="POST",route="/api/v1/appointments/admin",le="+Inf"}' in response.text
+    assert "db_pool_checked_out" in response.text
+
+def test_catalog_changes_are_published_to_bots(client: TestClient, monkeypatch):
+    import api
+    published = []
+    monkeypatch.setattr(api, "publish_catalog_changed", published.append)
+    super_auth = basic_auth(SUPER_ADMIN_USERNAME, SUPER_ADMIN_PASSWORD)
+    client.post("/superadmin/salons", data={"name": "cat", "title": "Cat", "token": "1:CAT", "password": "admin"}, headers=super_auth)
+    salon_auth = basic_auth("cat", "admin")
+    service_id = client.post("/api/v1/services", json={"name": "Маникюр", "price": 900, "duration_minutes": 60}, headers=salon_auth).json()["id"]
+    client.put(f"/api/v1/services/{service_id}", json={"name": "Маникюр", "price": 1000, "duration_minutes": 90}, headers=salon_auth)
+    master_id = client.post("/api/v1/masters", json={"name": "Анна", "specialization": "-", "service_ids": [service_id]}, headers=salon_auth).json()["id"]
+    client.put(f"/api/v1/masters/{master_id}", json={"name": "Анна", "specialization": "-", "service_ids": []}, headers=salon_auth)
+    client.post(f"/api/v1/masters/{master_id}/schedule", json={"items": []}, headers=salon_auth)
+    assert published == [1] * 5
@@ -0,0 +1,99 @@
+import asyncio
+import httpx
+import pytest
+from services.api_client import ApiClient
+from services.transport import RetryBudget, RetryTransport
+
+def make_client(handler):
+    client = ApiClient("http://api")
+    client.client = httpx.AsyncClient(base_url="http://api", transport=httpx.MockTransport(handler))
+    return client
+
+@pytest.mark.asyncio
+async def test_catalog_requests_are_cached_and_coalesced():
+    calls = []
+
+    async def handler(request):
+        calls.append(request.url.path)
+        await asyncio.sleep(0.01)
+        return httpx.Response(200, json=[{"id": 1, "name": "Стрижка", "price": 1000}])
+
+    api = make_client(handler)
+    # 10 одновременных одинаковых запросов -> один HTTP-вызов
+    results = await asyncio.gather(*(api.get_services(token="T1") for _ in range(10)))
+    assert all(r == results[0] for r in results)
+    assert calls == ["/api/v1/services"]
+
+    # Повтор берется из кэша, другой салон - отдельный ключ
+    await api.get_services(token="T1")
+    await api.get_services(token="T2")
+    assert calls == ["/api/v1/services"] * 2
+
+    api.invalidate_catalog("T1")
+    await api.get_services(token="T1")
+    assert calls == ["/api/v1/services"] * 3
+
+@pytest.mark.asyncio
+async def test_failed_request_is_not_cached():
+    responses = [httpx.Response(500), httpx.Response(200, json=[])]
+
+    async def handler(request):
+        return responses.pop(0)
+
+    api = make_client(handler)
+    with pytest.raises(httpx.HTTPStatusError):
+        await api.get_all_masters(token="T1")
+    assert await api.get_all_masters(token="T1") == []
+
+
+def make_retrying_client(handler, budget=None):
+    transport = RetryTransport(httpx.MockTransport(handler), attempts=2, budget=budget, backoff=0)
+    return httpx.AsyncClient(base_url="http://api", transport=transport)
+
+@pytest.mark.asyncio
+async def test_get_is_retried_but_post_is_not():
+    statuses = {"GET": [503, 503, 200], "POST": [503, 200]}
+
+    async def handler(request):
+        return httpx.Response(statuses[request.method].pop(0))
+
+    async with make_retrying_client(handler) as http:
+        assert (await http.get("/api/v1/services")).status_code == 200
+        assert (await http.post("/api/v1/appointments", json={})).status_code == 503
+    assert statuses == {"GET": [], "POST": [200]}
+
+@pytest.mark.asyncio
+async def test_retry_budget_limits_retries():
+    calls = []
+
+    async def handler(request):
+        calls.append(request.url.path)
+        raise httpx.ConnectError("down", request=request)
+
+    budget = RetryBudget(ratio=0.1, min_reserve=1)
+    async with make_retrying_client(handler, budget) as http:
+        for _ in range(3):
+            with pytest.raises(httpx.ConnectError):
+                await http.get("/api/v1/services")
+    # Первый запрос потратил единственный токен на повтор, остальные шли без повторов
+    assert len(calls) == 2 + 1 + 1
+    assert budget.retries == 1 and budget.exhausted == 3
+
+@pytest.mark.asyncio
+async def test_prefetched_month_is_served_from_cache():
+    calls = []
+
+    async def handler(request):
+        calls.append((request.method, request.url.params.get("month")))
+        return httpx.Response(200, json=[5, 6] if request.method == "GET" else {"id": 1})
+
+    api = make_client(handler)
+    api.prefetch_active_days(1, 2026, 12, token="T1")
+    await asyncio.sleep(0.01)
+    assert await api.get_active_days(1, 2026, 12, token="T1") == [5, 6]
+    assert calls == [("GET", "12")]
+
+    # Новая запись меняет активные дни - кэш салона сбрасывается
+    await api.create_appointment({}, token="T1")
+    await api.get_active_days(1, 2026, 12, token="T1")
+    assert calls == [("GET", "12"), ("POST", None), ("GET", "12")]
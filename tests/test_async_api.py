@@ -0,0 +1,88 @@
+# Асинхронные эндпоинты бота (USE_ASYNC_DB) на aiosqlite против синхронных на той же БД
+from datetime import date, timedelta
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+import api
+import availability
+import migrations
+from database import Base
+from tests.test_availability import setup_salon, BOT_HEADERS
+
+@pytest.fixture
+def clients(tmp_path):
+    """(синхронный клиент, асинхронный клиент) над одним файлом SQLite"""
+    url = f"sqlite:///{tmp_path / 'async.db'}"
+    sync_engine = create_engine(url, connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=sync_engine)
+    migrations.run_migrations(sync_engine)
+    SyncSession = sessionmaker(bind=sync_engine, autoflush=False)
+    async_engine = create_async_engine(url.replace("sqlite://", "sqlite+aiosqlite://", 1))
+    AsyncSession = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+    def get_db():
+        db = SyncSession()
+        try: yield db
+        finally: db.close()
+
+    async def get_async_db():
+        async with AsyncSession() as db:
+            yield db
+
+    # Как при USE_ASYNC_DB=true: только асинхронный роутер горячих эндпоинтов
+    async_app = FastAPI()
+    async_app.include_router(api.bot_async_router)
+    async_app.dependency_overrides[api.get_async_db] = get_async_db
+    api.app.dependency_overrides[api.get_db] = get_db
+    availability.cache.clear()
+    api.salons_by_token.clear(); api.salons_by_login.clear()
+    with TestClient(api.app) as sync_client, TestClient(async_app) as async_client:
+        yield sync_client, async_client
+    api.app.dependency_overrides.pop(api.get_db, None)
+    sync_engine.dispose()
+
+def test_async_endpoints_match_sync(clients):
+    sync_client, async_client = clients
+    service_id, master_id = setup_salon(sync_client)
+    day = date.today() + timedelta(days=2)
+    urls = ["/api/v1/services",
+            f"/api/v1/available-slots?service_id={service_id}&selected_date={day.isoformat()}",
+            f"/api/v1/available-slots?service_id={service_id}&selected_date={day.isoformat()}&master_id={master_id}",
+            f"/api/v1/active-days-in-month?service_id={service_id}&year={day.year}&month={day.month}"]
+    for url in urls:
+        availability.cache.clear()
+        expected = sync_client.get(url, headers=BOT_HEADERS)
+        availability.cache.clear()
+        actual = async_client.get(url, headers=BOT_HEADERS)
+        assert actual.status_code == expected.status_code == 200, url
+        assert actual.json() == expected.json(), url
+
+    assert async_client.get("/api/v1/services", headers={"X-Salon-Token": "bad"}).status_code == 403
+
+def test_async_booking_and_conflict(clients):
+    sync_client, async_client = clients
+    service_id, master_id = setup_salon(sync_client)
+    day = date.today() + timedelta(days=2)
+    slots_url = f"/api/v1/available-slots?service_id={service_id}&selected_date={day.isoformat()}"
+    appt = {"telegram_user_id": 5, "user_name": "Client", "service_id": service_id, "master_id": master_id,
+            "start_time": f"{day.isoformat()}T10:00:00"}
+    check = "db_constraint" if migrations.overlap_guard_installed else "precheck"
+    conflicts = api.BOOKING_CONFLICTS.value(check=check)
+
+    assert len(async_client.get(slots_url, headers=BOT_HEADERS).json()) == 3
+    response = async_client.post("/api/v1/appointments", json=appt, headers=BOT_HEADERS)
+    assert response.status_code == 200 and response.json()["appointment_id"]
+    # Запись сбросила кэш - занятое время пропало и в асинхронном, и в синхронном ответе
+    assert [s["time"] for s in async_client.get(slots_url, headers=BOT_HEADERS).json()] == ["11:00"]
+    assert [s["time"] for s in sync_client.get(slots_url, headers=BOT_HEADERS).json()] == ["11:00"]
+
+    # Пересечение: 409 и от асинхронного, и от синхронного эндпоинта
+    assert async_client.post("/api/v1/appointments", json={**appt, "start_time": f"{day.isoformat()}T10:30:00"}, headers=BOT_HEADERS).status_code == 409
+    assert sync_client.post("/api/v1/appointments", json=appt, headers=BOT_HEADERS).status_code == 409
+    assert api.BOOKING_CONFLICTS.value(check=check) == conflicts + 2
+    assert async_client.post("/api/v1/appointments", json={**appt, "service_id": 999}, headers=BOT_HEADERS).status_code == 404
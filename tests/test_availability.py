@@ -0,0 +1,217 @@
+import base64
+import random
+from datetime import date, datetime, time, timedelta
+from zoneinfo import ZoneInfo
+from config import SUPER_ADMIN_USERNAME, SUPER_ADMIN_PASSWORD
+import availability
+
+def basic_auth(username, password):
+    token = base64.b64encode(f"{username}:{password}".encode('utf-8')).decode("ascii")
+    return {"Authorization": f"Basic {token}"}
+
+BOT_HEADERS = {"X-Salon-Token": "123:TEST_TOKEN"}
+
+def setup_salon(client, duration_minutes=60):
+    """Салон с одной услугой и мастером, работающим каждый день 10:00-12:00"""
+    super_auth = basic_auth(SUPER_ADMIN_USERNAME, SUPER_ADMIN_PASSWORD)
+    client.post("/superadmin/salons", data={"name": "test_salon", "title": "Тест", "token": "123:TEST_TOKEN", "password": "admin"}, headers=super_auth)
+    salon_auth = basic_auth("test_salon", "admin")
+    service_id = client.post("/api/v1/services", json={"name": "Стрижка", "price": 1000, "duration_minutes": duration_minutes}, headers=salon_auth).json()["id"]
+    master_id = client.post("/api/v1/masters", json={"name": "Мастер", "specialization": "Профи", "service_ids": [service_id]}, headers=salon_auth).json()["id"]
+    items = [{"day_of_week": i, "is_working": True, "start_time": "10:00", "end_time": "12:00"} for i in range(1, 8)]
+    client.post(f"/api/v1/masters/{master_id}/schedule", json={"items": items}, headers=salon_auth)
+    return service_id, master_id
+
+def book(client, service_id, master_id, day, hhmm):
+    appt = {"telegram_user_id": 1, "user_name": "Client", "service_id": service_id, "master_id": master_id, "start_time": f"{day.isoformat()}T{hhmm}:00"}
+    return client.post("/api/v1/appointments", json=appt, headers=BOT_HEADERS)
+
+def test_slots_exclude_booked_time(client):
+    service_id, master_id = setup_salon(client)
+    day = date.today() + timedelta(days=1)
+    assert book(client, service_id, master_id, day, "10:30").status_code == 200
+
+    slots = client.get(f"/api/v1/available-slots?service_id={service_id}&selected_date={day.isoformat()}", headers=BOT_HEADERS).json()
+    assert [s["time"] for s in slots] == []
+
+    other_day = day + timedelta(days=1)
+    slots = client.get(f"/api/v1/available-slots?service_id={service_id}&selected_date={other_day.isoformat()}", headers=BOT_HEADERS).json()
+    assert [s["time"] for s in slots] == ["10:00", "10:30", "11:00"]
+    assert all(s["master_id"] == master_id for s in slots)
+
+def test_active_days_skip_fully_booked_day(client):
+    service_id, master_id = setup_salon(client, duration_minutes=120)
+    # Берем день в следующем месяце, чтобы не зависеть от текущего времени
+    first_next = (date.today().replace(day=1) + timedelta(days=32)).replace(day=1)
+    day = first_next + timedelta(days=4)
+    assert book(client, service_id, master_id, day, "10:00").status_code == 200
+
+    url = f"/api/v1/active-days-in-month?service_id={service_id}&year={day.year}&month={day.month}"
+    days = client.get(url, headers=BOT_HEADERS).json()
+    assert day.day not in days
+    assert first_next.day in days
+
+    assert client.get(url + f"&master_id={master_id + 100}", headers=BOT_HEADERS).json() == []
+    assert client.get(f"/api/v1/active-days-in-month?service_id={service_id + 100}&year={day.year}&month={day.month}", headers=BOT_HEADERS).json() == []
+
+def brute_force_slots(work_start, work_end, duration, step, appointments, now=None):
+    """Старый алгоритм: курсор с шагом по всему дню и проверка каждой записи"""
+    result, slot_start = [], work_start
+    while slot_start + duration <= work_end:
+        if not (now and slot_start <= now) and all(max(slot_start, s) >= min(slot_start + duration, e) for s, e in appointments):
+            result.append(slot_start)
+        slot_start += step
+    return result
+
+def test_gap_walk_matches_brute_force():
+    rnd = random.Random(42)
+    day = date(2030, 1, 7)
+    for _ in range(300):
+        step = timedelta(minutes=rnd.choice([10, 15, 30, 45]))
+        duration = timedelta(minutes=rnd.choice([15, 30, 60, 90]))
+        work_start = datetime.combine(day, time(rnd.randint(7, 11), rnd.choice([0, 30])))
+        work_end = work_start + timedelta(hours=rnd.randint(4, 12))
+        appts = []
+        for _ in range(rnd.randint(0, 8)):
+            start = work_start + timedelta(minutes=rnd.randint(-60, 12 * 60))
+            appts.append((start, start + timedelta(minutes=rnd.choice([15, 20, 60, 120]))))
+        appts.sort()
+        ctx = availability.AvailabilityContext(duration, step, [1], {(1, day.isoweekday()): (work_start.time(), work_end.time())}, {(1, day): appts})
+
+        far_now = datetime(2000, 1, 1, tzinfo=ZoneInfo("Europe/Moscow"))
+        assert list(availability._master_slots(ctx, 1, day, far_now)) == brute_force_slots(work_start, work_end, duration, step, appts)
+
+        now = datetime.combine(day, time(rnd.randint(6, 20), rnd.randint(0, 59)), ZoneInfo("Europe/Moscow"))
+        expected = brute_force_slots(work_start, work_end, duration, step, appts, now=now.replace(tzinfo=None))
+        assert list(availability._master_slots(ctx, 1, day, now)) == expected
+
+def test_slot_step_is_configurable_per_salon(client):
+    service_id, master_id = setup_salon(client)
+    super_auth = basic_auth(SUPER_ADMIN_USERNAME, SUPER_ADMIN_PASSWORD)
+    response = client.put("/superadmin/salons/1", json={"name": "test_salon", "telegram_token": "123:TEST_TOKEN", "admin_password": "admin", "is_active": True, "slot_step_minutes": 20}, headers=super_auth)
+    assert response.status_code == 200
+
+    day = date.today() + timedelta(days=1)
+    slots = client.get(f"/api/v1/available-slots?service_id={service_id}&selected_date={day.isoformat()}", headers=BOT_HEADERS).json()
+    assert [s["time"] for s in slots] == ["10:00", "10:20", "10:40", "11:00"]
+
+def test_slot_step_out_of_range_is_rejected(client):
+    setup_salon(client)
+    super_auth = basic_auth(SUPER_ADMIN_USERNAME, SUPER_ADMIN_PASSWORD)
+    update = {"name": "test_salon", "telegram_token": "123:TEST_TOKEN", "admin_password": "admin", "is_active": True}
+    for step in (-10, 0, 241):
+        assert client.put("/superadmin/salons/1", json={**update, "slot_step_minutes": step}, headers=super_auth).status_code == 422
+    for step in ("abc", "-5", "0", "1000"):
+        form = {"name": f"s{step}", "title": "S", "token": f"1:S{step}", "password": "admin", "slot_step": step}
+        assert client.post("/superadmin/salons", data=form, headers=super_auth).status_code == 400
+
+    # Некорректный шаг, уже сохраненный в БД, не зацикливает перебор слотов
+    from types import SimpleNamespace
+    for step in (-10, 0, None):
+        assert availability._salon_step(SimpleNamespace(slot_step_minutes=step)) == timedelta(minutes=availability.DEFAULT_SLOT_STEP_MINUTES)
+
+def test_cache_serves_repeated_requests_and_invalidates_on_booking(client):
+    service_id, master_id = setup_salon(client)
+    day = date.today() + timedelta(days=2)
+    url = f"/api/v1/available-slots?service_id={service_id}&selected_date={day.isoformat()}"
+
+    assert len(client.get(url, headers=BOT_HEADERS).json()) == 3
+    misses = availability.cache.misses
+    assert len(client.get(url, headers=BOT_HEADERS).json()) == 3
+    assert availability.cache.misses == misses
+
+    assert book(client, service_id, master_id, day, "11:00").status_code == 200
+    assert [s["time"] for s in client.get(url, headers=BOT_HEADERS).json()] == ["10:00"]
+
+    # Изменение длительности услуги тоже сбрасывает кэш
+    salon_auth = basic_auth("test_salon", "admin")
+    client.put(f"/api/v1/services/{service_id}", json={"name": "Стрижка", "price": 1000, "duration_minutes": 30}, headers=salon_auth)
+    assert [s["time"] for s in client.get(url, headers=BOT_HEADERS).json()] == ["10:00", "10:30"]
+
+def test_booking_context_matches_individual_endpoints(client):
+    service_id, master_id = setup_salon(client)
+    day = date.today() + timedelta(days=1)
+    assert book(client, service_id, master_id, day, "10:00").status_code == 200
+
+    ctx = client.get("/api/v1/booking-context", headers=BOT_HEADERS).json()
+    services = client.get("/api/v1/services", headers=BOT_HEADERS).json()
+    assert [{k: s[k] for k in ("id", "name", "price", "duration_minutes")} for s in ctx["services"]] == services
+    by_id = {s["id"]: s for s in ctx["services"]}
+    for service in services:
+        masters = client.get(f"/api/v1/services/{service['id']}/masters", headers=BOT_HEADERS).json()
+        assert sorted(by_id[service["id"]]["master_ids"]) == sorted(m["id"] for m in masters)
+
+    assert len({(e["year"], e["month"]) for e in ctx["active_days"]}) == 2
+    for entry in ctx["active_days"]:
+        url = f"/api/v1/active-days-in-month?service_id={entry['service_id']}&year={entry['year']}&month={entry['month']}"
+        if entry["master_id"]: url += f"&master_id={entry['master_id']}"
+        assert entry["days"] == client.get(url, headers=BOT_HEADERS).json()
+
+class StubRedis:
+    """Redis в памяти: запоминает команды и поток, из которого они пришли"""
+
+    def __init__(self):
+        self.data, self.calls = {}, []
+
+    def _call(self, name):
+        import threading
+        self.calls.append((name, threading.get_ident()))
+
+    def get(self, key):
+        self._call("get")
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self._call("set")
+        self.data[key] = value
+
+    def incr(self, key):
+        self._call("incr")
+        self.data[key] = int(self.data.get(key) or 0) + 1
+        return self.data[key]
+
+def test_shared_cache_skips_redis_on_local_hits(monkeypatch):
+    import asyncio
+    import threading
+    stub = StubRedis()
+    store = availability.RedisAvailabilityStore(stub, version_refresh=60)
+    monkeypatch.setattr(availability, "shared", store)
+    availability.cache.clear()
+    today = date.today()
+    key = availability.slots_key(99, 1, None, today + timedelta(days=1))
+    computed = []
+
+    def compute():
+        computed.append(1)
+        return [{"time": "10:00", "master_id": 1}]
+
+    availability.cached(key, compute, today)
+    stub.calls.clear()
+    assert availability.cached(key, compute, today) == [{"time": "10:00", "master_id": 1}]
+    assert stub.calls == [] and len(computed) == 1
+
+    # Своя запись видна сразу, чужая (INCR из другого воркера) - после version_refresh
+    availability.invalidate_salon(99)
+    availability.cached(key, compute, today)
+    assert len(computed) == 2
+    stub.incr("avail:ver:99")
+    availability.cached(key, compute, today)
+    assert len(computed) == 2
+    store.version_refresh = 0
+    availability.cached(key, compute, today)
+    assert len(computed) == 3
+
+    # Асинхронный путь ходит в Redis не из потока event loop
+    stub.calls.clear()
+    availability.cache.clear()
+
+    async def compute_async():
+        return compute()
+
+    async def run():
+        await availability.cached_async(availability.slots_key(99, 2, None, today), compute_async, today)
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(run())
+    assert [name for name, _ in stub.calls] == ["get", "get", "set"]  # версия, значение, запись
+    assert all(thread != loop_thread for _, thread in stub.calls)
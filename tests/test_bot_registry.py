@@ -0,0 +1,121 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from aiogram import Dispatcher, Router, types
+from bot_registry import BotRegistry
+from salon_events import SALONS_CHANNEL, CATALOG_CHANNEL
+from services.api_client import ApiClient
+from fake_telegram import FakeTelegram
+
+@pytest.mark.asyncio
+async def test_sync_starts_and_stops_only_changed_bots():
+    async with FakeTelegram() as telegram:
+        registry = BotRegistry(Dispatcher(), bot_factory=telegram.bot)
+        await registry.sync({1: "111:AAA", 2: "222:BBB"})
+        first_bot = registry.bots[1]
+        await asyncio.sleep(0.1)
+        assert {t for t, m, _ in telegram.calls if m == "getUpdates"} == {"111:AAA", "222:BBB"}
+
+        # Салон 2 сменил токен, появился салон 3; бот салона 1 не перезапускается
+        await registry.sync({1: "111:AAA", 2: "333:CCC", 3: "444:DDD"})
+        assert registry.bots[1] is first_bot
+        assert {s: b.token for s, b in registry.bots.items()} == {1: "111:AAA", 2: "333:CCC", 3: "444:DDD"}
+        assert [m for m, _ in telegram.methods("111:AAA")].count("deleteWebhook") == 1
+        # Бот, переехавший с другого воркера, не теряет накопленные обновления
+        assert all(p.get("drop_pending_updates") != "true" for m, p in telegram.methods("444:DDD") if m == "deleteWebhook")
+
+        await registry.sync({3: "444:DDD"})
+        assert set(registry.bots) == {3}
+        # getUpdates, отправленный до остановки, может дойти до сервера позже
+        await asyncio.sleep(0.1)
+        telegram.calls.clear()
+        await asyncio.sleep(0.1)
+        assert {t for t, m, _ in telegram.calls if m == "getUpdates"} == {"444:DDD"}
+        await registry.stop()
+        assert not registry.bots
+
+class StubPubSub:
+    def __init__(self, messages):
+        self.messages = list(messages)
+
+    async def get_message(self, ignore_subscribe_messages=True, timeout=None):
+        if self.messages:
+            return self.messages.pop(0)
+        await asyncio.sleep(min(timeout, 0.01))
+        return None
+
+def catalog(salon_id):
+    return {"type": "message", "channel": CATALOG_CHANNEL.encode(), "data": str(salon_id).encode()}
+
+@pytest.mark.asyncio
+async def test_catalog_change_invalidates_bot_cache_without_resync(monkeypatch):
+    import bot_registry
+    monkeypatch.setattr(bot_registry, "SALON_RESYNC_SECONDS", 0.05)
+    client = ApiClient("http://api")
+    client.catalog_cache.set(("catalog", "111:AAA", "/api/v1/services", None), [{"id": 1}])
+    client.catalog_cache.set(("catalog", "222:BBB", "/api/v1/services", None), [{"id": 2}])
+    registry = BotRegistry(Dispatcher(), on_catalog_changed=client.invalidate_catalog)
+    registry.bots = {1: SimpleNamespace(token="111:AAA"), 2: SimpleNamespace(token="222:BBB")}
+
+    # Только изменения справочников (и чужой салон 9) - ждем до таймера сверки
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    await registry._wait_for_change(StubPubSub([catalog(1), catalog(9)]))
+    assert loop.time() - started >= 0.05
+    assert client.catalog_cache.get(("catalog", "111:AAA", "/api/v1/services", None)) is None
+    assert client.catalog_cache.get(("catalog", "222:BBB", "/api/v1/services", None)) == [{"id": 2}]
+
+    # Изменение салона - сверка сразу; справочники из той же пачки тоже сброшены
+    started = loop.time()
+    salons = {"type": "message", "channel": SALONS_CHANNEL.encode(), "data": b"3"}
+    await registry._wait_for_change(StubPubSub([salons, catalog(2)]))
+    assert loop.time() - started < 1
+    assert client.catalog_cache.get(("catalog", "222:BBB", "/api/v1/services", None)) is None
+    await client.close()
+
+@pytest.mark.asyncio
+async def test_webhook_restart_keeps_pending_updates():
+    from webhook import WebhookReceiver
+    async with FakeTelegram() as telegram:
+        dp = Dispatcher()
+        registry = BotRegistry(dp, WebhookReceiver(dp, secret="s3cret"), bot_factory=telegram.bot)
+        await registry.sync({1: "111:AAA", 2: "222:BBB"})
+        # Остановка процесса (деплой): вебхуки не снимаются, Telegram копит обновления
+        await registry.stop()
+        restarted = BotRegistry(dp, WebhookReceiver(dp, secret="s3cret"), bot_factory=telegram.bot)
+        await restarted.sync({1: "111:AAA", 2: "222:BBB"})
+        for token in ("111:AAA", "222:BBB"):
+            methods = telegram.methods(token)
+            assert "deleteWebhook" not in [m for m, _ in methods]
+            assert all(p.get("drop_pending_updates") != "true" for m, p in methods if m == "setWebhook")
+
+        # Салон отключен - его вебхук снимается
+        await restarted.sync({2: "222:BBB"})
+        assert [m for m, _ in telegram.methods("111:AAA")].count("deleteWebhook") == 1
+        await restarted.stop()
+        assert "deleteWebhook" not in [m for m, _ in telegram.methods("222:BBB")]
+
+@pytest.mark.asyncio
+async def test_stopped_bot_finishes_received_updates():
+    started = asyncio.Event()
+    router = Router()
+
+    @router.message()
+    async def slow_echo(message: types.Message):
+        started.set()
+        await asyncio.sleep(0.5)
+        await message.answer(f"эхо: {message.text}")
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    async with FakeTelegram() as telegram:
+        telegram.updates["111:AAA"] = [{"update_id": 1, "message": {
+            "message_id": 1, "date": 1700000000, "text": "привет",
+            "chat": {"id": 42, "type": "private"}, "from": {"id": 42, "is_bot": False, "first_name": "Анна"}}}]
+        registry = BotRegistry(dp, bot_factory=telegram.bot)
+        await registry.sync({1: "111:AAA"})
+        await asyncio.wait_for(started.wait(), 1)
+        # Салон отключили, пока хендлер работает: ответ уходит до закрытия сессии бота
+        await registry.sync({})
+        sent = [p["text"] for m, p in telegram.methods("111:AAA") if m == "sendMessage"]
+        assert sent == ["эхо: привет"]
@@ -0,0 +1,21 @@
+import threading
+from sqlalchemy import create_engine
+
+from database import TimedQueuePool, pool_stats
+
+def test_pool_counts_checkouts_and_only_real_waits(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'pool.db'}", poolclass=TimedQueuePool, pool_size=1, max_overflow=0, pool_timeout=5)
+    # Соединение уже открыто и свободно - получение без ожидания
+    engine.connect().close()
+    for _ in range(3):
+        engine.connect().close()
+
+    held = engine.connect()
+    threading.Timer(0.05, held.close).start()
+    engine.connect().close()  # ждет, пока единственное соединение вернется в пул
+
+    stats = pool_stats(engine)
+    assert stats["checkouts"] == 6
+    assert stats["waits"] in (1, 2)  # первое открытие соединения тоже может занять > 1 мс
+    assert stats["wait_time_max_ms"] >= 40
+    engine.dispose()
@@ -0,0 +1,19 @@
+from aiogram import types
+from keyboards import create_calendar_keyboard
+
+def day_buttons(markup):
+    return {b.text.lstrip("✅"): b.callback_data for row in markup.inline_keyboard[2:-1] for b in row if b.text.strip()}
+
+def test_cached_template_overlays_active_days():
+    first = create_calendar_keyboard(2026, 2, {3, 14})
+    buttons = day_buttons(first)
+    assert len(buttons) == 28
+    assert buttons["14"] == "cal_day:2026:2:14" and buttons["15"] == "ignore_inactive_day"
+    assert first.inline_keyboard[-1][1].callback_data == "cal_nav:2026:3"
+
+    # Кнопка "Назад", добавленная хендлером, не попадает в следующие клавиатуры месяца
+    first.inline_keyboard.append([types.InlineKeyboardButton(text="◀️", callback_data="back_to_master")])
+    second = create_calendar_keyboard(2026, 2, {15})
+    assert day_buttons(second)["14"] == "ignore_inactive_day"
+    assert day_buttons(second)["15"] == "cal_day:2026:2:15"
+    assert len(second.inline_keyboard) == len(first.inline_keyboard) - 1
@@ -0,0 +1,59 @@
+import json
+import logging
+from logging.handlers import QueueHandler
+
+import log_config
+import tracing
+
+def test_json_record_carries_trace_id_and_extras():
+    log_config.setup_logging("test")
+    assert any(isinstance(h, QueueHandler) for h in logging.getLogger().handlers)
+    with tracing.trace("abc123"):
+        record = logging.getLogger("handlers.booking").makeRecord(
+            "handlers.booking", logging.INFO, __file__, 1, "Запись %s", (7,), None, extra={"salon_id": 3})
+    entry = json.loads(log_config.JsonFormatter("bot").format(record))
+    assert entry["message"] == "Запись 7" and entry["trace_id"] == "abc123"
+    assert entry["service"] == "bot" and entry["logger"] == "handlers.booking" and entry["salon_id"] == 3
+
+def test_per_module_levels():
+    assert log_config.parse_levels("httpx=warning, services.yandex_client=DEBUG,broken") == {
+        "httpx": "WARNING", "services.yandex_client": "DEBUG"}
+
+def test_payload_logging_is_sampled_and_truncated(monkeypatch, caplog):
+    logger = logging.getLogger("services.yandex_client")
+    payload = {"text": "x" * 5000}
+    monkeypatch.setattr(log_config, "LOG_PAYLOAD_MAX_CHARS", 100)
+
+    monkeypatch.setattr(log_config, "LOG_PAYLOAD_SAMPLE_RATE", 0.0)
+    with caplog.at_level(logging.DEBUG, logger="services.yandex_client"):
+        log_config.log_payload(logger, "Raw", payload)
+    assert not caplog.records
+
+    monkeypatch.setattr(log_config, "LOG_PAYLOAD_SAMPLE_RATE", 1.0)
+    with caplog.at_level(logging.INFO, logger="services.yandex_client"):
+        log_config.log_payload(logger, "Raw", payload)  # DEBUG выключен - не сериализуем
+    assert not caplog.records
+    with caplog.at_level(logging.DEBUG, logger="services.yandex_client"):
+        log_config.log_payload(logger, "Raw", payload)
+    message = caplog.records[0].getMessage()
+    assert message.startswith('Raw: {"text": "xxx') and message.endswith(f"... ({len(json.dumps(payload))} символов)")
+
+def test_payload_is_built_only_when_logged(monkeypatch, caplog):
+    from pydantic import BaseModel
+
+    class Request(BaseModel):
+        text: str
+
+    logger = logging.getLogger("api")
+    built = []
+    monkeypatch.setattr(log_config, "LOG_PAYLOAD_SAMPLE_RATE", 0.0)
+    with caplog.at_level(logging.DEBUG, logger="api"):
+        log_config.log_payload(logger, "Body", lambda: built.append(1) or {"a": 1})
+    assert not built
+
+    monkeypatch.setattr(log_config, "LOG_PAYLOAD_SAMPLE_RATE", 1.0)
+    with caplog.at_level(logging.DEBUG, logger="api"):
+        log_config.log_payload(logger, "Body", Request(text="маникюр"))
+        log_config.log_payload(logger, "Body", lambda: built.append(1) or {"a": 1})
+    assert built == [1]
+    assert [r.getMessage() for r in caplog.records] == ['Body: {"text": "маникюр"}', 'Body: {"a": 1}']
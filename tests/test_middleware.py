@@ -0,0 +1,68 @@
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+import pytest
+from middleware import UserSerialMiddleware
+
+def callback_update(user_id, data, message_id=10):
+    callback = SimpleNamespace(id=f"cb{user_id}{data}", data=data, message=SimpleNamespace(message_id=message_id))
+    return SimpleNamespace(callback_query=callback), {"event_from_user": SimpleNamespace(id=user_id),
+                                                       "bot": SimpleNamespace(id=1, answer_callback_query=AsyncMock())}
+
+@pytest.mark.asyncio
+async def test_double_tap_is_dropped():
+    middleware = UserSerialMiddleware(window=5)
+    calls = []
+
+    async def handler(event, data):
+        calls.append(event.callback_query.data)
+
+    for data in ("cal_day:2025:5:14", "cal_day:2025:5:14", "cal_day:2025:5:15"):
+        event, ctx = callback_update(1, data)
+        await middleware(handler, event, ctx)
+    # Другой пользователь с той же кнопкой не считается повтором
+    event, ctx = callback_update(2, "cal_day:2025:5:14")
+    await middleware(handler, event, ctx)
+    assert calls == ["cal_day:2025:5:14", "cal_day:2025:5:15", "cal_day:2025:5:14"]
+
+@pytest.mark.asyncio
+async def test_one_handler_per_user_at_a_time():
+    middleware = UserSerialMiddleware(window=0)
+    running = {1: 0, 2: 0}
+    peak = {1: 0, 2: 0}
+
+    async def handler(event, data):
+        user_id = data["event_from_user"].id
+        running[user_id] += 1
+        peak[user_id] = max(peak[user_id], running[user_id])
+        await asyncio.sleep(0.01)
+        running[user_id] -= 1
+
+    calls = []
+    for user_id in (1, 2):
+        for i in range(3):
+            event, ctx = callback_update(user_id, f"service_select:{i}")
+            calls.append(middleware(handler, event, ctx))
+    await asyncio.gather(*calls)
+    assert peak == {1: 1, 2: 1}
+    assert not middleware._locks
+
+@pytest.mark.asyncio
+async def test_update_and_handler_metrics():
+    from middleware import UpdateMetricsMiddleware, HandlerMetricsMiddleware, BOT_UPDATES, HANDLER_ERRORS
+    update = SimpleNamespace(event_type="callback_query")
+    before = BOT_UPDATES.value(salon_id=7, event="callback_query")
+
+    async def handler(event, data):
+        return "ok"
+
+    assert await UpdateMetricsMiddleware()(handler, update, {"salon_id": 7}) == "ok"
+    assert BOT_UPDATES.value(salon_id=7, event="callback_query") == before + 1
+
+    async def failing(event, data):
+        raise RuntimeError("boom")
+
+    errors = HANDLER_ERRORS.value(router="booking", event="SimpleNamespace")
+    with pytest.raises(RuntimeError):
+        await HandlerMetricsMiddleware("booking")(failing, update, {})
+    assert HANDLER_ERRORS.value(router="booking", event="SimpleNamespace") == errors + 1
@@ -0,0 +1,120 @@
+import multiprocessing
+import os
+import sys
+import time
+import pytest
+from config import BOT_WORKER_TTL
+from salon_events import SALONS_CHANNEL
+from sharding import HashRing, WorkerMembership, WORKERS_KEY
+
+def test_each_salon_has_one_owner_and_load_is_balanced():
+    ring = HashRing(["w-0", "w-1", "w-2", "w-3"])
+    assignment = ring.assign(range(1, 2001))
+    assert sorted(s for salons in assignment.values() for s in salons) == list(range(1, 2001))
+    assert set(assignment) == {"w-0", "w-1", "w-2", "w-3"}
+    assert all(300 < len(salons) < 700 for salons in assignment.values())
+
+def test_only_dead_workers_salons_move():
+    before = HashRing(["w-0", "w-1", "w-2", "w-3"])
+    after = HashRing(["w-0", "w-1", "w-3"])
+    for salon_id in range(1, 1001):
+        if before.owner(salon_id) != "w-2":
+            assert after.owner(salon_id) == before.owner(salon_id)
+        else:
+            assert after.owner(salon_id) != "w-2"
+
+class StubRedis:
+    """Sorted set и publish из redis.asyncio - то, что использует WorkerMembership"""
+
+    def __init__(self):
+        self.zsets, self.published = {}, []
+
+    async def zadd(self, key, mapping):
+        self.zsets.setdefault(key, {}).update(mapping)
+
+    async def zremrangebyscore(self, key, low, high):
+        zset = self.zsets.get(key, {})
+        for member in [m for m, score in zset.items() if score <= high]:
+            del zset[member]
+
+    async def zrangebyscore(self, key, low, high):
+        return [m.encode() for m, score in self.zsets.get(key, {}).items() if score >= low]
+
+    async def zrem(self, key, member):
+        self.zsets.get(key, {}).pop(member, None)
+
+    async def publish(self, channel, message):
+        self.published.append((channel, message))
+
+@pytest.mark.asyncio
+async def test_membership_join_leave_and_expiry():
+    redis = StubRedis()
+    a, b = WorkerMembership(redis, "w-a"), WorkerMembership(redis, "w-b")
+    assert not await a.heartbeat()          # один воркер - состав не изменился
+    assert all(a.owns(s) for s in range(1, 101))
+
+    # b вошел: a узнает об этом на ближайшей сверке (refresh), а не через BOT_WORKER_HEARTBEAT
+    await b.refresh()
+    assert b.workers == ["w-a", "w-b"] and redis.published == [(SALONS_CHANNEL, "workers:w-b")]
+    await a.refresh()
+    assert a.workers == ["w-a", "w-b"]
+    moved = [s for s in range(1, 101) if not a.owns(s)]
+    assert moved and all(b.owns(s) for s in moved)
+    assert all(a.owns(s) != b.owns(s) for s in range(1, 101))
+
+    # b штатно вышел - его салоны сразу возвращаются a
+    await b.leave()
+    await a.refresh()
+    assert a.workers == ["w-a"] and all(a.owns(s) for s in moved)
+
+    # b снова вошел и пропал без leave(): после BOT_WORKER_TTL без heartbeat он выбывает
+    await b.heartbeat()
+    await a.heartbeat()
+    assert a.workers == ["w-a", "w-b"]
+    redis.zsets[WORKERS_KEY]["w-b"] = time.time() - BOT_WORKER_TTL - 1
+    assert await a.heartbeat()
+    assert a.workers == ["w-a"] and all(a.owns(s) for s in range(1, 101))
+
+@pytest.mark.asyncio
+async def test_membership_keeps_last_ring_when_redis_fails():
+    redis = StubRedis()
+    a = WorkerMembership(redis, "w-a")
+    await WorkerMembership(redis, "w-b").heartbeat()
+    await a.heartbeat()
+
+    async def broken(*args):
+        raise ConnectionError("redis down")
+
+    redis.zadd = broken
+    assert not await a.heartbeat()
+    assert a.workers == ["w-a", "w-b"]
+
+def _flaky_worker(index):
+    with open(os.environ["SUPERVISE_LOG"], "a") as f:
+        f.write(f"{index}\n")
+    if index == 0:
+        sys.exit(1)
+    time.sleep(60)
+
+def _run_supervisor(log_path):
+    os.environ["SUPERVISE_LOG"] = log_path
+    import bot
+    bot.supervise(2, target=_flaky_worker, restart_delay=0.2, poll_interval=0.05)
+
+def test_supervisor_restarts_dead_workers_and_stops_on_sigterm(tmp_path):
+    log_path = str(tmp_path / "starts.log")
+    supervisor = multiprocessing.get_context("spawn").Process(target=_run_supervisor, args=(log_path,))
+    supervisor.start()
+    deadline = time.monotonic() + 20
+    starts = []
+    while time.monotonic() < deadline:
+        if os.path.exists(log_path):
+            starts = open(log_path).read().split()
+            if starts.count("0") >= 3 and "1" in starts:
+                break
+        time.sleep(0.1)
+    supervisor.terminate()
+    supervisor.join(10)
+    assert supervisor.exitcode == 0
+    assert starts.count("0") >= 3      # падающий воркер перезапускается
+    assert open(log_path).read().split().count("1") == 1  # живой - нет
@@ -0,0 +1,38 @@
+import logging
+from fastapi.testclient import TestClient
+
+import tracing
+from services.api_client import ApiClient
+from tests.test_api import basic_auth
+from config import SUPER_ADMIN_USERNAME, SUPER_ADMIN_PASSWORD
+
+def test_api_request_joins_bot_trace(client: TestClient, tmp_path, caplog):
+    path = str(tmp_path / "spans.jsonl")
+    tracing.configure("bot", path)
+    super_auth = basic_auth(SUPER_ADMIN_USERNAME, SUPER_ADMIN_PASSWORD)
+    client.post("/superadmin/salons", data={"name": "tr", "title": "TR", "token": "1:TR", "password": "admin"}, headers=super_auth)
+    caplog.clear()
+    try:
+        with tracing.trace() as trace_id, tracing.span("handler", router="booking") as handler:
+            headers = ApiClient("http://test")._headers("1:TR")
+            assert headers[tracing.TRACE_HEADER] == trace_id
+            # Тот же процесс играет роль API: его спан и лог получают trace_id бота
+            with caplog.at_level(logging.INFO):
+                response = client.get("/api/v1/services", headers=headers)
+            logging.info("после запроса")
+        assert response.headers[tracing.TRACE_HEADER] == trace_id
+        assert caplog.records and all(r.trace_id == trace_id for r in caplog.records)
+    finally:
+        tracing.configure("api", "")
+
+    spans = tracing.load_waterfall(path, trace_id)
+    assert [s["name"] for s in spans] == ["handler", "request"]
+    request = spans[1]
+    assert request["parent_id"] == handler.span_id
+    assert request["route"] == "/api/v1/services" and request["status"] == 200 and request["db_queries"] >= 1
+    assert "  bot:request method=GET route=/api/v1/services" in tracing.format_waterfall(spans)
+
+def test_api_mints_trace_id_and_rejects_garbage(client: TestClient):
+    response = client.get("/metrics", headers={tracing.TRACE_HEADER: "bad id\nINFO forged"})
+    trace_id = response.headers[tracing.TRACE_HEADER]
+    assert len(trace_id) == 32 and trace_id.isalnum()
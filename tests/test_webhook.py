@@ -0,0 +1,58 @@
+import httpx
+import pytest
+from aiogram import Dispatcher, Router, types
+from fastapi import FastAPI
+from fake_telegram import FakeTelegram
+from webhook import WebhookReceiver, secret_token
+
+def message_update(update_id, text):
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": 1700000000, "text": text,
+        "chat": {"id": 42, "type": "private"}, "from": {"id": 42, "is_bot": False, "first_name": "Анна"}}}
+
+@pytest.mark.asyncio
+async def test_updates_are_routed_to_salon_bot():
+    router = Router()
+
+    @router.message()
+    async def echo(message: types.Message):
+        await message.answer(f"эхо: {message.text}")
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    receiver = WebhookReceiver(dp, secret="s3cret")
+    # Приемник смонтирован в FastAPI, как в API
+    app = FastAPI()
+    app.mount("/telegram", receiver)
+
+    async with FakeTelegram() as telegram:
+        bots = {1: telegram.bot("111:AAA"), 2: telegram.bot("222:BBB")}
+        for salon_id, bot in bots.items():
+            await receiver.set_webhook(salon_id, bot, base_url="https://bot.example.ru", path="/telegram")
+        method, params = telegram.methods("111:AAA")[0]
+        assert method == "setWebhook"
+        assert params["url"] == "https://bot.example.ru/telegram/1"
+        assert params["secret_token"] == secret_token("111:AAA", "s3cret")
+
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+            headers = {"X-Telegram-Bot-Api-Secret-Token": secret_token("222:BBB", "s3cret")}
+            response = await http.post("/telegram/2", json=message_update(1, "привет"), headers=headers)
+            assert response.status_code == 200
+            await receiver.wait_pending()
+            # Секрет другого салона и неизвестный салон отклоняются
+            assert (await http.post("/telegram/1", json=message_update(2, "x"), headers=headers)).status_code == 403
+            assert (await http.post("/telegram/3", json=message_update(3, "x"), headers=headers)).status_code == 404
+
+        sent = [params for method, params in telegram.methods("222:BBB") if method == "sendMessage"]
+        assert [p["text"] for p in sent] == ["эхо: привет"]
+        assert not [m for m, _ in telegram.methods("111:AAA") if m == "sendMessage"]
+        for bot in bots.values():
+            await bot.session.close()
+
+def test_webhook_mode_requires_secret_and_base_url():
+    from webhook import check_config
+    check_config("s3cret", "https://bot.example.ru")
+    with pytest.raises(RuntimeError, match="WEBHOOK_SECRET"):
+        check_config("", "https://bot.example.ru")
+    with pytest.raises(RuntimeError, match="WEBHOOK_SECRET, WEBHOOK_BASE_URL"):
+        check_config("", "")
@@ -0,0 +1,204 @@
+# tracing.py - Сквозной идентификатор (correlation id) обновления Telegram и спаны по обе стороны.
+# Бот выдает trace_id на каждое обновление (SalonContextMiddleware), ApiClient передает его
+# в заголовке X-Correlation-ID, API подхватывает в middleware. trace_id попадает в каждую
+# строку лога, а спаны (бот -> Telegram / API -> БД) пишутся в JSONL (TRACE_EXPORT_PATH).
+# Водопад одного обновления: python tracing.py spans.jsonl <trace_id>
+import atexit
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from config import TRACE_EXPORT_PATH
+
+logger = logging.getLogger(__name__)
+
+TRACE_HEADER = "X-Correlation-ID"
+PARENT_HEADER = "X-Parent-Span-ID"
+
+current_trace_id: ContextVar[Optional[str]] = ContextVar("current_trace_id", default=None)
+current_span_id: ContextVar[Optional[str]] = ContextVar("current_span_id", default=None)
+
+
+def new_trace_id() -> str:
+    return secrets.token_hex(16)
+
+
+def _new_span_id() -> str:
+    return secrets.token_hex(8)
+
+
+def outgoing_headers() -> Dict[str, str]:
+    """Заголовки для запроса к API из текущего контекста"""
+    trace_id = current_trace_id.get()
+    if trace_id is None:
+        return {}
+    headers = {TRACE_HEADER: trace_id}
+    span_id = current_span_id.get()
+    if span_id is not None:
+        headers[PARENT_HEADER] = span_id
+    return headers
+
+
+class JsonlSpanExporter:
+    """Спаны построчно в JSONL. Пишет пачками одним write в файл с O_APPEND,
+    поэтому строки API и процессов ботов в общем файле не перемешиваются.
+    """
+
+    def __init__(self, path: str, batch_size: int = 64, max_delay: float = 1.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self._fd: Optional[int] = None
+        self._buffer: List[str] = []
+        self._flushed_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def export(self, span: dict):
+        line = json.dumps(span, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            self._buffer.append(line)
+            if len(self._buffer) < self.batch_size and time.monotonic() - self._flushed_at < self.max_delay:
+                return
+            lines, self._buffer = self._buffer, []
+            self._flushed_at = time.monotonic()
+            self._write(lines)
+
+    def flush(self):
+        with self._lock:
+            lines, self._buffer = self._buffer, []
+            self._write(lines)
+
+    def _write(self, lines: List[str]):
+        if not lines:
+            return
+        try:
+            if self._fd is None:
+                self._fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            os.write(self._fd, "".join(lines).encode())
+        except OSError as e:
+            logger.warning(f"Не удалось записать спаны в {self.path}: {e}")
+
+
+_exporter: Optional[JsonlSpanExporter] = None
+_service = "app"
+
+
+def configure(service: str, path: str = TRACE_EXPORT_PATH):
+    """Имя процесса в спанах (bot / api) и файл экспорта; пустой path - спаны не пишутся"""
+    global _exporter, _service
+    _service = service
+    if _exporter is not None:
+        _exporter.flush()
+    _exporter = JsonlSpanExporter(path) if path else None
+
+
+@atexit.register
+def _flush_on_exit():
+    if _exporter is not None:
+        _exporter.flush()
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "attributes")
+
+    def __init__(self, name: str, trace_id: Optional[str], parent_id: Optional[str], attributes: dict):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _new_span_id()
+        self.parent_id = parent_id
+        self.attributes = attributes
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+@contextmanager
+def span(name: str, parent_id: Optional[str] = None, **attributes):
+    """Интервал внутри текущего trace; вложенные спаны и запросы к API становятся его детьми"""
+    current = Span(name, current_trace_id.get(), parent_id or current_span_id.get(), attributes)
+    token = current_span_id.set(current.span_id)
+    started_at = time.time()
+    started = time.perf_counter()
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        current_span_id.reset(token)
+        if _exporter is not None and current.trace_id is not None:
+            record = {
+                "trace_id": current.trace_id, "span_id": current.span_id, "parent_id": current.parent_id,
+                "service": _service, "name": name, "start": started_at,
+                "duration_ms": round((time.perf_counter() - started) * 1000, 3), **current.attributes,
+            }
+            if error is not None:
+                record["error"] = error
+            _exporter.export(record)
+
+
+@contextmanager
+def trace(trace_id: Optional[str] = None):
+    """Делает trace_id текущим (новый, если не передан) на время блока"""
+    token = current_trace_id.set(trace_id or new_trace_id())
+    try:
+        yield current_trace_id.get()
+    finally:
+        current_trace_id.reset(token)
+
+
+def install_log_correlation():
+    """Добавляет %(trace_id)s в каждую запись лога ("-" вне обработки обновления/запроса)"""
+    factory = logging.getLogRecordFactory()
+    if getattr(factory, "adds_trace_id", False):
+        return
+
+    def record_factory(*args, **kwargs):
+        record = factory(*args, **kwargs)
+        record.trace_id = current_trace_id.get() or "-"
+        return record
+
+    record_factory.adds_trace_id = True
+    logging.setLogRecordFactory(record_factory)
+
+
+def load_waterfall(path: str, trace_id: str) -> List[dict]:
+    with open(path, encoding="utf-8") as f:
+        spans = [json.loads(line) for line in f if trace_id in line]
+    return sorted((s for s in spans if s["trace_id"] == trace_id), key=lambda s: s["start"])
+
+
+def format_waterfall(spans: List[dict]) -> str:
+    if not spans:
+        return "Спанов не найдено"
+    by_id = {s["span_id"]: s for s in spans}
+
+    def depth(s):
+        level = 0
+        while s.get("parent_id") in by_id and level < 32:
+            s, level = by_id[s["parent_id"]], level + 1
+        return level
+
+    origin = spans[0]["start"]
+    lines = []
+    for s in spans:
+        offset = (s["start"] - origin) * 1000
+        extra = {k: v for k, v in s.items() if k not in ("trace_id", "span_id", "parent_id", "service", "name", "start", "duration_ms")}
+        details = " ".join(f"{k}={v}" for k, v in extra.items())
+        lines.append(f"{offset:9.1f} мс {s['duration_ms']:9.1f} мс  {'  ' * depth(s)}{s['service']}:{s['name']} {details}".rstrip())
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) != 3:
+        sys.exit("Использование: python tracing.py <spans.jsonl> <trace_id>")
+    print(format_waterfall(load_waterfall(sys.argv[1], sys.argv[2])))
@@ -0,0 +1,142 @@
+# webhook.py - Прием обновлений Telegram вебхуками для всех ботов салонов.
+# Один ASGI-приемник обслуживает все токены: салону соответствует путь {WEBHOOK_PATH}/{salon_id},
+# подлинность запроса проверяется по заголовку X-Telegram-Bot-Api-Secret-Token.
+#
+# Отдельно (bot.py при BOT_MODE=webhook):  uvicorn слушает WEBHOOK_HOST:WEBHOOK_PORT
+# Внутри FastAPI:                          app.mount(WEBHOOK_PATH, receiver)
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+from typing import Dict, Optional, Set
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from config import WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_SECRET
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = b"x-telegram-bot-api-secret-token"
+
+
+def secret_token(bot_token: str, secret: str = WEBHOOK_SECRET) -> str:
+    """secret_token бота: HMAC от общего секрета, чтобы токен одного салона не подходил к другому"""
+    return hmac.new(secret.encode(), bot_token.encode(), hashlib.sha256).hexdigest()
+
+
+def check_config(secret: str = WEBHOOK_SECRET, base_url: str = WEBHOOK_BASE_URL):
+    """Без секрета secret_token всех ботов выводятся из пустого ключа, без адреса не пройдет ни один
+    setWebhook - в режиме вебхуков не запускаемся вовсе"""
+    missing = [name for name, value in (("WEBHOOK_SECRET", secret), ("WEBHOOK_BASE_URL", base_url)) if not value]
+    if missing:
+        raise RuntimeError(f"BOT_MODE=webhook: не заданы {', '.join(missing)}")
+
+
+def webhook_url(salon_id: int, base_url: str = WEBHOOK_BASE_URL, path: str = WEBHOOK_PATH) -> str:
+    return f"{base_url.rstrip('/')}{path}/{salon_id}"
+
+
+def _route_path(scope) -> str:
+    # При монтировании (app.mount) Starlette оставляет полный path и дописывает префикс в root_path
+    path, root = scope["path"], scope.get("root_path", "")
+    return path[len(root):] if root and path.startswith(root) else path
+
+
+class WebhookReceiver:
+    """ASGI-приложение: POST /{salon_id} -> dp.feed_update(бот салона, update).
+
+    Telegram получает 200 сразу, обработка идет в фоне - иначе медленный хендлер
+    (например, YandexGPT) задерживает доставку следующих обновлений этого бота.
+    """
+
+    def __init__(self, dp: Dispatcher, secret: str = WEBHOOK_SECRET):
+        self.dp = dp
+        self.secret = secret
+        self.bots: Dict[str, Bot] = {}            # salon_id (строкой, как в пути) -> бот
+        self._secrets: Dict[str, str] = {}
+        self._tasks: Dict[str, Set[asyncio.Task]] = {}  # salon_id -> обработка обновлений
+
+    def add_bot(self, salon_id: int, bot: Bot):
+        self.bots[str(salon_id)] = bot
+        self._secrets[str(salon_id)] = secret_token(bot.token, self.secret)
+
+    def remove_bot(self, salon_id: int) -> Optional[Bot]:
+        self._secrets.pop(str(salon_id), None)
+        return self.bots.pop(str(salon_id), None)
+
+    async def set_webhook(self, salon_id: int, bot: Bot, base_url: str = WEBHOOK_BASE_URL,
+                          path: str = WEBHOOK_PATH, drop_pending_updates: bool = False):
+        """Регистрирует бота в приемнике и сообщает Telegram адрес его вебхука"""
+        self.add_bot(salon_id, bot)
+        await bot.set_webhook(
+            url=webhook_url(salon_id, base_url, path),
+            secret_token=self._secrets[str(salon_id)],
+            allowed_updates=self.dp.resolve_used_update_types(),
+            drop_pending_updates=drop_pending_updates,
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            # При монтировании в FastAPI lifespan обрабатывает основное приложение
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await self.wait_pending()
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        if scope["type"] != "http":
+            return
+
+        status = await self._handle(scope, receive)
+        await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", b"text/plain")]})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def _handle(self, scope, receive) -> int:
+        if scope["method"] != "POST":
+            return 405
+        salon_id = _route_path(scope).strip("/")
+        bot = self.bots.get(salon_id)
+        if bot is None:
+            return 404
+        received = dict(scope["headers"]).get(SECRET_HEADER, b"").decode()
+        if not hmac.compare_digest(received, self._secrets[salon_id]):
+            logger.warning(f"Вебхук салона {salon_id}: неверный secret token")
+            return 403
+
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        try:
+            update = Update.model_validate(json.loads(body), context={"bot": bot})
+        except ValueError as e:
+            logger.error(f"Вебхук салона {salon_id}: некорректное обновление: {e}")
+            return 400
+
+        task = asyncio.create_task(self._feed(salon_id, bot, update))
+        tasks = self._tasks.setdefault(salon_id, set())
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        return 200
+
+    async def _feed(self, salon_id: str, bot: Bot, update: Update):
+        try:
+            await self.dp.feed_update(bot, update, salon_id=int(salon_id))
+        except Exception as e:
+            logger.error(f"Ошибка обработки обновления {update.update_id}: {e}", exc_info=True)
+
+    def pending(self, salon_id: int) -> Set[asyncio.Task]:
+        """Обновления салона, принятые, но еще не обработанные"""
+        return set(self._tasks.pop(str(salon_id), ()))
+
+    async def wait_pending(self):
+        """Дожидается обработки уже принятых обновлений (при остановке)"""
+        tasks = {task for salon_tasks in self._tasks.values() for task in salon_tasks}
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)